@@ -0,0 +1,114 @@
+import unittest, threading, time
+
+from tomato.lib import cache
+
+class ThreadUpdater:
+	"""
+	Refreshes stale values in a new thread instead of the scheduler.
+	"""
+	def __init__(self):
+		self.threads = []
+	def add(self, cache_):
+		pass
+	def refresh(self, cache_, args, kwargs):
+		thread = threading.Thread(target=cache_.refresh, args=(args, kwargs))
+		self.threads.append(thread)
+		thread.start()
+
+class CacheTest(unittest.TestCase):
+	def setUp(self):
+		self.updater = cache.cache_updater
+		cache.cache_updater = ThreadUpdater()
+		self.calls = 0
+		self.lock = threading.Lock()
+	def tearDown(self):
+		cache.cache_updater = self.updater
+	def _slow(self, value, delay=0.1, error=False):
+		with self.lock:
+			self.calls += 1
+			calls = self.calls
+		time.sleep(delay)
+		if error:
+			raise ValueError(value)
+		return (value, calls)
+	def _concurrently(self, fn, count=20):
+		results = []
+		def run():
+			try:
+				results.append(fn())
+			except Exception, exc:
+				results.append(exc)
+		threads = [threading.Thread(target=run) for _ in xrange(count)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return results
+	def testSingleFlight(self):
+		c = cache.Cache(self._slow, timeout=60)
+		results = self._concurrently(lambda: c.get(("a",), {}))
+		self.assertEquals(self.calls, 1)
+		self.assertEquals(results, [("a", 1)] * 20)
+		self.assertEquals(c.get(("a",), {}), ("a", 1))
+		info = c.info()
+		self.assertEquals(info["hits"] + info["misses"], 21)
+		self.assertEquals(info["waits"], info["misses"] - 1)
+		self.assertEquals(info["flights"], 0)
+	def testSingleFlightError(self):
+		c = cache.Cache(self._slow, timeout=60)
+		results = self._concurrently(lambda: c.get(("a",), {"error": True}), count=5)
+		self.assertEquals(self.calls, 1)
+		self.assertTrue(all(isinstance(res, ValueError) for res in results))
+		self.assertEquals(c.info()["errors"], 1)
+		# errors are not cached
+		self.assertFalse(c.contains(("a",), {"error": True}))
+		self.assertRaises(ValueError, c.get, ("a",), {"error": True})
+		self.assertEquals(self.calls, 2)
+	def testStale(self):
+		c = cache.Cache(lambda: self._slow("a", delay=0.2), timeout=0.1, staleTime=10.0)
+		self.assertEquals(c.get((), {}), ("a", 1))
+		time.sleep(0.15)
+		start = time.time()
+		results = self._concurrently(lambda: c.get((), {}))
+		self.assertTrue(time.time() - start < 0.15)
+		self.assertEquals(results, [("a", 1)] * 20)
+		self.assertEquals(c.info()["stale_hits"], 20)
+		self.assertEquals(len(cache.cache_updater.threads), 1)
+		cache.cache_updater.threads[0].join()
+		self.assertEquals(self.calls, 2)
+		self.assertEquals(c.get((), {}), ("a", 2))
+	def testExpired(self):
+		c = cache.Cache(self._slow, timeout=0.05)
+		self.assertEquals(c.get(("a",), {"delay": 0}), ("a", 1))
+		time.sleep(0.1)
+		self.assertEquals(c.get(("a",), {"delay": 0}), ("a", 2))
+		self.assertEquals(cache.cache_updater.threads, [])
+	def testEviction(self):
+		c = cache.Cache(maxSize=32)
+		self.assertEquals(len(c._stripes), 2)
+		for i in xrange(100):
+			c.set((i,), {}, i)
+		info = c.info()
+		self.assertEquals(info["size"], 32)
+		self.assertEquals(info["evictions"], 68)
+		# the least recently used key of the stripe is evicted
+		stripe = c._stripes[0]
+		keys = [i for i in xrange(1000, 2000) if c._stripe(cache.Cache.getKey((i,), {})) is stripe][:stripe.maxSize+1]
+		for i in keys[:-1]:
+			c.set((i,), {}, i)
+		c.get((keys[0],), {})
+		c.set((keys[-1],), {}, keys[-1])
+		self.assertTrue(c.contains((keys[0],), {}))
+		self.assertFalse(c.contains((keys[1],), {}))
+		self.assertTrue(c.contains((keys[-1],), {}))
+		self.assertEquals(len(stripe.entries), stripe.maxSize)
+	def testRemove(self):
+		c = cache.Cache(maxSize=10)
+		c.set(("a",), {}, 1)
+		c.remove(("a",), {})
+		self.assertFalse(c.contains(("a",), {}))
+		c.remove(("missing",), {})
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,116 @@
+import unittest, threading, time
+
+from tomato import executor
+from tomato.lib.error import UserError
+
+class ActionExecutorTest(unittest.TestCase):
+	def setUp(self):
+		self.lock = threading.Lock()
+		self.events = []
+		self.running = {}
+		self.maxRunning = {}
+	def _step(self, name, key=None, delay=0.05, error=None, wait=None):
+		def run():
+			with self.lock:
+				self.events.append(("start", name))
+				self.running[key] = self.running.get(key, 0) + 1
+				self.maxRunning[key] = max(self.maxRunning.get(key, 0), self.running[key])
+			if wait:
+				wait.wait(5.0)
+			time.sleep(delay)
+			with self.lock:
+				self.running[key] -= 1
+				self.events.append(("end", name))
+			if error:
+				raise error
+		return run
+	def _add(self, ex, name, key=None, deps=(), **kwargs):
+		ex.add(name, self._step(name, key, **kwargs), key=key, deps=deps)
+	def testOrder(self):
+		ex = executor.ActionExecutor("order", "start", maxWorkers=4)
+		self._add(ex, "c", deps=["b"])
+		self._add(ex, "b", deps=["a"])
+		self._add(ex, "a")
+		self._add(ex, "d")
+		ex.run()
+		self.assertTrue(self.events.index(("end", "a")) < self.events.index(("start", "b")))
+		self.assertTrue(self.events.index(("end", "b")) < self.events.index(("start", "c")))
+		# independent steps run in parallel
+		self.assertTrue(self.events.index(("start", "d")) < self.events.index(("end", "a")))
+		self.assertEquals(ex.failed, [])
+	def testFailed(self):
+		ex = executor.ActionExecutor("failed", "start", maxWorkers=4)
+		self._add(ex, "a", error=UserError(code=UserError.INVALID_STATE, message="failed"))
+		self._add(ex, "b", deps=["a"])
+		self._add(ex, "c", deps=["b"])
+		self._add(ex, "d", error=ValueError("broken"))
+		self._add(ex, "e")
+		ex.run()
+		info = ex.info()
+		self.assertEquals(info["steps"], {"a": "failed", "b": "skipped", "c": "skipped", "d": "failed", "e": "done"})
+		self.assertEquals(info["errors"]["a"], {"type": "user", "code": UserError.INVALID_STATE, "message": "failed"})
+		self.assertEquals(info["errors"]["d"], {"type": "ValueError", "message": "broken"})
+		self.assertEquals([step.id for step in ex.failed], ["a", "d"])
+		self.assertFalse(("start", "b") in self.events)
+	def testKeyLimit(self):
+		ex = executor.ActionExecutor("limit", "start", maxWorkers=8, keyLimit=2)
+		for i in xrange(6):
+			self._add(ex, "h1-%d" % i, key="h1")
+		for i in xrange(3):
+			self._add(ex, "h2-%d" % i, key="h2")
+		ex.run()
+		self.assertEquals(self.maxRunning, {"h1": 2, "h2": 2})
+		self.assertEquals(ex.info()["done"], 9)
+	def testSharedKeyLimit(self):
+		# the limit holds for all executors together
+		executors = [executor.ActionExecutor("shared%d" % i, "start", maxWorkers=4, keyLimit=2) for i in xrange(3)]
+		for i, ex in enumerate(executors):
+			for j in xrange(4):
+				self._add(ex, "%d-%d" % (i, j), key="h1")
+		threads = [threading.Thread(target=ex.run) for ex in executors]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEquals(self.maxRunning, {"h1": 2})
+		self.assertEquals(sum(ex.info()["done"] for ex in executors), 12)
+		self.assertEquals(executor._slots.keys, {})
+	def testTotalLimit(self):
+		ex = executor.ActionExecutor("total", "start", maxWorkers=8, totalLimit=3)
+		for i in xrange(8):
+			self._add(ex, "h%d" % i, key="h%d" % i)
+		ex.run()
+		self.assertTrue(max(self.events.index(("end", "h%d" % i)) for i in xrange(3)) < self.events.index(("start", "h7")))
+		self.assertEquals(executor._slots.total, 0)
+	def testCycle(self):
+		ex = executor.ActionExecutor("cycle", "start", maxWorkers=4)
+		self._add(ex, "a", deps=["b"])
+		self._add(ex, "b", deps=["a"])
+		self._add(ex, "c")
+		ex.run()
+		self.assertEquals(ex.info()["steps"], {"a": "skipped", "b": "skipped", "c": "done"})
+	def testProgress(self):
+		release = threading.Event()
+		ex = executor.ActionExecutor("progress", "stop", maxWorkers=2)
+		self._add(ex, "a", wait=release)
+		self._add(ex, "b", deps=["a"])
+		self._add(ex, "c", error=ValueError("broken"), delay=0)
+		self._add(ex, "d", deps=["c"])
+		thread = threading.Thread(target=ex.run)
+		thread.start()
+		for _ in xrange(100):
+			info = executor.progress("progress")
+			if info and info["failed"]:
+				break
+			time.sleep(0.01)
+		self.assertEquals((info["action"], info["total"], info["running"], info["pending"], info["failed"], info["skipped"], info["done"]),
+						  ("stop", 4, 1, 1, 1, 1, 0))
+		release.set()
+		thread.join()
+		info = ex.info()
+		self.assertEquals((info["done"], info["failed"], info["skipped"], info["pending"], info["running"]), (2, 1, 1, 0, 0))
+		self.assertEquals(executor.progress("progress"), None)
+
+
+if __name__ == '__main__':
+	unittest.main()
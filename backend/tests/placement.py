@@ -0,0 +1,103 @@
+import unittest
+
+from tomato import placement
+
+class Element:
+	def __init__(self, id_, parent=None, site=None, type_="openvz"):
+		self.idStr = id_
+		self.parentId = parent
+		self.site = site
+		self.TYPE = type_
+		self.CAP_CHILDREN = {}
+	def getFieldId(self, field):
+		assert field == "site"
+		return self.site
+
+class Connection:
+	def __init__(self, elFrom, elTo):
+		self.elementFromId = elFrom
+		self.elementToId = elTo
+
+class Snapshot:
+	"""
+	Hosts with equal load, every element that is planned for a host costs
+	elementCost points.
+	"""
+	def __init__(self, sites, elementCost=0.0):
+		self.sites = sites
+		self.ids = ["host%d" % i for i in xrange(len(sites))]
+		self.elementCost = elementCost
+		self.requests = []
+	def candidates(self, siteId=None, elementTypes=()):
+		self.requests.append(elementTypes[0])
+		return [i for i, site in enumerate(self.sites) if siteId is None or site == siteId]
+	def scores(self, candidates, extraElements=None):
+		return [-self.elementCost * (extraElements or {}).get(i, 0) for i in candidates]
+
+def vms(*ids, **kwargs):
+	return dict((id_, Element(id_, **kwargs)) for id_ in ids)
+
+class LinkGraphTest(unittest.TestCase):
+	def testDirect(self):
+		# interfaces are linked with their VM
+		elements = vms("a", "b").values() + [Element("a1", "a"), Element("b1", "b")]
+		graph = placement._linkGraph(elements, [Connection("a1", "b1")], vms("a", "b"))
+		self.assertEquals(graph, {"a": {"b": 1.0}, "b": {"a": 1.0}})
+	def testSwitch(self):
+		# the weight of a switch is split over all pairs of its elements
+		elements = vms("a", "b", "c").values() + [Element("s", type_="tinc_vpn")]
+		for id_ in "abc":
+			elements += [Element(id_ + "1", id_), Element("s" + id_, "s", type_="tinc_endpoint")]
+		connections = [Connection(id_ + "1", "s" + id_) for id_ in "abc"]
+		graph = placement._linkGraph(elements, connections, vms("a", "b", "c"))
+		self.assertEquals(graph["a"], {"b": 0.5, "c": 0.5})
+		self.assertEquals(graph["b"], {"a": 0.5, "c": 0.5})
+
+class PlaceTest(unittest.TestCase):
+	def testLinkedSameHost(self):
+		graph = {"a": {"b": 1.0}, "b": {"a": 1.0}}
+		positions, scores, unplaced = placement._place(vms("a", "b"), graph, Snapshot(["x", "x"]), {})
+		self.assertEquals(positions["a"], positions["b"])
+		self.assertEquals(unplaced, [])
+		self.assertEquals(sorted(scores.keys()), ["a", "b"])
+	def testLinkedFullHost(self):
+		# the link does not outweigh the cost of a second element on a host
+		graph = {"a": {"b": 1.0}, "b": {"a": 1.0}}
+		positions, _, _ = placement._place(vms("a", "b"), graph, Snapshot(["x", "x"], elementCost=30.0), {})
+		self.assertNotEquals(positions["a"], positions["b"])
+	def testPlannedOnce(self):
+		# planned elements are only penalised by the snapshot, so the link
+		# to the same host outweighs an element cost of 8 points
+		graph = {"a": {"b": 1.0}, "b": {"a": 1.0}}
+		positions, scores, _ = placement._place(vms("a", "b"), graph, Snapshot(["x", "x"], elementCost=8.0), {})
+		self.assertEquals(positions["a"], positions["b"])
+		self.assertEquals(scores["b"], placement.SAME_HOST_LINK - 8.0)
+	def testOtherSite(self):
+		# linked elements prefer hosts of the same site
+		graph = {"a": {"b": 1.0}, "b": {"a": 1.0}}
+		positions, _, _ = placement._place(vms("a", "b"), graph, Snapshot(["x", "y", "x"], elementCost=30.0), {})
+		self.assertEquals(sorted([positions["a"], positions["b"]]), [0, 2])
+	def testUnplaced(self):
+		elements = vms("a", "b")
+		elements.update(vms("c", site="nowhere"))
+		graph = {"a": {}, "b": {}, "c": {}}
+		positions, scores, unplaced = placement._place(elements, graph, Snapshot(["x"]), {})
+		self.assertEquals(unplaced, ["c"])
+		self.assertEquals(sorted(positions.keys()), ["a", "b"])
+		self.assertFalse("c" in scores)
+	def testOrder(self):
+		# the most linked element first, then the elements linked to it
+		elements = {
+			"z": Element("z", type_="z"),
+			"y": Element("y", type_="y"),
+			"x": Element("x", type_="x"),
+			"h": Element("h", type_="h")
+		}
+		graph = {"h": {"x": 1.0, "y": 1.0}, "x": {"h": 1.0}, "y": {"h": 1.0}, "z": {}}
+		snapshot = Snapshot(["x"])
+		placement._place(elements, graph, snapshot, {})
+		self.assertEquals(snapshot.requests, ["h", "x", "y", "z"])
+
+
+if __name__ == '__main__':
+	unittest.main()
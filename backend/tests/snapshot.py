@@ -0,0 +1,188 @@
+import unittest, sys
+
+from tomato import config
+from tomato.host.snapshot import HostSnapshot
+
+# the host package replaces the module attribute with its snapshot instance
+snapshotModule = sys.modules[HostSnapshot.__module__]
+
+class Clock:
+	def __init__(self):
+		self.now = 1e9
+	def time(self):
+		return self.now
+
+clock = Clock()
+
+class Count:
+	def __init__(self, count):
+		self.num = count
+	def count(self):
+		return self.num
+
+class Network:
+	def __init__(self, kind):
+		self.kind = kind
+	def getKind(self):
+		return self.kind
+
+class Networks:
+	def __init__(self, kinds):
+		self.kinds = kinds
+	def all(self):
+		return [Network(kind) for kind in self.kinds]
+
+class Host:
+	"""
+	Has the attributes of a host that the old host.select() used.
+	"""
+	def __init__(self, id_, site, load=0.0, errors=0, elements=0, connections=0, elementTypes=("openvz", "kvmqm"),
+				 connectionTypes=("bridge",), networkKinds=("internet",), problems=()):
+		self.id = id_
+		self.name = "host%d" % id_
+		self.site = site
+		self.load = load
+		self.componentErrors = errors
+		self.elements = Count(elements)
+		self.connections = Count(connections)
+		self.elementTypes = dict((t, {}) for t in elementTypes)
+		self.connectionTypes = dict((t, {}) for t in connectionTypes)
+		self.networks = Networks(list(networkKinds))
+		self.fixedProblems = list(problems)
+		self.hostInfoTimestamp = clock.now
+		self.lastResourcesSync = clock.now
+	def getFieldId(self, field):
+		assert field == "site"
+		return self.site
+	def getLoad(self):
+		return self.load
+	def getNetworkKinds(self):
+		nets = [net.getKind() for net in self.networks.all()]
+		for net in list(nets):
+			if "/" in net:
+				nets.append(net.split("/", 1)[0])
+		if nets:
+			nets.append(None)
+		return nets
+	def problems(self):
+		# the time and error checks of Host.problems()
+		problems = list(self.fixedProblems)
+		if clock.time() - self.hostInfoTimestamp > 2 * config.HOST_UPDATE_INTERVAL + 300:
+			problems.append("Host unreachable")
+		if clock.time() - self.lastResourcesSync > 2 * config.RESOURCES_SYNC_INTERVAL + 300:
+			problems.append("Host is not synchronized")
+		if self.componentErrors > 2:
+			problems.append("Multiple component errors")
+		return problems
+
+def oldSelect(hosts, site=None, elementTypes=(), connectionTypes=(), networkKinds=(), hostPrefs=None, sitePrefs=None):
+	"""
+	The scoring of host.select() before the snapshot, returns the scores by
+	host name.
+	"""
+	hostPrefs, sitePrefs = hostPrefs or {}, sitePrefs or {}
+	hosts = [h for h in hosts if (site is None or h.site == site) and not h.problems()
+			 and not set(elementTypes) - set(h.elementTypes.keys())
+			 and not set(connectionTypes) - set(h.connectionTypes.keys())
+			 and not set(networkKinds) - set(h.getNetworkKinds())]
+	if not hosts:
+		return {}
+	prefs = dict([(h, 0.0) for h in hosts])
+	els = 0.0
+	cons = 0.0
+	for h in hosts:
+		prefs[h] -= h.componentErrors * 25
+		prefs[h] -= h.getLoad() * 100
+		els += h.elements.count()
+		cons += h.connections.count()
+	avgEls = els / len(hosts)
+	avgCons = cons / len(hosts)
+	for h in hosts:
+		if avgEls:
+			prefs[h] -= max(-20.0, min(10.0 * (h.elements.count() - avgEls) / avgEls, 20.0))
+		if avgCons:
+			prefs[h] -= max(-10.0, min(10.0 * (h.connections.count() - avgCons) / avgCons, 10.0))
+	for h in hosts:
+		if h.id in hostPrefs:
+			prefs[h] += hostPrefs[h.id]
+		if h.site in sitePrefs:
+			prefs[h] += sitePrefs[h.site]
+	return dict((h.name, score) for h, score in prefs.iteritems())
+
+class Site:
+	def __init__(self, id_):
+		self.id = id_
+
+class HostSnapshotTest(unittest.TestCase):
+	def setUp(self):
+		self.time, self.starttime = snapshotModule.time, snapshotModule.starttime
+		snapshotModule.time = clock
+		snapshotModule.starttime = 0
+		self.hosts = [
+			Host(1, "a", load=0.1, elements=10, connections=4),
+			Host(2, "a", load=0.5, errors=1, elements=2, connections=0),
+			Host(3, "b", load=0.2, errors=2, elements=30, connections=12, networkKinds=("internet/test",)),
+			Host(4, "b", load=0.9, elements=0, connections=1, elementTypes=("openvz",)),
+			Host(5, "b", load=0.0, errors=3),
+			Host(6, "c", problems=["Manually disabled"]),
+		]
+		self.snapshot = HostSnapshot(maxAge=3600)
+		self.load()
+	def tearDown(self):
+		snapshotModule.time, snapshotModule.starttime = self.time, self.starttime
+	def load(self):
+		self.snapshot.load(self.hosts, dict((h.id, h.elements.count()) for h in self.hosts),
+						   dict((h.id, h.connections.count()) for h in self.hosts),
+						   dict((h.id, h.networks.kinds) for h in self.hosts))
+	def assertSameSelection(self, site=None, **kwargs):
+		expected = oldSelect(self.hosts, site.id if site else None, **kwargs)
+		hostId, scores = self.snapshot.select(site, **kwargs)
+		self.assertEquals(sorted(scores.keys()), sorted(expected.keys()))
+		for name, score in expected.iteritems():
+			self.assertAlmostEqual(scores[name], score)
+		if expected:
+			self.assertEquals("host%d" % hostId, max(expected, key=expected.get))
+		else:
+			self.assertEquals(hostId, None)
+	def testScores(self):
+		self.assertSameSelection()
+		self.assertSameSelection(elementTypes=["kvmqm"])
+		self.assertSameSelection(connectionTypes=["bridge"], networkKinds=["internet"])
+		self.assertSameSelection(networkKinds=["internet/test"])
+		self.assertSameSelection(site=Site("b"))
+		self.assertSameSelection(site=Site("c"))
+		self.assertSameSelection(hostPrefs={2: 100.0}, sitePrefs={"b": 10.0})
+	def testErrors(self):
+		# host 5 has too many errors, host 1 gets them after the snapshot was built
+		self.assertTrue("host5" not in self.snapshot.select()[1])
+		self.hosts[0].componentErrors += 3
+		self.snapshot.adjust(self.hosts[0], errors=3)
+		self.assertTrue("host1" not in self.snapshot.select()[1])
+		self.assertSameSelection()
+	def testStale(self):
+		# no sync for a while, only the hosts that have been updated remain
+		clock.now += 2 * max(config.HOST_UPDATE_INTERVAL, config.RESOURCES_SYNC_INTERVAL) + 301
+		for host in self.hosts[1:3]:
+			host.hostInfoTimestamp = host.lastResourcesSync = clock.now
+			self.snapshot.updateHost(host)
+		self.assertEquals(sorted(self.snapshot.select()[1].keys()), ["host2", "host3"])
+		self.assertSameSelection()
+	def testAdjust(self):
+		host = self.hosts[1]
+		self.snapshot.adjust(host, elements=3, connections=2)
+		self.snapshot.adjust(host, elements=-1)
+		host.elements.num += 2
+		host.connections.num += 2
+		adjusted = self.snapshot.select()[1]
+		self.snapshot.updateHost(host)
+		self.assertEquals(self.snapshot.select()[1], adjusted)
+		self.assertSameSelection()
+		self.snapshot.adjust(host, elements=-100, connections=-100)
+		i = self.snapshot.index[host.id]
+		self.assertEquals((self.snapshot.elements[i], self.snapshot.connections[i]), (0, 0))
+		self.snapshot.adjust(Host(99, "a"), elements=1)
+		self.assertEquals(self.snapshot.info()["elements"], sum(h.elements.count() for h in self.hosts) - host.elements.count())
+
+
+if __name__ == '__main__':
+	unittest.main()
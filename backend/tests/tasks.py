@@ -0,0 +1,87 @@
+import unittest, threading, time
+
+from tomato.lib import tasks
+
+class TaskSchedulerTest(unittest.TestCase):
+	def setUp(self):
+		self.scheduler = tasks.TaskScheduler(minWorkers=2, maxWorkers=4)
+		self.results = []
+		self.lock = threading.Lock()
+	def tearDown(self):
+		if self.scheduler.isAlive():
+			self.scheduler.stop()
+	def _record(self, value):
+		with self.lock:
+			self.results.append(value)
+	def testOnce(self):
+		for i in xrange(100):
+			self.scheduler.scheduleOnce(0.01 * (i % 5), self._record, i)
+		self.scheduler.start()
+		time.sleep(0.5)
+		self.assertEquals(sorted(self.results), range(100))
+		self.assertEquals(self.scheduler.tasks, {})
+	def testRepeated(self):
+		self.scheduler.scheduleRepeated(0.05, self._record, "repeated")
+		self.scheduler.start()
+		time.sleep(0.3)
+		self.assertTrue(self.results.count("repeated") >= 3)
+		self.assertEquals(len(self.scheduler.tasks), 1)
+	def testCancel(self):
+		taskId = self.scheduler.scheduleOnce(0.1, self._record, "canceled")
+		self.scheduler.cancelTask(taskId)
+		self.scheduler.start()
+		time.sleep(0.3)
+		self.assertEquals(self.results, [])
+	def testForce(self):
+		taskId = self.scheduler.scheduleRepeated(3600, self._record, "forced", immediate=False)
+		self.assertFalse(self.scheduler.executeTask(taskId))
+		self.assertTrue(self.scheduler.executeTask(taskId, force=True))
+		self.assertEquals(self.results, ["forced"])
+		self.assertEquals(self.scheduler._nextTask()[0], taskId)
+	def testPriority(self):
+		self.scheduler.addCategory("high", priority=10)
+		self.scheduler.scheduleOnce(0, self._record, "low")
+		self.scheduler.scheduleOnce(0, self._record, "high", category="high")
+		self.assertEquals(self.scheduler._nextTask()[1].category, "high")
+	def testMaxWorkers(self):
+		self.scheduler.addCategory("limited", maxWorkers=1)
+		def slow(value):
+			time.sleep(0.2)
+			self._record(value)
+		for i in xrange(3):
+			self.scheduler.scheduleOnce(0, slow, i, category="limited")
+		self.scheduler.start()
+		time.sleep(0.3)
+		self.assertEquals(len(self.results), 1)
+		self.assertTrue(self.scheduler.info()["categories"]["limited"]["busy"] <= 1)
+	def testCoalesce(self):
+		self.scheduler.addCategory("bulk", coalesce=True)
+		first = self.scheduler.scheduleOnce(0.1, self._record, "bulk", category="bulk")
+		self.assertEquals(self.scheduler.scheduleOnce(0.1, self._record, "bulk", category="bulk"), first)
+		self.scheduler.start()
+		time.sleep(0.3)
+		self.assertEquals(self.results, ["bulk"])
+		self.assertEquals(self.scheduler.info()["categories"]["bulk"]["coalesced"], 1)
+	def testSkipLate(self):
+		self.scheduler.addCategory("skipping", maxLate=0.0)
+		taskId = self.scheduler.scheduleRepeated(0.05, self._record, "late", category="skipping")
+		self.scheduler.tasks[taskId].next -= 1.0
+		self.scheduler._popTask()
+		self.assertEquals(self.scheduler.info()["categories"]["skipping"]["skipped"], 1)
+		self.assertEquals(self.results, [])
+	def testMetrics(self):
+		def failing():
+			raise Exception("failed")
+		taskId = self.scheduler.scheduleRepeated(3600, failing, immediate=False)
+		self.scheduler.executeTask(taskId, force=True)
+		metrics = self.scheduler.metrics()[str(taskId)]
+		self.assertEquals(metrics["runs"], 1)
+		self.assertEquals(metrics["errors"], 1)
+		self.assertEquals(metrics["latency"]["count"], 1)
+		text = self.scheduler.metricsText()
+		self.assertTrue('tomato_task_errors_total{method="%s.failing",category="default"} 1' % __name__ in text)
+		self.assertTrue('le="+Inf"} 1' in text)
+
+
+if __name__ == '__main__':
+	unittest.main()
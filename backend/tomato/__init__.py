@@ -63,6 +63,16 @@ def currentUser():
 	
 def setCurrentUser(user):
 	_currentUser.user = user
+	_currentUser.cache = {}
+
+def requestCache():
+	"""
+	Returns a dict to cache values during the current request. The dict is
+	cleared whenever the current user is set, i.e. on every login.
+	"""
+	if not hasattr(_currentUser, "cache"):
+		_currentUser.cache = {}
+	return _currentUser.cache
 
 def login(credentials, sslCert):
 	user = auth.login(*credentials) if credentials else None
@@ -76,6 +86,8 @@ def handleError():
 
 from lib import tasks #@UnresolvedImport
 scheduler = tasks.TaskScheduler(maxLateTime=30.0, minWorkers=5, maxWorkers=25)
+for name, options in config.TASK_CATEGORIES.items():
+	scheduler.addCategory(name, **options)
 
 starttime = time.time()
 
@@ -83,7 +95,7 @@ from . import host, auth, rpcserver #@UnresolvedImport
 from lib.cmd import bittorrent, process #@UnresolvedImport
 from lib import util, cache #@UnresolvedImport
 
-scheduler.scheduleRepeated(config.BITTORRENT_RESTART, util.wrap_task(bittorrent.restartClient))
+scheduler.scheduleRepeated(config.BITTORRENT_RESTART, util.wrap_task(bittorrent.restartClient), category="maintenance")
 
 stopped = threading.Event()
 
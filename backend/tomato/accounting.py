@@ -19,7 +19,7 @@ from .db import *
 
 from lib.decorators import *
 from datetime import datetime, timedelta
-import time
+import time, threading
 from . import scheduler
 
 #TODO: aggregate per user
@@ -91,18 +91,18 @@ def _prevPoint(point, type_):
 def _toTime(point):
 	return util.utcDatetimeToTimestamp(point)
 
-def _combine(records):
+def _combine(records, begin, end):
 	#calculate coverage
 	measurements = sum([r.measurements for r in records])
 	#combine attributes
-	combined = Usage()
+	combined = UsageRecord(begin=begin, end=end, measurements=measurements)
 	if not measurements:
-		return (combined, 0)
-	combined.cputime = _sum([(r.usage.cputime, r.measurements) for r in records], measurements)
-	combined.diskspace = _avg([(r.usage.diskspace, r.measurements) for r in records], measurements)
-	combined.memory = _avg([(r.usage.memory, r.measurements) for r in records], measurements)
-	combined.traffic = _sum([(r.usage.traffic, r.measurements) for r in records], measurements)
-	return (combined, measurements)
+		return combined
+	combined.cputime = _sum([(r.cputime, r.measurements) for r in records], measurements)
+	combined.diskspace = _avg([(r.diskspace, r.measurements) for r in records], measurements)
+	combined.memory = _avg([(r.memory, r.measurements) for r in records], measurements)
+	combined.traffic = _sum([(r.traffic, r.measurements) for r in records], measurements)
+	return combined
 
 class Usage(EmbeddedDocument):
 	memory = FloatField(default=0.0, db_field="m") #unit: bytes
@@ -124,51 +124,106 @@ class Usage(EmbeddedDocument):
 			"traffic": self.traffic
 		}
 
-class UsageRecord(EmbeddedDocument):
-	begin = FloatField(required=True, db_field="b")
-	end = FloatField(required=True, db_field="e")
-	measurements = IntField(default=0, db_field="m")
-	usage = EmbeddedDocumentField(Usage, required=True, db_field="u")
-	meta = {
-		'collection': 'usage_record',
-		'ordering': ['type', 'end'],
-		'indexes': [
-			('type', 'end')
-		]
-	}
+class UsageRecord(object):
+	"""
+	A single usage record, unpacked from a UsageSeries.
+	"""
+	__slots__ = ("begin", "end", "measurements", "cputime", "memory", "diskspace", "traffic")
 
-	def init(self, begin, end, measurements, usage): #@ReservedAssignment
+	def __init__(self, begin, end, measurements=0, cputime=0.0, memory=0.0, diskspace=0.0, traffic=0.0):
 		self.begin = begin
 		self.end = end
 		self.measurements = measurements
-		self.usage = usage
+		self.cputime = cputime
+		self.memory = memory
+		self.diskspace = diskspace
+		self.traffic = traffic
+
+	def usageInfo(self):
+		return {
+			"cputime": self.cputime,
+			"diskspace": self.diskspace,
+			"memory": self.memory,
+			"traffic": self.traffic
+		}
 
 	def info(self):
 		return {
 			"begin": self.begin,
 			"end": self.end,
 			"measurements": self.measurements,
-			"usage": self.usage.info()
+			"usage": self.usageInfo()
 		}
 
 
+class UsageSeries(EmbeddedDocument):
+	"""
+	All records of one type, stored as parallel arrays (one entry per record).
+	"""
+	begin = ListField(FloatField(), db_field="b")
+	end = ListField(FloatField(), db_field="e")
+	measurements = ListField(IntField(), db_field="n")
+	cputime = ListField(FloatField(), db_field="c")
+	memory = ListField(FloatField(), db_field="m")
+	diskspace = ListField(FloatField(), db_field="d")
+	traffic = ListField(FloatField(), db_field="t")
+
+	COLUMNS = [("begin", "b"), ("end", "e"), ("measurements", "n"), ("cputime", "c"), ("memory", "m"),
+		("diskspace", "d"), ("traffic", "t")]
+
+	def __len__(self):
+		return len(self.end)
+
+	@property
+	def lastEnd(self):
+		return self.end[-1] if self.end else None
+
+	def records(self):
+		return [UsageRecord(*values) for values in zip(*[getattr(self, attr) for attr, _ in self.COLUMNS])]
+
+	@classmethod
+	def columns(cls, records):
+		"""
+		Packs the records into a dict of arrays keyed by database field names.
+		"""
+		return dict((dbField, [getattr(rec, attr) for rec in records]) for attr, dbField in cls.COLUMNS)
+
+	@classmethod
+	def fromRecords(cls, records):
+		return cls(**dict((attr, [getattr(rec, attr) for rec in records]) for attr, _ in cls.COLUMNS))
+
+
+RECORD_COLUMNS = [attr for attr, _ in UsageSeries.COLUMNS]
+
+
 class UsageStatistics(BaseDocument):
 	"""
-	:type by5minutes: list of UsageRecord
-	:type byHour: list of UsageRecord
-	:type byDay: list of UsageRecord
-	:type byMonth: list of UsageRecord
-	:type byYear: list of UsageRecord
+	Stores the usage records of an object as one UsageSeries per type.
+	Records are appended in place using $push/$slice so that each series
+	acts as a ring buffer of at most KEEP_RECORDS entries.
+	:type by5minutes: UsageSeries
+	:type byHour: UsageSeries
+	:type byDay: UsageSeries
+	:type byMonth: UsageSeries
+	:type byYear: UsageSeries
 	"""
-	by5minutes = ListField(EmbeddedDocumentField(UsageRecord), db_field='5minutes')
-	byHour = ListField(EmbeddedDocumentField(UsageRecord), db_field='hour')
-	byDay = ListField(EmbeddedDocumentField(UsageRecord), db_field='day')
-	byMonth = ListField(EmbeddedDocumentField(UsageRecord), db_field='month')
-	byYear = ListField(EmbeddedDocumentField(UsageRecord), db_field='year')
+	by5minutes = EmbeddedDocumentField(UsageSeries, db_field='5minutes', default=UsageSeries)
+	byHour = EmbeddedDocumentField(UsageSeries, db_field='hour', default=UsageSeries)
+	byDay = EmbeddedDocumentField(UsageSeries, db_field='day', default=UsageSeries)
+	byMonth = EmbeddedDocumentField(UsageSeries, db_field='month', default=UsageSeries)
+	byYear = EmbeddedDocumentField(UsageSeries, db_field='year', default=UsageSeries)
 	meta = {
 		'collection': 'usage_statistics',
 	}
 
+	FIELDS = {
+		"5minutes": "by5minutes",
+		"hour": "byHour",
+		"day": "byDay",
+		"month": "byMonth",
+		"year": "byYear"
+	}
+
 	def init(self):
 		self.save()
 
@@ -177,51 +232,73 @@ class UsageStatistics(BaseDocument):
 			self.delete()
 
 	def info(self):
-		return {
-			"5minutes": [rec.info() for rec in self.by5minutes],
-			"hour": [rec.info() for rec in self.byHour],
-			"day": [rec.info() for rec in self.byDay],
-			"month": [rec.info() for rec in self.byMonth],
-			"year": [rec.info() for rec in self.byYear],
-		}
+		return dict((type_, [rec.info() for rec in self.getRecords(type_)]) for type_ in TYPES)
 
-	def _getList(self, type_):
+	def _getSeries(self, type_):
+		"""
+		:rtype: UsageSeries
+		"""
+		return getattr(self, self.FIELDS[type_])
+
+	def getRecords(self, type_):
 		"""
 		:rtype: list of UsageRecord
 		"""
-		if type_ == "5minutes":
-			return self.by5minutes
-		elif type_ == "hour":
-			return self.byHour
-		elif type_ == "day":
-			return self.byDay
-		elif type_ == "month":
-			return self.byMonth
-		elif type_ == "year":
-			return self.byYear
-
-	def importRecords(self, data):
-		for rec in data:
-			list_ = self._getList(rec["type"])
-			if list_ and list_[-1].end >= rec["end"]:
-				continue
-			usage = Usage(cputime=rec["usage"]["cputime"], memory=rec["usage"]["memory"],
-				diskspace=rec["usage"]["diskspace"], traffic=rec["usage"]["traffic"])
-			record = UsageRecord(begin=rec["begin"], end=rec["end"], measurements=rec["measurements"], usage=usage)
-			list_.append(record)
-		self.save()
+		return self._getSeries(type_).records()
 
-	def _removeOld(self):
-		for type_ in TYPES:
-			list_ = self._getList(type_)
-			end = _toTime(_toPoint(time.time()) - MAX_AGE[type_])
-			list_[:] = filter(lambda e: e.end > end, list_[-KEEP_RECORDS[type_]:])
+	def _setRecords(self, type_, records):
+		setattr(self, self.FIELDS[type_], UsageSeries.fromRecords(records))
+
+	def _appendUpdate(self, recordsByType):
+		"""
+		Appends the records locally and returns the $push update that appends
+		them to the stored series.
+		"""
+		push = {}
+		for type_, records in recordsByType.items():
+			if not records:
+				continue
+			keep = KEEP_RECORDS[type_]
+			self._setRecords(type_, (self.getRecords(type_) + records)[-keep:])
+			for dbField, values in UsageSeries.columns(records).items():
+				push["%s.%s" % (type_, dbField)] = {"$each": values, "$slice": -keep}
+		return {"$push": push} if push else None
+
+	def _applyUpdate(self, update):
+		if update:
+			self._get_collection().update({"_id": self.id}, update)
+		self._clear_changed_fields()
+
+	def importRecords(self, type_, columns, names=RECORD_COLUMNS):
+		"""
+		Imports records of the given type given as parallel arrays (one array
+		per record attribute in the order of names) and returns the number of
+		new records. Records that end before the last stored record are
+		skipped.
+		"""
+		endIndex = names.index("end")
+		lastEnd = self._getSeries(type_).lastEnd
+		records = []
+		for values in zip(*columns):
+			if lastEnd is not None and lastEnd >= values[endIndex]:
+				continue
+			records.append(UsageRecord(**dict(zip(names, values))))
+			lastEnd = values[endIndex]
+		if records:
+			self._applyUpdate(self._appendUpdate({type_: records}))
+		return len(records)
 
 	def _combine(self):
-		lastList = self._getList(TYPES[0])
+		"""
+		Combines records into records of the next bigger type and returns the
+		new records by type.
+		"""
+		lastList = self.getRecords(TYPES[0])
 		now = time.time()
+		new = {}
 		for type_ in TYPES[1:]:
-			list_ = self._getList(type_)
+			list_ = self.getRecords(type_)
+			new[type_] = []
 			if list_:
 				begin = list_[-1].end
 			else:
@@ -240,53 +317,84 @@ class UsageStatistics(BaseDocument):
 					break
 				while i < len(records) and records[i].end <= end:
 					i += 1
-				usage, measurements = _combine(records[:i])
+				combined = _combine(records[:i], begin, end)
 				records = records[i:]
-				list_.append(UsageRecord(begin=begin, end=end, usage=usage, measurements=measurements))
+				list_.append(combined)
+				new[type_].append(combined)
 				begin = end
 				end = _toTime(_nextPoint(_toPoint(end), type_))
 			lastList = list_
+		return new
+
+	def _housekeepUpdate(self):
+		"""
+		Combines records and removes old ones locally and returns the update
+		that has to be applied to the stored document (None if unchanged).
+		"""
+		new = self._combine()
+		update = self._appendUpdate(new) or {}
+		now = _toPoint(time.time())
+		for type_ in TYPES:
+			records = self.getRecords(type_)
+			limit = _toTime(now - MAX_AGE[type_])
+			if not records or records[0].end > limit:
+				continue
+			# some records are too old, the series has to be rewritten
+			records = filter(lambda rec: rec.end > limit, records)
+			self._setRecords(type_, records)
+			if "$push" in update:
+				for dbField in UsageSeries.columns([]):
+					update["$push"].pop("%s.%s" % (type_, dbField), None)
+				if not update["$push"]:
+					del update["$push"]
+			update.setdefault("$set", {})[type_] = UsageSeries.columns(records)
+		return update or None
 
 	def housekeep(self):
-		self._combine()
-		self._removeOld()
-		self.save()
+		self._applyUpdate(self._housekeepUpdate())
 
 	def updateFrom(self, sources):
 		"""
+		Appends the sums of the 5 minute records of all sources that are not yet
+		contained in this object and returns the number of new records.
 		:type sources: list of UsageStatistics
 		"""
-		lists = [source.by5minutes for source in sources]
+		series = [source.by5minutes for source in sources]
 		minAll = _toTime(_lastPoint("5minutes", _toPoint(time.time() - 1800)))
 		if sources:
-			lastAll = max(minAll, min([l[-1].end if l else minAll for l in lists]))
+			lastAll = max(minAll, min([s.lastEnd or minAll for s in series]))
 		else:
 			lastAll = _toTime(_lastPoint("5minutes", _toPoint(time.time())))
-		myList = self.by5minutes
-		begin = myList[-1].begin if myList else minAll
+		myEnd = self.by5minutes.lastEnd
+		begin = myEnd if myEnd is not None else minAll
 		end = _toTime(_nextPoint(_toPoint(begin), "5minutes"))
+		if end > lastAll:
+			return 0
+		# index the source records by their end to avoid scanning all records for every interval
+		byEnd = [dict((rec.end, rec) for rec in s.records()) for s in series]
+		records = []
 		while end <= lastAll:
-			usage = Usage()
-			record = UsageRecord(usage=usage, begin=begin, end=end)
-			for l in lists:
-				for rec in l:
-					if rec.end == end:
-						record.measurements += rec.measurements
-						record.usage.cputime += rec.usage.cputime
-						record.usage.traffic += rec.usage.traffic
-						record.usage.memory += rec.usage.memory * (rec.end - rec.begin) / (end-begin)
-						record.usage.diskspace += rec.usage.diskspace * (rec.end - rec.begin) / (end-begin)
-						break
-			myList.append(record)
+			record = UsageRecord(begin=begin, end=end)
+			for recs in byEnd:
+				rec = recs.get(end)
+				if rec:
+					record.measurements += rec.measurements
+					record.cputime += rec.cputime
+					record.traffic += rec.traffic
+					record.memory += rec.memory * (rec.end - rec.begin) / (end-begin)
+					record.diskspace += rec.diskspace * (rec.end - rec.begin) / (end-begin)
+			records.append(record)
 			begin = end
 			end = _toTime(_nextPoint(_toPoint(end), "5minutes"))
-		self.save()
+		self._applyUpdate(self._appendUpdate({"5minutes": records}))
+		return len(records)
 
 	@property
 	def latest(self):
-		if not self.by5minutes:
+		records = self.getRecords("5minutes")
+		if not records:
 			return
-		return self.by5minutes[-1].usage.info()
+		return records[-1].usageInfo()
 
 
 class Quota(EmbeddedDocument):
@@ -318,18 +426,18 @@ class Quota(EmbeddedDocument):
 			self.used.diskspace = 0.0
 			self.used.traffic = 0.0
 			self.usedTime = start_of_month
-		recs = filter(lambda rec: rec.end > self.usedTime, usageStats.by5minutes)
+		recs = filter(lambda rec: rec.end > self.usedTime, usageStats.getRecords("5minutes"))
 		factor = 300.0 / util.secondsInMonth(*util.getYearMonth(time.time())) 
 		end = self.usedTime
 		for rec in recs:
-			if rec.usage.cputime > self.monthly.cputime * factor * self.continousFactor:
-				self.used.cputime += rec.usage.cputime - self.monthly.cputime * factor * self.continousFactor
-			if rec.usage.memory > self.monthly.memory * self.continousFactor:
-				self.used.memory += rec.usage.memory * factor - self.monthly.memory * self.continousFactor
-			if rec.usage.diskspace > self.monthly.diskspace * self.continousFactor:
-				self.used.diskspace += rec.usage.diskspace * factor - self.monthly.diskspace * self.continousFactor
-			if rec.usage.traffic > self.monthly.traffic * factor * self.continousFactor:
-				self.used.traffic += rec.usage.traffic - self.monthly.traffic * factor * self.continousFactor
+			if rec.cputime > self.monthly.cputime * factor * self.continousFactor:
+				self.used.cputime += rec.cputime - self.monthly.cputime * factor * self.continousFactor
+			if rec.memory > self.monthly.memory * self.continousFactor:
+				self.used.memory += rec.memory * factor - self.monthly.memory * self.continousFactor
+			if rec.diskspace > self.monthly.diskspace * self.continousFactor:
+				self.used.diskspace += rec.diskspace * factor - self.monthly.diskspace * self.continousFactor
+			if rec.traffic > self.monthly.traffic * factor * self.continousFactor:
+				self.used.traffic += rec.traffic - self.monthly.traffic * factor * self.continousFactor
 			if rec.end > end:
 				end = rec.end
 		self.usedTime = end
@@ -366,8 +474,30 @@ class Quota(EmbeddedDocument):
 			"continous_factor": self.continousFactor
 		}
 
-@util.wrap_task
-def aggregate():
+FULL_AGGREGATION_INTERVAL = 600
+
+_dirtyLock = threading.RLock()
+_dirtyElements = set()
+_dirtyConnections = set()
+_dirtyHosts = set()
+_lastFullAggregation = 0.0
+
+def markDirty(hostObject):
+	"""
+	Marks the topology element or connection owning the given host element or
+	host connection and its host for the next aggregation.
+	:type hostObject: host.HostObject
+	"""
+	with _dirtyLock:
+		elementId = hostObject.getFieldId('topologyElement')
+		if elementId:
+			_dirtyElements.add(elementId)
+		connectionId = hostObject.getFieldId('topologyConnection')
+		if connectionId:
+			_dirtyConnections.add(connectionId)
+		_dirtyHosts.add(hostObject.getFieldId('host'))
+
+def _aggregateAll():
 	from . import host, elements, connections, topology, auth
 	from .host import organization
 	for el in elements.Element.objects():
@@ -384,14 +514,47 @@ def aggregate():
 		if h.enabled:
 			h.updateUsage()
 
+def _aggregateDirty(elementIds, connectionIds, hostIds):
+	# Roll up changes bottom-up: (Element, Connection) -> Topology -> User -> Organization
+	from . import host, elements, connections, topology, auth
+	from .host import organization
+	topologyIds = set()
+	for obj in list(elements.Element.objects(id__in=elementIds)) + list(connections.Connection.objects(id__in=connectionIds)):
+		if obj.updateUsage():
+			topologyIds.add(obj.getFieldId('topology'))
+	userIds = set()
+	for top in topology.Topology.objects(id__in=list(topologyIds)):
+		if top.updateUsage():
+			userIds.update(perm.getFieldId('user') for perm in top.permissions if perm.role == "owner")
+	orgaIds = set()
+	for user in auth.User.objects(id__in=list(userIds)):
+		if user.updateUsage():
+			orgaIds.add(user.getFieldId('organization'))
+	for orga in organization.Organization.objects(id__in=list(orgaIds)):
+		orga.updateUsage()
+	for h in host.Host.objects(id__in=hostIds, enabled=True):
+		h.updateUsage()
+
+@util.wrap_task
+def aggregate():
+	"""
+	Aggregates the usage of all objects whose host elements or host connections
+	received new records since the last run. A full aggregation is done every
+	FULL_AGGREGATION_INTERVAL seconds to also cover idle objects.
+	"""
+	global _dirtyElements, _dirtyConnections, _dirtyHosts, _lastFullAggregation
+	with _dirtyLock:
+		elementIds, connectionIds, hostIds = list(_dirtyElements), list(_dirtyConnections), list(_dirtyHosts)
+		_dirtyElements, _dirtyConnections, _dirtyHosts = set(), set(), set()
+	if time.time() - _lastFullAggregation >= FULL_AGGREGATION_INTERVAL:
+		_lastFullAggregation = time.time()
+		_aggregateAll()
+	else:
+		_aggregateDirty(elementIds, connectionIds, hostIds)
+
 @util.wrap_task
 def housekeep():
-	try:
-		for stats in UsageStatistics.objects():
-			stats.housekeep()
-	except:
-		import traceback
-		traceback.print_exc()
+	return batchUpdate(UsageStatistics.objects(), UsageStatistics._housekeepUpdate)
 
 
 @util.wrap_task
@@ -401,6 +564,6 @@ def updateQuota():
 		user.updateQuota()
 		user.enforceQuota()
 
-scheduler.scheduleRepeated(60, housekeep) #every minute @UndefinedVariable
-scheduler.scheduleRepeated(60, aggregate) #every minute @UndefinedVariable
-scheduler.scheduleRepeated(60, updateQuota) #every minute @UndefinedVariable
\ No newline at end of file
+scheduler.scheduleRepeated(60, housekeep, category="accounting") #every minute @UndefinedVariable
+scheduler.scheduleRepeated(60, aggregate, category="accounting") #every minute @UndefinedVariable
+scheduler.scheduleRepeated(60, updateQuota, category="accounting") #every minute @UndefinedVariable
\ No newline at end of file
@@ -104,6 +104,18 @@ def task_execute(id):
 	UserError.check(currentUser().hasFlag(auth.Flags.GlobalAdmin), code=UserError.DENIED, message="Not enough permissions")
 	return scheduler.executeTask(id, force=True)
 
+def task_metrics(format="dict"):
+	"""
+	Returns latency and lateness histograms, run and error counts of all
+	repeated tasks. With format="text" the metrics are returned in the
+	Prometheus text format.
+	"""
+	UserError.check(currentUser(), code=UserError.NOT_LOGGED_IN, message="Unauthorized")
+	UserError.check(format in ["dict", "text"], code=UserError.INVALID_VALUE, message="Unsupported format", data={"format": format})
+	if format == "text":
+		return scheduler.metricsText()
+	return scheduler.metrics()
+
 def debug_stats():
 	UserError.check(currentUser(), code=UserError.NOT_LOGGED_IN, message="Unauthorized")
 	UserError.check(currentUser().hasFlag(auth.Flags.Debug), code=UserError.DENIED, message="Not enough permissions")
@@ -112,6 +124,13 @@ def debug_stats():
 	stats["db"] = database_obj.command("dbstats")
 	stats["db"]["collections"] = {name: database_obj.command("collstats", name) for name in database_obj.collection_names()}
 	stats["scheduler"] = scheduler.info()
+	from ..host import syncEngine, connectionInfo, snapshot
+	stats["host_sync"] = syncEngine.info()
+	stats["host_snapshot"] = snapshot.info()
+	stats["host_rpc"] = connectionInfo()
+	stats["login_cache"] = auth.loginCache.info()
+	from ..lib import cache
+	stats["caches"] = cache.info()
 	stats["threads"] = map(traceback.extract_stack, sys._current_frames().values())
 	return stats
 
@@ -129,6 +129,25 @@ def topology_action(id, action, params=None): #@ReservedAssignment
 	top = _getTopology(id)
 	return top.action(action, params)
 
+def topology_placement(id): #@ReservedAssignment
+	"""
+	Calculates where the elements of a topology would be placed by the action
+	``prepare`` without executing it.
+
+	Parameter *id*:
+	  The parameter *id* identifies the topology by giving its unique id.
+
+	Return value:
+	  The return value of this method is a dict containing the planned host
+	  by element id (``elements``), the elements without a suitable host
+	  (``unplaced``) and the number of links between elements on the same
+	  host, on the same site and on other sites (``links``).
+	"""
+	UserError.check(currentUser(), code=UserError.NOT_LOGGED_IN, message="Unauthorized")
+	top = _getTopology(id)
+	top.checkRole(permissions.Role.manager)
+	return placement.plan(top).info()
+
 def topology_info(id, full=False): #@ReservedAssignment
 	"""
 	Retrieves information about a topology.
@@ -174,6 +193,13 @@ def topology_info(id, full=False): #@ReservedAssignment
 
 	``permissions``
 	  A dict with usernames as the keys and permission levels as values.
+
+	``action_progress``
+	  The progress of the currently running topology action as a dict with
+	  the ``action``, the number of ``total``, ``done``, ``running``,
+	  ``pending``, ``failed`` and ``skipped`` elements, the state of each
+	  element (``steps``) and the ``errors`` by element id. This field is
+	  ``None`` if no action is running.
 	"""
 	UserError.check(currentUser(), code=UserError.NOT_LOGGED_IN, message="Unauthorized")
 	top = _getTopology(id)
@@ -199,7 +225,7 @@ def topology_list(full=False, showAll=False, organization=None): #@ReservedAssig
 		tops = topology.getAll()
 	else:
 		tops = topology.getAll(permissions__user=currentUser())
-	return [top.info(full) for top in filter(lambda t:t.hasRole("user"), tops)]
+	return topology.bulkInfo(tops, full, accessibleOnly=True)
 
 def topology_permission(id, user, role): #@ReservedAssignment
 	"""
@@ -375,7 +401,7 @@ def topology_export(id): #@ReservedAssignment
 		
 from host import _getOrganization
 from account import _getAccount
-from .. import topology, currentUser
+from .. import topology, currentUser, placement
 from elements import element_create, element_modify 
 from connections import connection_create, connection_modify
 from ..lib.error import UserError
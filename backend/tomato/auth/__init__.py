@@ -15,7 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import time, crypt, string, random, sys
+import time, crypt, string, random, sys, os, hmac, hashlib, threading
+from collections import OrderedDict
 from ..db import *
 from ..lib import logging, util, mail #@UnresolvedImport
 from .. import config, currentUser, setCurrentUser, scheduler, accounting
@@ -195,9 +196,11 @@ class User(BaseDocument):
 		salt += ''.join([ random.choice(saltchars) for _ in range(8) ])
 		self.password = crypt.crypt(password, salt)
 		self.passwordTime = time.time()
+		loginCache.forget(self.name)
 
 	def forgetPassword(self):
 		self.password = None
+		loginCache.forget(self.name)
 		self.passwordTime = None
 		self.save()		
 		
@@ -211,7 +214,7 @@ class User(BaseDocument):
 	def loggedIn(self):
 		logging.logMessage("successful login", category="auth", user=self.name, origin=self.origin)
 		self.lastLogin = time.time()
-		self.save()
+		loginCache.touch(self)
 	
 	def hasFlag(self, flag):
 		return flag in self.flags
@@ -276,6 +279,7 @@ class User(BaseDocument):
 
 	def modify(self, attrs, save=True):
 		logging.logMessage("modify", category="user", name=self.name, origin=self.origin, attrs=attrs)
+		organizationId = self.getFieldId('organization')
 		for key, value in attrs.items():
 			UserError.check(self.can_modify(key, value), code=UserError.DENIED,
 				message="No permission to change attribute", data={"attribute": key})
@@ -288,6 +292,10 @@ class User(BaseDocument):
 				setattr(self, key, value)
 		if save:
 			self.save()
+			if organizationId and self.getFieldId('organization') != organizationId:
+				# permissions store the organization of their user
+				from .permissions import updateOrganization
+				updateOrganization(self, self.organization)
 	
 	def info(self, includeInfos):
 		info = {
@@ -321,7 +329,7 @@ class User(BaseDocument):
 		
 	def updateUsage(self):
 		#FIXME: do something useful with topologies with multiple owners
-		self.totalUsage.updateFrom([top.totalUsage for top in self.topologies.filter(permissions__role="owner")])
+		return self.totalUsage.updateFrom([top.totalUsage for top in self.topologies.filter(permissions__role="owner")])
 		
 	def updateQuota(self):
 		self.quota.updateUsage(self.totalUsage)
@@ -446,7 +454,90 @@ def provider_login(username, password):
 	logging.logMessage("failed login", category="auth", user=username)
 	return None
 
-def login(username, password):
+class LoginCache:
+	"""
+	Remembers successful logins for a limited time, so that repeated calls
+	with the same credentials skip the password checks of the auth providers.
+	Instead of the passwords, HMACs with a random per-process key are stored.
+	The providers stay the source of truth: entries expire after timeout
+	seconds and are dropped when the password of a user changes.
+	The last login times of users are collected and saved in batches.
+	"""
+	def __init__(self, maxSize=1000, timeout=120):
+		self.maxSize = maxSize
+		self.timeout = timeout
+		self._key = os.urandom(32)
+		self._entries = OrderedDict() #username -> (digest, user id, expiry)
+		self._lastLogins = {} #user id -> timestamp
+		self._lock = threading.RLock()
+		self.hits = 0
+		self.misses = 0
+
+	def _digest(self, username, password):
+		return hmac.new(self._key, "%s\0%s" % (username, password), hashlib.sha256).digest()
+
+	def get(self, username, password):
+		"""
+		Returns the user if the credentials have been checked recently.
+		"""
+		digest = self._digest(username, password)
+		with self._lock:
+			entry = self._entries.get(username)
+			if not entry or entry[2] <= time.time() or not _compareDigest(entry[0], digest):
+				self.misses += 1
+				return None
+			self.hits += 1
+		try:
+			user = User.objects.get(id=entry[1])
+		except User.DoesNotExist:
+			self.forget(username)
+			return None
+		self.touch(user)
+		return user
+
+	def put(self, username, password, user):
+		with self._lock:
+			self._entries.pop(username, None)
+			while len(self._entries) >= self.maxSize:
+				self._entries.popitem(last=False)
+			self._entries[username] = (self._digest(username, password), user.id, time.time() + self.timeout)
+
+	def forget(self, username):
+		"""
+		Drops the entries of the user, also those that were created with
+		"name@origin" as username.
+		"""
+		with self._lock:
+			for key in [key for key in self._entries if key.split("@", 1)[0] == username]:
+				del self._entries[key]
+
+	def touch(self, user):
+		with self._lock:
+			self._lastLogins[user.id] = time.time()
+
+	def saveLastLogins(self):
+		with self._lock:
+			lastLogins, self._lastLogins = self._lastLogins, {}
+		for userId, timestamp in lastLogins.iteritems():
+			User.objects(id=userId).update_one(set__lastLogin=timestamp)
+
+	def info(self):
+		with self._lock:
+			return {
+				"size": len(self._entries),
+				"hits": self.hits,
+				"misses": self.misses,
+				"pending_last_logins": len(self._lastLogins)
+			}
+
+def _compareDigest(a, b):
+	if hasattr(hmac, "compare_digest"):
+		return hmac.compare_digest(a, b)
+	return a == b
+
+loginCache = LoginCache(maxSize=config.LOGIN_CACHE_SIZE, timeout=config.LOGIN_CACHE_TIME)
+
+def _login(username, password):
 	for user in User.objects.filter(name = username):
 		if user.password and user.checkPassword(password):
 			user.loggedIn()
@@ -461,10 +552,21 @@ def login(username, password):
 		user.save()
 		stored = user
 	stored.storePassword(password)
+	stored.save()
 	stored.loggedIn()
 	return stored
 
+def login(username, password):
+	user = loginCache.get(username, password)
+	if user:
+		return user
+	user = _login(username, password)
+	if user:
+		loginCache.put(username, password, user)
+	return user
+
 def remove(user):
+	loginCache.forget(user.name)
 	user.delete()
 	user.totalUsage.remove()
 
@@ -481,7 +583,8 @@ def register(username, password, organization, attrs=None, provider=""):
 
 providers = []
 
-scheduler.scheduleRepeated(300, cleanup) #every 5 minutes @UndefinedVariable
+scheduler.scheduleRepeated(300, cleanup, category="maintenance") #every 5 minutes @UndefinedVariable
+scheduler.scheduleRepeated(config.LOGIN_SAVE_INTERVAL, util.wrap_task(loginCache.saveLastLogins), immediate=False, category="maintenance") #@UndefinedVariable
 
 def init():
 	print >>sys.stderr, "Loading auth modules..."
@@ -17,7 +17,7 @@
 
 from ..db import *
 
-from .. import currentUser
+from .. import currentUser, requestCache
 from ..lib.error import UserError
 
 # noinspection PyClassHasNoInit
@@ -53,6 +53,18 @@ class Permission(ExtDocument, EmbeddedDocument):
 	from . import User
 	user = ReferenceField(User, required=True)
 	role = StringField(choices=['owner', 'manager', 'user'], required=True)
+	# id of the organization of the user, so that organization checks do not
+	# need to load the user
+	organizationId = ObjectIdField(db_field='organization')
+
+	@property
+	def userId(self):
+		return self.getFieldId('user')
+
+	def getOrganizationId(self):
+		if self.organizationId is None:
+			self.organizationId = self.user.getFieldId('organization')
+		return self.organizationId
 
 
 # noinspection PyClassHasNoInit
@@ -65,12 +77,23 @@ class PermissionMixin(object):
 
 	def getRole(self, user=None):
 		"""
+		Returns the role of the user, roles are cached for the rest of the
+		request.
 		:type user: auth.User or None
 		"""
 		if not user:
 			user = currentUser()
 		if user is True:
 			return Role.owner
+		if not self.id:
+			return self._getRole(user)
+		cache = requestCache()
+		key = ("role", self.id, user.id)
+		if not key in cache:
+			cache[key] = self._getRole(user)
+		return cache[key]
+
+	def _getRole(self, user):
 		role = Role.null
 		# Global permissions, that's easy
 		if user.hasFlag(Flags.GlobalToplUser):
@@ -82,7 +105,7 @@ class PermissionMixin(object):
 
 		# User specific role
 		for perm in self.permissions:
-			if perm.user != user:
+			if perm.userId != user.id:
 				continue
 			if Role.RANKING.index(perm.role) > Role.RANKING.index(role):
 				role = perm.role
@@ -96,8 +119,9 @@ class PermissionMixin(object):
 		if user.hasFlag(Flags.OrgaToplOwner):
 			orgaRole = Role.owner
 		if Role.RANKING.index(orgaRole) > Role.RANKING.index(role):
+			orgaId = user.getFieldId('organization')
 			for perm in self.permissions:
-				if perm.role == Role.owner and perm.user.organization == user.organization:
+				if perm.role == Role.owner and perm.getOrganizationId() == orgaId:
 					role = orgaRole
 					break
 
@@ -113,7 +137,25 @@ class PermissionMixin(object):
 	def setRole(self, user=None, role=Role.user):
 		if not user:
 			user = currentUser()
-		self.permissions = 	filter(lambda perm: perm.user != user, self.permissions)
-		self.permissions.append(Permission(user=user, role=role))
+		self.permissions = 	filter(lambda perm: perm.userId != user.id, self.permissions)
+		self.permissions.append(Permission(user=user, role=role, organizationId=user.getFieldId('organization')))
+		cache = requestCache()
+		for key in [key for key in cache if key[0] == "role" and key[1] == self.id]:
+			del cache[key]
+
+def updateOrganization(user, organization):
+	"""
+	Updates the organization id that is stored in the permissions of the user
+	after the user has moved to another organization.
+	"""
+	from ..topology import Topology
+	from ..elements import Element
+	from ..connections import Connection
+	for cls in [Topology, Element, Connection]:
+		# setRole keeps only one entry per user, so the positional update hits it
+		cls.objects(permissions__user=user).update(set__permissions__S__organizationId=organization.id)
+	cache = requestCache()
+	for key in [key for key in cache if key[0] == "role"]:
+		del cache[key]
 
 from . import Flags
@@ -45,6 +45,10 @@ AUTH.append ({
 	}
 })
 
+LOGIN_CACHE_TIME = 120
+LOGIN_CACHE_SIZE = 1000
+LOGIN_SAVE_INTERVAL = 60
+
 LOG_FILE = "/var/log/tomato/main.log"
 
 SERVER = []
@@ -73,6 +77,25 @@ RPC_TIMEOUT = 60
 HOST_UPDATE_INTERVAL = 60
 HOST_AVAILABILITY_HALFTIME = 60.0 * 60 * 24 * 90 # 90 days 
 RESOURCES_SYNC_INTERVAL = 600
+HOST_SYNC_WORKERS = 10
+HOST_SYNC_DEADLINE = 120
+HOST_RPC_CONNECTIONS = 2
+HOST_RPC_MAX_INFLIGHT = 16
+HOST_RPC_HEALTH_INTERVAL = 60
+HOST_ACCOUNTING_COMPRESS = True
+HOST_SNAPSHOT_MAX_AGE = 600
+
+# Categories of scheduled tasks: tasks of categories with a higher priority
+# run first, maxWorkers limits concurrent tasks, repeated tasks more than
+# maxLate seconds late skip a run and identical one-shot tasks of coalescing
+# categories are merged.
+TASK_CATEGORIES = {
+	"realtime": {"priority": 20},
+	"topology": {"priority": 15, "maxWorkers": 1},
+	"host": {"priority": 10, "maxWorkers": 5},
+	"accounting": {"priority": 0, "maxWorkers": 3, "maxLate": 60},
+	"maintenance": {"priority": -10, "maxWorkers": 3, "maxLate": 300, "coalesce": True},
+}
 
 EMAIL_SMTP = "localhost"
 EMAIL_FROM = "ToMaTo backend <tomato@localhost>"
@@ -84,6 +107,9 @@ TOPOLOGY_TIMEOUT_DEFAULT = 3600.0 * 24 * 3
 TOPOLOGY_TIMEOUT_MAX = 3600.0 * 24 * 30
 TOPOLOGY_TIMEOUT_WARNING = 3600.0 * 24
 TOPOLOGY_TIMEOUT_OPTIONS = [3600.0 * 24, 3600.0 * 24 * 3, 3600.0 * 24 * 14, 3600.0 * 24 * 30]
+TOPOLOGY_ACTION_WORKERS = 8
+TOPOLOGY_ACTION_HOST_LIMIT = 2
+TOPOLOGY_ACTION_MAX_RUNNING = 32
 
 HOST_COMPONENT_TIMEOUT = 3600.0 * 24 * 30 * 12
 
@@ -474,7 +474,7 @@ class Connection(LockedStatefulEntity, PermissionMixin, BaseDocument):
 	}
 		
 	def updateUsage(self):
-		self.totalUsage.updateFrom([el.usageStatistics for el in self.hostElements]
+		return self.totalUsage.updateFrom([el.usageStatistics for el in self.hostElements]
 								 + [con.usageStatistics for con in self.hostConnections])
 		
 
@@ -1,7 +1,7 @@
 from __future__ import print_function
 from mongoengine import *
 from mongoengine.base.fields import BaseField
-import bson, sys
+import bson, sys, time, traceback
 
 # noinspection PyUnresolvedReferences
 
@@ -102,4 +102,102 @@ class DataHub:
 	def __setitem__(self, key, value):
 		self.set(key, value)
 
-data = DataHub()
\ No newline at end of file
+data = DataHub()
+
+
+def batchUpdate(queryset, updateFn, chunkSize=500):
+	"""
+	Streams the documents of the queryset in chunks of chunkSize documents and
+	calls updateFn for each of them. updateFn must return the update for the
+	document or None if it is unchanged. All updates of a chunk are written with
+	one bulk write.
+	Returns statistics about the processed documents and chunks.
+	"""
+	collection = queryset._document._get_collection()
+	stats = {"documents": 0, "changed": 0, "errors": 0, "duration": 0.0, "chunks": []}
+	chunk = []
+	start = time.time()
+	for doc in queryset.batch_size(chunkSize):
+		chunk.append(doc)
+		if len(chunk) >= chunkSize:
+			_batchUpdateChunk(collection, chunk, updateFn, start, stats)
+			chunk = []
+			start = time.time()
+	if chunk:
+		_batchUpdateChunk(collection, chunk, updateFn, start, stats)
+	return stats
+
+def _batchUpdateChunk(collection, chunk, updateFn, start, stats):
+	bulk = collection.initialize_unordered_bulk_op()
+	changed = 0
+	for doc in chunk:
+		try:
+			update = updateFn(doc)
+		except:
+			traceback.print_exc()
+			stats["errors"] += 1
+			continue
+		if update:
+			bulk.find({"_id": doc.id}).update_one(update)
+			changed += 1
+	if changed:
+		bulk.execute()
+	duration = time.time() - start
+	stats["documents"] += len(chunk)
+	stats["changed"] += changed
+	stats["duration"] += duration
+	stats["chunks"].append({"documents": len(chunk), "changed": changed, "duration": duration})
+
+
+def _refId(value):
+	if isinstance(value, dict) and '_ref' in value:
+		value = value['_ref']
+	if isinstance(value, bson.DBRef):
+		return value.id
+	return value
+
+def _referencedType(field):
+	if isinstance(field, ListField):
+		field = field.field
+	if isinstance(field, ReferenceField):
+		return field.document_type
+	return None
+
+def prefetch(docs, fields, known=()):
+	"""
+	Loads the documents that are referenced by the given fields (ReferenceFields
+	or ListFields of ReferenceFields) of all docs with one $in query per
+	document type and stores them in the docs, so that accessing the fields
+	does not query the database again. Fields that a document does not have
+	are skipped, references that are already loaded are kept. The documents in
+	known are used without loading them again.
+	Returns the list of newly loaded documents.
+	"""
+	loaded = dict((doc.id, doc) for doc in known)
+	missing = {}
+	for doc in docs:
+		for name in fields:
+			type_ = _referencedType(doc._fields.get(name))
+			if not type_:
+				continue
+			value = doc._data.get(name)
+			for ref in (value if isinstance(value, list) else [value]):
+				if ref is None or isinstance(ref, Document):
+					continue
+				if not _refId(ref) in loaded:
+					missing.setdefault(type_, set()).add(_refId(ref))
+	new = []
+	for type_, ids in missing.iteritems():
+		for obj in type_.objects(id__in=list(ids)):
+			loaded[obj.id] = obj
+			new.append(obj)
+	for doc in docs:
+		for name in fields:
+			if not _referencedType(doc._fields.get(name)):
+				continue
+			value = doc._data.get(name)
+			if isinstance(value, list):
+				doc._data[name] = [ref if isinstance(ref, Document) else loaded.get(_refId(ref), ref) for ref in value]
+			elif value is not None and not isinstance(value, Document):
+				doc._data[name] = loaded.get(_refId(value), value)
+	return new
@@ -381,14 +381,14 @@ def update_source(source):
 def update_all(async=True):
 	for s in getDumpSources():
 		if async:
-			scheduler.scheduleOnce(0, update_source, s)
+			scheduler.scheduleOnce(0, update_source, s, category="maintenance")
 		else:
 			update_source(s)
 	return len(getDumpSources())
 
 
 def init():
-	scheduler.scheduleRepeated(config.DUMP_COLLECTION_INTERVAL, update_all, immediate=True)
+	scheduler.scheduleRepeated(config.DUMP_COLLECTION_INTERVAL, update_all, immediate=True, category="maintenance")
 
 
 # Second Part: Access to known dumps for API
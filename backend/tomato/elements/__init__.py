@@ -26,6 +26,7 @@ from ..lib.decorators import *
 from ..lib.cache import cached
 from ..lib.error import UserError
 from ..connections import Connection
+from .. import placement
 
 TYPES = {}
 
@@ -268,6 +269,9 @@ class Element(LockedStatefulEntity, PermissionMixin, BaseDocument):
 		"""
 		hostPrefs = {}
 		sitePrefs = {}
+		plannedHost = placement.plannedHost(self)
+		if plannedHost:
+			hostPrefs[plannedHost] = placement.PLAN_AFFINITY
 		if self.connection:
 			for el, sha, ssa in self.connectedElement.getLocationData():
 				if not el.host:
@@ -345,7 +349,7 @@ class Element(LockedStatefulEntity, PermissionMixin, BaseDocument):
 			self.mainElement.updateInfo()
 
 	def updateUsage(self):
-		self.totalUsage.updateFrom([el.usageStatistics for el in self.hostElements]
+		return self.totalUsage.updateFrom([el.usageStatistics for el in self.hostElements]
 								 + [con.usageStatistics for con in self.hostConnections])
 
 	def __str__(self):
@@ -49,7 +49,7 @@ def syncRexTFV():
 		with e:
 			e.reload().updateInfo()
 		
-scheduler.scheduleRepeated(1, syncRexTFV)
+scheduler.scheduleRepeated(1, syncRexTFV, category="realtime")
 	
 elements.TYPES[KVMQM.TYPE] = KVMQM
 elements.TYPES[KVMQM_Interface.TYPE] = KVMQM_Interface
\ No newline at end of file
@@ -53,7 +53,7 @@ def syncRexTFV():
 		with e:
 			e.reload().updateInfo()
 
-scheduler.scheduleRepeated(1, syncRexTFV)
+scheduler.scheduleRepeated(1, syncRexTFV, category="realtime")
 	
 elements.TYPES[OpenVZ.TYPE] = OpenVZ
 elements.TYPES[OpenVZ_Interface.TYPE] = OpenVZ_Interface
\ No newline at end of file
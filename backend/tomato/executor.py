@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from .lib.error import Error #@UnresolvedImport
+import threading, time, sys
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+_running = {}
+_runningLock = threading.RLock()
+
+
+class _Slots:
+	"""
+	Number of running steps of all executors in total and by key, so that
+	the limits also hold when several executors run at the same time.
+	"""
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.cond = threading.Condition(self.lock)
+		self.keys = {}
+		self.total = 0
+
+	def available(self, key, keyLimit, totalLimit):
+		if self.total >= totalLimit:
+			return False
+		return key is None or self.keys.get(key, 0) < keyLimit
+
+	def acquire(self, key):
+		self.total += 1
+		self.keys[key] = self.keys.get(key, 0) + 1
+
+	def release(self, key):
+		self.total -= 1
+		self.keys[key] -= 1
+		if not self.keys[key]:
+			del self.keys[key]
+		self.cond.notify_all()
+
+_slots = _Slots()
+
+
+class Step:
+	def __init__(self, id_, fn, key=None, deps=()):
+		self.id = id_
+		self.fn = fn
+		self.key = key
+		self.deps = list(deps)
+		self.state = PENDING
+		self.error = None # exc_info of a failed step
+		self.duration = None
+
+	def errorInfo(self):
+		error = self.error[1]
+		if isinstance(error, Error):
+			return {"type": error.type, "code": error.code, "message": error.message}
+		return {"type": error.__class__.__name__, "message": str(error)}
+
+
+class ActionExecutor:
+	"""
+	Runs steps in up to maxWorkers threads. A step starts when all steps it
+	depends on are done, fewer than keyLimit steps with the same key (e.g.
+	the host of an element) and fewer than totalLimit steps are running in
+	all executors. Failed steps do not stop the others, only the steps that
+	depend on them are skipped.
+	setup is called at the start of every worker thread.
+	"""
+	def __init__(self, name, action, maxWorkers=8, keyLimit=2, totalLimit=32, setup=None):
+		self.name = name
+		self.action = action
+		self.maxWorkers = maxWorkers
+		self.keyLimit = keyLimit
+		self.totalLimit = totalLimit
+		self.setup = setup
+		self.steps = []
+		self.byId = {}
+		# the state of all executors is guarded by one lock, finished steps
+		# may free slots for the steps of other executors
+		self.lock = _slots.lock
+		self.cond = _slots.cond
+		self.started = None
+
+	def add(self, id_, fn, key=None, deps=()):
+		step = Step(id_, fn, key, deps)
+		self.steps.append(step)
+		self.byId[id_] = step
+		return step
+
+	def _count(self, state):
+		return len([step for step in self.steps if step.state == state])
+
+	def _next(self):
+		# called with lock, returns a runnable step and skips the steps that
+		# can never run
+		changed = True
+		while changed:
+			changed = False
+			for step in self.steps:
+				if step.state != PENDING:
+					continue
+				states = [self.byId[dep].state for dep in step.deps if dep in self.byId]
+				if FAILED in states or SKIPPED in states:
+					step.state = SKIPPED
+					changed = True
+		limited = False
+		for step in self.steps:
+			if step.state != PENDING:
+				continue
+			if any(self.byId[dep].state != DONE for dep in step.deps if dep in self.byId):
+				continue
+			if not _slots.available(step.key, self.keyLimit, self.totalLimit):
+				limited = True
+				continue
+			return step
+		if not limited and not self._count(RUNNING):
+			# remaining steps wait for each other
+			for step in self.steps:
+				if step.state == PENDING:
+					step.state = SKIPPED
+		return None
+
+	def _work(self):
+		if self.setup:
+			self.setup()
+		while True:
+			with self.lock:
+				step = self._next()
+				while step is None and self._count(PENDING):
+					self.cond.wait()
+					step = self._next()
+				if step is None:
+					self.cond.notify_all()
+					return
+				step.state = RUNNING
+				_slots.acquire(step.key)
+			start = time.time()
+			error = None
+			try:
+				step.fn()
+			except:
+				error = sys.exc_info()
+			with self.lock:
+				step.duration = time.time() - start
+				step.error = error
+				step.state = FAILED if error else DONE
+				_slots.release(step.key)
+
+	def run(self):
+		"""
+		Runs all steps and returns when they are finished. The progress can be
+		queried with progress(name) meanwhile.
+		"""
+		self.started = time.time()
+		with _runningLock:
+			_running[self.name] = self
+		try:
+			workers = [threading.Thread(target=self._work, name="executor-%s-%d" % (self.name, i))
+					   for i in xrange(min(self.maxWorkers, len(self.steps)))]
+			for worker in workers:
+				worker.start()
+			for worker in workers:
+				worker.join()
+		finally:
+			with _runningLock:
+				if _running.get(self.name) is self:
+					del _running[self.name]
+		return self
+
+	@property
+	def failed(self):
+		return [step for step in self.steps if step.state == FAILED]
+
+	def info(self):
+		with self.lock:
+			return {
+				"action": self.action,
+				"total": len(self.steps),
+				"done": self._count(DONE),
+				"running": self._count(RUNNING),
+				"pending": self._count(PENDING),
+				"failed": self._count(FAILED),
+				"skipped": self._count(SKIPPED),
+				"duration": time.time() - self.started if self.started else 0.0,
+				"steps": dict((step.id, step.state) for step in self.steps),
+				"errors": dict((step.id, step.errorInfo()) for step in self.steps if step.error)
+			}
+
+
+def progress(name):
+	"""
+	Returns the info of the executor that is currently running under the
+	given name or None.
+	"""
+	with _runningLock:
+		executor = _running.get(name)
+	return executor.info() if executor else None
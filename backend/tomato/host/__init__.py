@@ -18,47 +18,85 @@
 from ..db import *
 from ..generic import *
 from .. import config, currentUser, starttime, scheduler
+from .. import accounting
 from ..accounting import UsageStatistics
 from ..lib import rpc, util, logging, error
 from ..lib.cache import cached
 from ..lib.error import TransportError, InternalError, UserError, Error
 from ..lib import anyjson as json
 from ..dumpmanager import DumpSource
-import time, hashlib, threading, datetime, zlib, base64, sys
+from .pool import ConnectionPool
+from . import pool
+import time, hashlib, datetime, zlib, base64, sys
 
 class RemoteWrapper:
 	def __init__(self, url, host, *args, **kwargs):
 		self._url = url
 		self._host = host
-		self._args = args
-		self._kwargs = kwargs
-		self._proxy = None
+		self._pool = ConnectionPool(url, host, size=config.HOST_RPC_CONNECTIONS, maxInflight=config.HOST_RPC_MAX_INFLIGHT,
+									*args, **kwargs)
+
+	def _call(self, fn):
+		"""
+		Calls fn with a proxy and the time the call may take, which is limited
+		by the deadline of the current thread (see pool.deadline).
+		"""
+		retries = 3
+		while True:
+			retries -= 1
+			timeout = pool.remaining(config.RPC_TIMEOUT)
+			try:
+				if timeout <= 0:
+					raise TransportError(code="network.timeout", message="Deadline exceeded", module="backend")
+				return self._pool.call(lambda proxy: fn(proxy, timeout), timeout=timeout)
+			except Error as err:
+				if isinstance(err, TransportError):
+					if retries >= 0 and pool.isBroken(err) and pool.remaining(config.RPC_TIMEOUT) > 0:
+						print >>sys.stderr, "Retrying after error on %s: %s, retries left: %d" % (self._host, err, retries)
+						continue
+					if not err.data:
+						err.data = {}
+					err.data["host"] = self._host
+				raise err, None, sys.exc_info()[2]
+			except Exception as exc:
+				print >>sys.stderr, "Warning: received unwrapped error:"
+				import traceback
+				traceback.print_exc()
+				raise InternalError(code=InternalError.UNKNOWN, message=repr(exc), module="hostmanager",
+						data={"host": self._host}), None, sys.exc_info()[2]
+
+	def setVersion(self, version):
+		self._pool.setVersion(version)
+
+	def checkHealth(self):
+		self._pool.checkHealth(idle=config.HOST_RPC_HEALTH_INTERVAL)
+
+	def hasMethod(self, name):
+		return self._pool.hasMethod(name)
+
+	def info(self):
+		return self._pool.info()
+
+	def close(self):
+		self._pool.close()
+
+	def multicall(self, *calls):
+		"""
+		Executes all calls (given as (method, args, kwargs) tuples) in one
+		round trip and returns a list of (success, result) tuples.
+		"""
+		return self._call(lambda proxy, timeout: rpc.multicall(proxy, calls, timeout=timeout))
+
+	def pipeline(self, *calls):
+		"""
+		Sends all calls (given as (method, args, kwargs) tuples) at once over one
+		connection and returns a list of (success, result) tuples.
+		"""
+		return self._call(lambda proxy, timeout: rpc.pipeline(proxy, calls, timeout=timeout))
 
 	def __getattr__(self, name):
 		def call(*args, **kwargs):
-			retries = 3
-			while True:
-				retries -= 1
-				if not self._proxy or not rpc.isReusable(self._proxy):
-					self._proxy = rpc.createProxy(self._url, *self._args, **self._kwargs)
-				try:
-					return getattr(self._proxy, name)(*args, **kwargs)
-				except Error as err:
-					if isinstance(err, TransportError):
-						self._proxy = None
-						if retries >= 0:
-							print >>sys.stderr, "Retrying after error on %s: %s, retries left: %d" % (self._host, err, retries)
-							continue
-						if not err.data:
-							err.data = {}
-						err.data["host"] = self._host
-					raise err, None, sys.exc_info()[2]
-				except Exception as exc:
-					print >>sys.stderr, "Warning: received unwrapped error:"
-					import traceback
-					traceback.print_exc()
-					raise InternalError(code=InternalError.UNKNOWN, message=repr(exc), module="hostmanager",
-							data={"host": self._host}), None, sys.exc_info()[2]
+			return self._call(lambda proxy, timeout: rpc.call(proxy, name, args, kwargs, timeout=timeout))
 		return call
 
 
@@ -68,6 +106,8 @@ _proxies = {}
 
 def stopCaching():
 	global _proxies
+	for proxy in _proxies.values():
+		proxy.close()
 	_proxies = {}
 	global _caching
 	_caching = False
@@ -90,6 +130,8 @@ class Host(DumpSource, Entity, BaseDocument):
 	hostInfo = DictField(db_field='host_info')
 	hostInfoTimestamp = FloatField(db_field='host_info_timestamp', required=True)
 	accountingTimestamp = FloatField(db_field='accounting_timestamp', required=True)
+	accountingSeq = IntField(db_field='accounting_seq', default=0)
+	accountingDatabase = FloatField(db_field='accounting_database')
 	lastResourcesSync = FloatField(db_field='last_resource_sync', required=True)
 	enabled = BooleanField(default=True)
 	componentErrors = IntField(default=0, db_field='component_errors')
@@ -157,6 +199,10 @@ class Host(DumpSource, Entity, BaseDocument):
 			self.modify(attrs)
 		self.update()
 
+	def modify(self, attrs):
+		Entity.modify(self, attrs)
+		snapshot.updateHost(self)
+
 	def getProxy(self):
 		if not _caching:
 			return RemoteWrapper(self.rpcurl, self.name, sslcert=config.CERTIFICATE, timeout=config.RPC_TIMEOUT)
@@ -171,6 +217,7 @@ class Host(DumpSource, Entity, BaseDocument):
 		logging.logMessage("component error", category="host", host=self.name)
 		self.componentErrors += 1
 		self.save()
+		snapshot.adjust(self, errors=1)
 
 	def update(self):
 		self.availability *= config.HOST_AVAILABILITY_FACTOR
@@ -178,16 +225,21 @@ class Host(DumpSource, Entity, BaseDocument):
 		if not self.enabled:
 			return
 		before = time.time()
-		self.hostInfo = self._info()
+		# host_info, host_capabilities and host_networks are pipelined into one round trip
+		(infoOk, info), (capsOk, caps), (netsOk, nets) = self.getProxy().multicall(
+			("host_info", (), {}), ("host_capabilities", (), {}), ("host_networks", (), {}))
 		after = time.time()
+		if not infoOk:
+			raise info
+		if not capsOk:
+			raise caps
+		self.hostInfo = info
+		self.getProxy().setVersion(info.get("hostmanager", {}).get("version"))
 		self.hostInfoTimestamp = (before + after) / 2.0
 		self.hostInfo["query_time"] = after - before
 		self.hostInfo["time_diff"] = self.hostInfo["time"] - self.hostInfoTimestamp
-		try:
-			self.hostNetworks = self.getProxy().host_networks()
-		except:
-			self.hostNetworks = []
-		caps = self._convertCapabilities(self.getProxy().host_capabilities())
+		self.hostNetworks = nets if netsOk else []
+		caps = self._convertCapabilities(caps)
 		self.elementTypes = caps["elements"]
 		self.connectionTypes = caps["connections"]
 		self.componentErrors = max(0, self.componentErrors / 2)
@@ -275,6 +327,7 @@ class Host(DumpSource, Entity, BaseDocument):
 		hel.usageStatistics = UsageStatistics.objects.create()
 		hel.objectInfo = el
 		hel.save()
+		snapshot.adjust(self, elements=1)
 		if ownerElement:
 			ownerElement.hostElements.append(hel)
 			ownerElement.save()
@@ -309,6 +362,7 @@ class Host(DumpSource, Entity, BaseDocument):
 		hcon.usageStatistics = UsageStatistics.objects.create()
 		hcon.objectInfo = con
 		hcon.save()
+		snapshot.adjust(self, connections=1)
 		hel1.connection = hcon
 		hel1.save()
 		hel2.connection = hcon
@@ -383,33 +437,64 @@ class Host(DumpSource, Entity, BaseDocument):
 		self.save()
 
 	def updateUsage(self):
-		self.totalUsage.updateFrom(
+		return self.totalUsage.updateFrom(
 			[hel.usageStatistics for hel in self.elements.all()] + [hcon.usageStatistics for hcon in
 																	self.connections.all()])
 
+	def _exportAccountingData(self, proxy, after):
+		data = proxy.accounting_export(type="5minutes", after=after, compress=config.HOST_ACCOUNTING_COMPRESS)
+		if "zlib" in data:
+			data = json.loads(zlib.decompress(base64.b64decode(data["zlib"])))
+		return data
+
+	def _fetchAccountingData(self):
+		"""
+		Fetches the 5 minute records created since the last synchronization in
+		the columnar export format. Hostmanagers without incremental export
+		send all recent records, they are converted to the same format.
+		"""
+		proxy = self.getProxy()
+		# hasMethod returns None if the protocol can not tell
+		if proxy.hasMethod("accounting_export") is not False:
+			try:
+				data = self._exportAccountingData(proxy, self.accountingSeq)
+				if self.accountingSeq and self.accountingDatabase is not None and data.get("database") != self.accountingDatabase:
+					# the sequence numbers of a new database start over
+					data = self._exportAccountingData(proxy, 0)
+				return data, False
+			except TransportError as err:
+				if err.code != "method.unknown_method":
+					raise
+		data = proxy.accounting_statistics(type="5minutes", after=self.accountingTimestamp - 900)
+		for kind in ["elements", "connections"]:
+			for id_, records in data[kind].items():
+				data[kind][id_] = [[rec["begin"] for rec in records], [rec["end"] for rec in records],
+					[rec["measurements"] for rec in records]] + [[rec["usage"][name] for rec in records] for name in accounting.RECORD_COLUMNS[3:]]
+		data["columns"] = accounting.RECORD_COLUMNS
+		return data, True
+
 	def updateAccountingData(self):
 		logging.logMessage("accounting_sync begin", category="host", name=self.name)
-		data = self.getProxy().accounting_statistics(type="5minutes", after=self.accountingTimestamp - 900)
-		for el in self.elements.all():
-			if not el.usageStatistics:
-				el.usageStatistics = UsageStatistics.objects.create()
-				el.save()
-			if not str(el.num) in data["elements"]:
-				print >>sys.stderr, "Missing accounting data for element #%d on host %s" % (el.num, self.name)
-				continue
-			logging.logMessage("host_records", category="accounting", host=self.name,
-							   records=data["elements"][str(el.num)], object=("element", el.idStr))
-			el.updateAccountingData(data["elements"][str(el.num)])
-		for con in self.connections.all():
-			if not con.usageStatistics:
-				con.usageStatistics = UsageStatistics.objects.create()
-				con.save()
-			if not str(con.num) in data["connections"]:
-				print >>sys.stderr, "Missing accounting data for connection #%d on host %s" % (con.num, self.name)
-				continue
-			logging.logMessage("host_records", category="accounting", host=self.name,
-							   records=data["connections"][str(con.num)], object=("connection", con.idStr))
-			con.updateAccountingData(data["connections"][str(con.num)])
+		data, complete = self._fetchAccountingData()
+		for kind, objects in [("element", self.elements.all()), ("connection", self.connections.all())]:
+			records = data[kind + "s"]
+			for obj in objects:
+				if not obj.usageStatistics:
+					obj.usageStatistics = UsageStatistics.objects.create()
+					obj.save()
+				if not str(obj.num) in records:
+					# incremental exports only contain objects with new records
+					if complete:
+						print >>sys.stderr, "Missing accounting data for %s #%d on host %s" % (kind, obj.num, self.name)
+					continue
+				logging.logMessage("host_records", category="accounting", host=self.name,
+								   records=records[str(obj.num)], object=(kind, obj.idStr))
+				if obj.updateAccountingData(records[str(obj.num)], data["columns"]):
+					accounting.markDirty(obj)
+		if "seq" in data:
+			self.accountingSeq = data["seq"]
+		if "database" in data:
+			self.accountingDatabase = data["database"]
 		self.accountingTimestamp = time.time()
 		self.save()
 		logging.logMessage("accounting_sync end", category="host", name=self.name)
@@ -463,6 +548,7 @@ class Host(DumpSource, Entity, BaseDocument):
 			except:
 				pass
 		if self.id:
+			snapshot.removeHost(self)
 			self.delete()
 		self.totalUsage.remove()
 
@@ -623,6 +709,7 @@ class Host(DumpSource, Entity, BaseDocument):
 			attrs_['name'] = name
 			host.init(attrs_)
 			host.save()
+			snapshot.updateHost(host)
 			logging.logMessage("create", category="host", info=host.info())
 		except:
 			host.remove()
@@ -672,60 +759,24 @@ class HostObject(BaseDocument):
 
 
 def select(site=None, elementTypes=None, connectionTypes=None, networkKinds=None, hostPrefs=None, sitePrefs=None):
-	# STEP 1: limit host choices to what is possible
 	if not sitePrefs: sitePrefs = {}
 	if not hostPrefs: hostPrefs = {}
 	if not networkKinds: networkKinds = []
 	if not connectionTypes: connectionTypes = []
 	if not elementTypes: elementTypes = []
-	all_ = Host.getAll(site=site) if site else Host.getAll()
-	hosts = []
-	for host in all_:
-		if host.problems():
-			continue
-		if set(elementTypes) - set(host.elementTypes.keys()):
-			continue
-		if set(connectionTypes) - set(host.connectionTypes.keys()):
-			continue
-		if set(networkKinds) - set(host.getNetworkKinds()):
-			continue
-		hosts.append(host)
-	UserError.check(hosts, code=UserError.INVALID_CONFIGURATION, message="No hosts found for requirements", data={
+	hostId, prefs = snapshot.select(site, elementTypes, connectionTypes, networkKinds,
+									hostPrefs=dict([(k.id, v) for k, v in hostPrefs.iteritems()]),
+									sitePrefs=dict([(k.id, v) for k, v in sitePrefs.iteritems()]))
+	host = Host.get(id=hostId) if hostId else None
+	UserError.check(host, code=UserError.INVALID_CONFIGURATION, message="No hosts found for requirements", data={
 		'site': site, 'element_types': elementTypes, 'connection_types': connectionTypes, 'network_kinds': networkKinds
 	})
-	# any host in hosts can handle the request
-	prefs = dict([(h, 0.0) for h in hosts])
-	# STEP 2: calculate preferences based on host load
-	els = 0.0
-	cons = 0.0
-	for h in hosts:
-		prefs[h] -= h.componentErrors * 25  # discourage hosts with previous errors
-		prefs[h] -= h.getLoad() * 100  # up to -100 points for load
-		els += h.elements.count()
-		cons += h.connections.count()
-	avgEls = els / len(hosts)
-	avgCons = cons / len(hosts)
-	for h in hosts:
-		# between -30 and +30 points for element/connection over-/under-population
-		if avgEls:
-			prefs[h] -= max(-20.0, min(10.0 * (h.elements.count() - avgEls) / avgEls, 20.0))
-		if avgCons:
-			prefs[h] -= max(-10.0, min(10.0 * (h.connections.count() - avgCons) / avgCons, 10.0))
-		# STEP 3: calculate preferences based on host location
-	for h in hosts:
-		if h in hostPrefs:
-			prefs[h] += hostPrefs[h]
-		if h.site in sitePrefs:
-			prefs[h] += sitePrefs[h.site]
-	#STEP 4: select the best host
-	hosts.sort(key=lambda h: prefs[h], reverse=True)
-	logging.logMessage("select", category="host", result=hosts[0].name,
-					   prefs=dict([(k.name, v) for k, v in prefs.iteritems()]),
+	logging.logMessage("select", category="host", result=host.name, prefs=prefs,
 					   site=site.name if site else None, element_types=elementTypes, connection_types=connectionTypes,
 					   network_types=networkKinds,
 					   host_prefs=dict([(k.name, v) for k, v in hostPrefs.iteritems()]),
 					   site_prefs=dict([(k.name, v) for k, v in sitePrefs.iteritems()]))
-	return hosts[0]
+	return host
 
 
 @cached(timeout=3600, autoupdate=True)
@@ -766,38 +817,21 @@ def getConnectionCapabilities(type_):
 	return caps
 
 
-checkingHostsLock = threading.RLock()
-checkingHosts = set()
+@util.wrap_task
+def synchronize():
+	for host in Host.getAll():
+		if host.enabled:
+			syncEngine.submit(host)
 
 
 @util.wrap_task
-def synchronizeHost(host):
-	with checkingHostsLock:
-		if host in checkingHosts:
-			return
-		checkingHosts.add(host)
-	try:
-		try:
-			host.update()
-			host.synchronizeResources()
-			host.updateAccountingData()
-		except:
-			import traceback
+def checkConnections():
+	for proxy in _proxies.values():
+		proxy.checkHealth()
 
-			traceback.print_exc()
-			logging.logException(host=host.name)
-			print >>sys.stderr, "Error updating information from %s" % host
-		host.checkProblems()
-	finally:
-		with checkingHostsLock:
-			checkingHosts.remove(host)
 
-
-@util.wrap_task
-def synchronize():
-	for host in Host.getAll():
-		if host.enabled:
-			scheduler.scheduleOnce(0, synchronizeHost, host)  # @UndefinedVariable
+def connectionInfo():
+	return {proxy._host: proxy.info() for proxy in _proxies.values()}
 
 
 @util.wrap_task
@@ -812,6 +846,12 @@ def synchronizeComponents():
 
 from ..auth import Flags, mailFilteredUsers
 from .site import Site
+from .sync import HostSyncEngine
+from .snapshot import HostSnapshot
+
+syncEngine = HostSyncEngine(maxWorkers=config.HOST_SYNC_WORKERS, deadline=config.HOST_SYNC_DEADLINE)
+snapshot = HostSnapshot(maxAge=config.HOST_SNAPSHOT_MAX_AGE)
 
-scheduler.scheduleRepeated(config.HOST_UPDATE_INTERVAL, synchronize)  # @UndefinedVariable
-scheduler.scheduleRepeated(3600, synchronizeComponents)  # @UndefinedVariable
\ No newline at end of file
+scheduler.scheduleRepeated(config.HOST_UPDATE_INTERVAL, synchronize, category="host")  # @UndefinedVariable
+scheduler.scheduleRepeated(3600, synchronizeComponents, category="host")  # @UndefinedVariable
+scheduler.scheduleRepeated(config.HOST_RPC_HEALTH_INTERVAL, checkConnections, category="host", immediate=False)  # @UndefinedVariable
\ No newline at end of file
@@ -63,6 +63,8 @@ class HostConnection(HostObject):
 			self.host.incrementErrors()
 		if self.id:
 			self.delete()
+			from . import snapshot
+			snapshot.adjust(self.host, connections=-1)
 		self.usageStatistics.delete()
 
 	def getElements(self):
@@ -93,9 +95,8 @@ class HostConnection(HostObject):
 	def capabilities(self):
 		return self.host.getConnectionCapabilities(self.type)
 
-	def updateAccountingData(self, data):
-		self.usageStatistics.importRecords(data)
-		self.usageStatistics.removeOld()
+	def updateAccountingData(self, columns, names):
+		return self.usageStatistics.importRecords("5minutes", columns, names)
 
 	def synchronize(self):
 		try:
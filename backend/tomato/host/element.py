@@ -80,6 +80,8 @@ class HostElement(HostObject):
 		try:
 			if self.id:
 				self.delete()
+				from . import snapshot
+				snapshot.adjust(self.host, elements=-1)
 		except OperationError:
 			from .connection import HostConnection
 			for hcon in HostConnection.objects(elementFrom=self):
@@ -117,9 +119,8 @@ class HostElement(HostObject):
 	def capabilities(self):
 		return self.host.getElementCapabilities(self.type)
 
-	def updateAccountingData(self, data):
-		self.usageStatistics.importRecords(data)
-		self.usageStatistics.removeOld()
+	def updateAccountingData(self, columns, names):
+		return self.usageStatistics.importRecords("5minutes", columns, names)
 
 	def synchronize(self):
 		try:
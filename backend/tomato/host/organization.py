@@ -54,7 +54,7 @@ class Organization(Entity, BaseDocument):
 		self.totalUsage.remove()
 
 	def updateUsage(self):
-		self.totalUsage.updateFrom([user.totalUsage for user in self.users])
+		return self.totalUsage.updateFrom([user.totalUsage for user in self.users])
 
 	def __str__(self):
 		return self.name
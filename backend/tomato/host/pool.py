@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from ..lib import rpc
+from ..lib.error import TransportError
+import threading, time
+
+# method info of the hostmanager by software version, shared by all pools
+_methodCache = {}
+_methodCacheLock = threading.RLock()
+
+# errors of single calls, the connection can still be used for other calls
+_CALL_ERRORS = ["network.timeout", "method.unknown_method"]
+
+
+def isBroken(err):
+	"""
+	Returns whether a TransportError means that the connection can not be
+	used anymore, i.e. it could not be established, was reset or closed or
+	the peer violated the protocol.
+	"""
+	return not err.code in _CALL_ERRORS
+
+
+_deadline = threading.local()
+
+class deadline:
+	"""
+	Limits all host calls of the current thread to finish before the given
+	time, see remaining().
+	"""
+	def __init__(self, end):
+		self.end = end
+		self.previous = None
+
+	def __enter__(self):
+		self.previous = getattr(_deadline, "end", None)
+		_deadline.end = self.end
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		_deadline.end = self.previous
+
+
+def remaining(timeout):
+	"""
+	Returns the time that a call of the current thread may take, i.e. the
+	time left until its deadline but at most timeout.
+	"""
+	end = getattr(_deadline, "end", None)
+	if end is None:
+		return timeout
+	return min(timeout, end - time.time())
+
+
+class PooledConnection:
+	def __init__(self, index):
+		self.index = index
+		self.proxy = None
+		self.version = None
+		self.inflight = 0
+		self.failures = 0
+		self.retryAfter = 0.0
+		self.lastUsed = 0.0
+		self.connectLock = threading.Lock()
+
+	@property
+	def usable(self):
+		return self.proxy is not None or self.retryAfter <= time.time()
+
+	def info(self):
+		return {
+			"connected": self.proxy is not None,
+			"version": self.version,
+			"inflight": self.inflight,
+			"failures": self.failures,
+			"retry_after": self.retryAfter if self.retryAfter > time.time() else None,
+			"last_used": self.lastUsed
+		}
+
+
+class ConnectionPool:
+	"""
+	Keeps a number of persistent connections to one hostmanager. Requests are
+	multiplexed over the connections, each call uses the connection with the
+	fewest calls in flight. Callers wait when all connections have reached
+	maxInflight calls.
+	Broken connections are reconnected on the next use. Failed connection
+	attempts are retried with exponential backoff.
+	Non-reusable proxies (XML-RPC) are created per call.
+	"""
+	def __init__(self, url, host, size=2, maxInflight=16, backoff=1.0, maxBackoff=60.0, **proxyArgs):
+		self.url = url
+		self.host = host
+		self.size = size
+		self.maxInflight = maxInflight
+		self.backoff = backoff
+		self.maxBackoff = maxBackoff
+		self.proxyArgs = proxyArgs
+		self.connections = [PooledConnection(i) for i in xrange(size)]
+		self.version = None
+		self.lock = threading.RLock()
+		self.cond = threading.Condition(self.lock)
+		self.calls = 0
+		self.errors = 0
+		self.connects = 0
+		self.reconnects = 0
+		self.connectFailures = 0
+		self.waiting = 0
+		self.waitTime = 0.0
+		self.maxWaitTime = 0.0
+
+	def setVersion(self, version):
+		"""
+		Sets the software version of the hostmanager. Method info is cached per
+		version, connections that were opened for another version refresh their
+		method info on the next use.
+		"""
+		with self.lock:
+			self.version = version
+
+	def _methods(self):
+		with _methodCacheLock:
+			return _methodCache.get(self.version) if self.version else None
+
+	def _getProxy(self, con):
+		# called without lock, con is reserved by the caller
+		with con.connectLock:
+			if con.proxy is not None:
+				if self.version and con.version != self.version:
+					self._refreshMethods(con)
+				return con.proxy
+			proxy = self._connect(con)
+			if rpc.isReusable(proxy):
+				con.proxy = proxy
+			return proxy
+
+	def _connect(self, con):
+		methods = self._methods()
+		try:
+			proxy = rpc.createProxy(self.url, methods=methods, **self.proxyArgs)
+		except:
+			with self.lock:
+				self.connectFailures += 1
+				con.failures += 1
+				con.retryAfter = time.time() + min(self.backoff * 2 ** (con.failures - 1), self.maxBackoff)
+			raise
+		info = rpc.methodInfo(proxy)
+		if self.version and info is not None and methods is None:
+			with _methodCacheLock:
+				_methodCache[self.version] = info
+		with self.lock:
+			if con.failures or con.version:
+				self.reconnects += 1
+			self.connects += 1
+			con.failures = 0
+			con.retryAfter = 0.0
+			con.version = self.version
+		return proxy
+
+	def _refreshMethods(self, con):
+		methods = self._methods()
+		if methods is None:
+			methods = con.proxy._call("$infoall$")
+			with _methodCacheLock:
+				_methodCache[self.version] = methods
+		con.proxy._methods = methods
+		con.version = self.version
+
+	def _select(self):
+		with self.lock:
+			usable = [con for con in self.connections if con.usable]
+			if not usable:
+				retryAfter = min(con.retryAfter for con in self.connections)
+				raise TransportError(code=TransportError.CONNECT, message="Host is not reachable, retrying in %.1f seconds" % (retryAfter - time.time()),
+									 module="backend", data={"host": self.host})
+			con = min(usable, key=lambda con: (con.inflight, con.proxy is None))
+			if con.inflight >= self.maxInflight:
+				return None
+			con.inflight += 1
+			con.lastUsed = time.time()
+			return con
+
+	def _acquire(self, timeout):
+		start = time.time()
+		con = self._select()
+		if not con:
+			with self.lock:
+				self.waiting += 1
+				try:
+					while not con:
+						remaining = start + timeout - time.time()
+						if remaining <= 0:
+							raise TransportError(code=TransportError.CONNECT, message="Timeout waiting for a connection",
+												 module="backend", data={"host": self.host})
+						self.cond.wait(remaining)
+						con = self._select()
+				finally:
+					self.waiting -= 1
+		wait = time.time() - start
+		with self.lock:
+			self.waitTime += wait
+			self.maxWaitTime = max(self.maxWaitTime, wait)
+		return con
+
+	def _release(self, con, proxy=None):
+		with self.lock:
+			con.inflight -= 1
+			if proxy is not None and con.proxy is proxy:
+				# the connection is broken, it will be reopened on the next use
+				proxy._close()
+				con.proxy = None
+			self.cond.notify()
+
+	def call(self, fn, timeout=60.0):
+		"""
+		Calls fn with a proxy to the host and returns its result.
+		TransportErrors that break the connection (see isBroken) close it,
+		other calls on the connection are not affected by errors of this one.
+		"""
+		with self.lock:
+			self.calls += 1
+		con = self._acquire(timeout)
+		proxy = broken = None
+		try:
+			proxy = self._getProxy(con)
+			return fn(proxy)
+		except TransportError, err:
+			if isBroken(err):
+				broken = proxy if proxy is not None else con.proxy
+			with self.lock:
+				self.errors += 1
+			raise
+		finally:
+			self._release(con, broken)
+
+	def hasMethod(self, name):
+		"""
+		Returns whether the hostmanager offers the given method or None if the
+		protocol can not tell.
+		"""
+		methods = self.call(rpc.methodInfo)
+		return name in methods if methods is not None else None
+
+	def checkHealth(self, idle=60.0):
+		"""
+		Pings connections that have not been used for idle seconds and
+		reconnects broken connections whose backoff time has passed.
+		"""
+		now = time.time()
+		for con in self.connections:
+			with self.lock:
+				if con.inflight or not con.usable or (con.proxy and con.lastUsed > now - idle):
+					continue
+				con.inflight += 1
+			proxy = broken = None
+			try:
+				connected = con.proxy is not None
+				proxy = self._getProxy(con)
+				if connected and con.proxy is proxy:
+					proxy._call("$list$")
+				con.lastUsed = time.time()
+			except Exception:
+				broken = proxy
+			finally:
+				self._release(con, broken)
+
+	def close(self):
+		with self.lock:
+			for con in self.connections:
+				if con.proxy:
+					con.proxy._close()
+					con.proxy = None
+
+	def info(self):
+		with self.lock:
+			return {
+				"url": self.url,
+				"version": self.version,
+				"size": self.size,
+				"max_inflight": self.maxInflight,
+				"inflight": sum(con.inflight for con in self.connections),
+				"calls": self.calls,
+				"errors": self.errors,
+				"connects": self.connects,
+				"reconnects": self.reconnects,
+				"connect_failures": self.connectFailures,
+				"waiting": self.waiting,
+				"wait_time": {
+					"total": self.waitTime,
+					"avg": self.waitTime / self.calls if self.calls else None,
+					"max": self.maxWaitTime
+				},
+				"connections": [con.info() for con in self.connections]
+			}
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from .. import config, starttime
+import threading, time
+
+
+def _networkKinds(kinds):
+	kinds = set(kinds)
+	for kind in list(kinds):
+		if "/" in kind:
+			kinds.add(kind.split("/", 1)[0])
+	if kinds:
+		kinds.add(None)
+	return frozenset(kinds)
+
+
+class HostSnapshot:
+	"""
+	Scheduling data of all hosts in parallel arrays with one entry per host.
+	The snapshot is built with a few queries, updated for single hosts after
+	each host sync and rebuilt completely after maxAge seconds. Element,
+	connection and error counts are updated when components are placed or
+	removed, so selecting a host needs no database queries.
+	"""
+	def __init__(self, maxAge=600):
+		self.maxAge = maxAge
+		self.lock = threading.RLock()
+		self.timestamp = 0
+		self.rebuilds = 0
+		self.updates = 0
+		self._clear()
+
+	def _clear(self):
+		self.index = {} # host id -> position in the arrays
+		self.ids = []
+		self.names = []
+		self.sites = []
+		self.problems = []
+		self.infoTimestamps = []
+		self.resourceTimestamps = []
+		self.loads = []
+		self.errors = []
+		self.elements = []
+		self.connections = []
+		self.elementTypes = []
+		self.connectionTypes = []
+		self.networkKinds = []
+
+	def _set(self, i, host, elements, connections, networkKinds):
+		self.ids[i] = host.id
+		self.names[i] = host.name
+		self.sites[i] = host.getFieldId('site')
+		self.problems[i] = bool(host.problems())
+		self.infoTimestamps[i] = host.hostInfoTimestamp or 0
+		self.resourceTimestamps[i] = host.lastResourcesSync or 0
+		self.loads[i] = host.getLoad()
+		self.errors[i] = host.componentErrors
+		self.elements[i] = elements
+		self.connections[i] = connections
+		self.elementTypes[i] = frozenset(host.elementTypes.keys())
+		self.connectionTypes[i] = frozenset(host.connectionTypes.keys())
+		self.networkKinds[i] = _networkKinds(networkKinds)
+
+	def _append(self, host, elements, connections, networkKinds):
+		self.index[host.id] = len(self.ids)
+		for array in [self.ids, self.names, self.sites, self.problems, self.infoTimestamps, self.resourceTimestamps,
+					  self.loads, self.errors, self.elements, self.connections, self.elementTypes,
+					  self.connectionTypes, self.networkKinds]:
+			array.append(None)
+		self._set(len(self.ids) - 1, host, elements, connections, networkKinds)
+
+	def rebuild(self):
+		from . import Host
+		from .element import HostElement
+		from .connection import HostConnection
+		from ..resources.network import Network, NetworkInstance
+		elements, connections, kinds = {}, {}, {}
+		for hel in HostElement.objects.only('host'):
+			hostId = hel.getFieldId('host')
+			elements[hostId] = elements.get(hostId, 0) + 1
+		for hcon in HostConnection.objects.only('host'):
+			hostId = hcon.getFieldId('host')
+			connections[hostId] = connections.get(hostId, 0) + 1
+		networks = dict((net.id, net.kind) for net in Network.objects.only('kind'))
+		for inst in NetworkInstance.objects.only('host', 'network'):
+			kind = networks.get(inst.getFieldId('network'))
+			if kind:
+				kinds.setdefault(inst.getFieldId('host'), []).append(kind)
+		self.load(Host.getAll(), elements, connections, kinds)
+
+	def load(self, hosts, elements, connections, networkKinds):
+		"""
+		Replaces the snapshot with the given hosts. elements, connections and
+		networkKinds map host ids to the number of elements and connections
+		and the network kinds of the host.
+		"""
+		with self.lock:
+			self._clear()
+			for host in hosts:
+				self._append(host, elements.get(host.id, 0), connections.get(host.id, 0), networkKinds.get(host.id, []))
+			self.timestamp = time.time()
+			self.rebuilds += 1
+
+	def check(self):
+		"""
+		Rebuilds the snapshot if it is older than maxAge.
+		"""
+		if time.time() - self.timestamp > self.maxAge:
+			self.rebuild()
+
+	def updateHost(self, host):
+		"""
+		Reloads the entry of the host, called after it has been synchronized
+		or modified.
+		"""
+		if not host.id:
+			return
+		elements = host.elements.count()
+		connections = host.connections.count()
+		kinds = [net.getKind() for net in host.networks.all()]
+		with self.lock:
+			i = self.index.get(host.id)
+			if i is None:
+				self._append(host, elements, connections, kinds)
+			else:
+				self._set(i, host, elements, connections, kinds)
+			self.updates += 1
+
+	def removeHost(self, host):
+		with self.lock:
+			if host.id in self.index:
+				# removing single entries would shift all positions
+				self.timestamp = 0
+
+	def adjust(self, host, elements=0, connections=0, errors=0):
+		"""
+		Updates the counts of a host after components have been placed on it
+		or removed from it.
+		"""
+		with self.lock:
+			i = self.index.get(host.id)
+			if i is None:
+				return
+			self.elements[i] = max(0, self.elements[i] + elements)
+			self.connections[i] = max(0, self.connections[i] + connections)
+			self.errors[i] = max(0, self.errors[i] + errors)
+
+	def candidates(self, siteId=None, elementTypes=(), connectionTypes=(), networkKinds=()):
+		"""
+		Returns the positions of all hosts without problems that offer the
+		given types and network kinds.
+		"""
+		elementTypes, connectionTypes, networkKinds = set(elementTypes), set(connectionTypes), set(networkKinds)
+		now = time.time()
+		infoLimit = now - 2 * config.HOST_UPDATE_INTERVAL - 300
+		resourceLimit = now - 2 * config.RESOURCES_SYNC_INTERVAL - 300
+		return [i for i in xrange(len(self.ids))
+				if not self.problems[i] and self.errors[i] <= 2
+				and (siteId is None or self.sites[i] == siteId)
+				and max(self.infoTimestamps[i], starttime) >= infoLimit
+				and max(self.resourceTimestamps[i], starttime) >= resourceLimit
+				and elementTypes <= self.elementTypes[i]
+				and connectionTypes <= self.connectionTypes[i]
+				and networkKinds <= self.networkKinds[i]]
+
+	def scores(self, candidates, hostPrefs=None, sitePrefs=None, extraElements=None):
+		"""
+		Scores the candidates by errors, load and element/connection counts
+		relative to the average of all candidates plus the given preferences
+		by host id and site id. extraElements maps positions to elements that
+		are about to be placed on these hosts.
+		"""
+		count = float(len(candidates))
+		errors = [self.errors[i] for i in candidates]
+		loads = [self.loads[i] for i in candidates]
+		elements = [self.elements[i] for i in candidates]
+		if extraElements:
+			elements = [n + extraElements.get(i, 0) for n, i in zip(elements, candidates)]
+		connections = [self.connections[i] for i in candidates]
+		# discourage hosts with previous errors, up to -100 points for load
+		scores = [-25.0 * e - 100.0 * l for e, l in zip(errors, loads)]
+		# between -30 and +30 points for element/connection over-/under-population
+		avgEls = sum(elements) / count
+		if avgEls:
+			scores = [s - max(-20.0, min(10.0 * (n - avgEls) / avgEls, 20.0)) for s, n in zip(scores, elements)]
+		avgCons = sum(connections) / count
+		if avgCons:
+			scores = [s - max(-10.0, min(10.0 * (n - avgCons) / avgCons, 10.0)) for s, n in zip(scores, connections)]
+		if hostPrefs:
+			scores = [s + hostPrefs.get(self.ids[i], 0.0) for s, i in zip(scores, candidates)]
+		if sitePrefs:
+			scores = [s + sitePrefs.get(self.sites[i], 0.0) for s, i in zip(scores, candidates)]
+		return scores
+
+	def select(self, site=None, elementTypes=(), connectionTypes=(), networkKinds=(), hostPrefs=None, sitePrefs=None):
+		"""
+		Returns the id of the best host and the scores of all candidates by
+		host name. The id is None if no host fulfills the requirements.
+		"""
+		with self.lock:
+			self.check()
+			candidates = self.candidates(site.id if site else None, elementTypes, connectionTypes, networkKinds)
+			if not candidates:
+				return None, {}
+			scores = self.scores(candidates, hostPrefs, sitePrefs)
+			best = max(xrange(len(candidates)), key=scores.__getitem__)
+			return self.ids[candidates[best]], dict((self.names[i], s) for i, s in zip(candidates, scores))
+
+	def info(self):
+		with self.lock:
+			return {
+				"hosts": len(self.ids),
+				"age": time.time() - self.timestamp if self.timestamp else None,
+				"max_age": self.maxAge,
+				"rebuilds": self.rebuilds,
+				"updates": self.updates,
+				"elements": sum(self.elements),
+				"connections": sum(self.connections)
+			}
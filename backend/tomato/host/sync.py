@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from ..lib import logging
+from . import pool
+import threading, time, sys, Queue
+
+class HostSyncState:
+	def __init__(self, name):
+		self.name = name
+		self.queued = None
+		self.started = None
+		self.finished = None
+		self.phases = {}
+		self.deadlineExceeded = 0
+		self.errors = 0
+		self.runs = 0
+
+	def info(self):
+		return {
+			"queued": self.queued,
+			"started": self.started,
+			"finished": self.finished,
+			"busy": bool(self.started) and (not self.finished or self.finished < self.started),
+			"wait": (self.started - self.queued) if self.started and self.queued and self.started >= self.queued else None,
+			"duration": (self.finished - self.started) if self.finished and self.started and self.finished >= self.started else None,
+			"phases": dict(self.phases),
+			"deadline_exceeded": self.deadlineExceeded,
+			"errors": self.errors,
+			"runs": self.runs
+		}
+
+
+class HostSyncEngine:
+	"""
+	Synchronizes hosts on its own bounded set of worker threads so that
+	host synchronization does not occupy the shared task scheduler.
+	Each host synchronization is split into phases whose latency is
+	recorded. The deadline of a host limits the timeout of its RPC calls,
+	once it is exceeded the remaining phases are skipped until the next run.
+	"""
+	def __init__(self, maxWorkers=10, deadline=120.0, idleTimeout=60.0):
+		self.maxWorkers = maxWorkers
+		self.deadline = deadline
+		self.idleTimeout = idleTimeout
+		self.queue = Queue.Queue()
+		self.states = {}
+		self.pending = set()
+		self.workers = 0
+		self.idle = 0
+		self.lock = threading.RLock()
+
+	def _getState(self, host):
+		with self.lock:
+			if not host.name in self.states:
+				self.states[host.name] = HostSyncState(host.name)
+			return self.states[host.name]
+
+	def submit(self, host):
+		"""
+		Queues the host for synchronization unless it is already queued or
+		being synchronized. Returns whether the host has been queued.
+		"""
+		with self.lock:
+			if host.name in self.pending:
+				return False
+			self.pending.add(host.name)
+			self._getState(host).queued = time.time()
+			self.queue.put(host)
+			if self.workers < self.maxWorkers and self.queue.qsize() > self.idle:
+				self.workers += 1
+				worker = threading.Thread(target=self._workerLoop, name="host-sync")
+				worker.daemon = True
+				worker.start()
+		return True
+
+	def _workerLoop(self):
+		while True:
+			with self.lock:
+				self.idle += 1
+			try:
+				host = self.queue.get(timeout=self.idleTimeout)
+			except Queue.Empty:
+				with self.lock:
+					self.idle -= 1
+					if self.queue.empty():
+						self.workers -= 1
+						return
+				continue
+			with self.lock:
+				self.idle -= 1
+			try:
+				self.synchronize(host)
+			finally:
+				with self.lock:
+					self.pending.discard(host.name)
+
+	def _runPhase(self, state, name, fn):
+		start = time.time()
+		try:
+			fn()
+		finally:
+			state.phases[name] = time.time() - start
+
+	def synchronize(self, host):
+		state = self._getState(host)
+		state.started = time.time()
+		state.phases = {}
+		state.runs += 1
+		deadline = state.started + self.deadline
+		try:
+			try:
+				with pool.deadline(deadline):
+					for name, fn in [("update", host.update), ("resources", host.synchronizeResources),
+									 ("accounting", host.updateAccountingData)]:
+						if time.time() > deadline:
+							break
+						self._runPhase(state, name, fn)
+			except:
+				import traceback
+				traceback.print_exc()
+				state.errors += 1
+				logging.logException(host=host.name)
+				print >>sys.stderr, "Error updating information from %s" % host
+			if time.time() > deadline:
+				state.deadlineExceeded += 1
+				logging.logMessage("sync deadline exceeded", category="host", name=host.name, phases=state.phases)
+			self._runPhase(state, "problems", host.checkProblems)
+			from . import snapshot
+			self._runPhase(state, "snapshot", lambda: snapshot.updateHost(host))
+		except:
+			from .. import handleError
+			handleError()
+		finally:
+			state.finished = time.time()
+
+	def info(self):
+		with self.lock:
+			return {
+				"max_workers": self.maxWorkers,
+				"deadline": self.deadline,
+				"workers": self.workers,
+				"idle": self.idle,
+				"queue": self.queue.qsize(),
+				"hosts": {name: state.info() for name, state in self.states.items()}
+			}
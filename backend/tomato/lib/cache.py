@@ -15,7 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import time, sys, threading, thread
+import time, sys, threading, collections
+
+STRIPES = 8 # maximal number of independently locked parts of a cache
+STRIPE_MIN_SIZE = 16
+
+_caches = []
 
 class CacheUpdater:
 	caches = []
@@ -25,100 +30,229 @@ class CacheUpdater:
 		self.caches.remove(cache)
 	def start_updating(self, interval):
 		from .. import scheduler
-		scheduler.scheduleRepeated(interval, self.update_all, immediate=False)
+		scheduler.scheduleRepeated(interval, self.update_all, immediate=False, category="maintenance")
 	def update_all(self):
 		for cache in list(self.caches):
 			cache.update_all()
+	def refresh(self, cache, args, kwargs):
+		"""
+		Recalculates a stale value in the background.
+		"""
+		from .. import scheduler
+		scheduler.scheduleOnce(0, cache.refresh, args, kwargs, category="maintenance")
 cache_updater = None
 
+class _Entry:
+	__slots__ = ['value', 'timeout', 'auto_timeout', 'stale_timeout', 'args', 'kwargs']
+	def __init__(self, value, timeout, auto_timeout, stale_timeout, args, kwargs):
+		self.value = value
+		self.timeout = timeout
+		self.auto_timeout = auto_timeout
+		self.stale_timeout = stale_timeout
+		self.args = args
+		self.kwargs = kwargs
+
+class _Flight:
+	"""
+	A running calculation of a value that other threads can wait for.
+	"""
+	def __init__(self):
+		self.event = threading.Event()
+		self.value = None
+		self.error = None
+
+class _Stripe:
+	def __init__(self, maxSize):
+		self.maxSize = maxSize
+		self.lock = threading.RLock()
+		self.entries = collections.OrderedDict() #{key:_Entry} in LRU order, the oldest first
+		self.flights = {} #{key:_Flight}
+		self.refreshing = set()
+		self.hits = 0
+		self.stale_hits = 0
+		self.misses = 0
+		self.waits = 0
+		self.evictions = 0
+		self.errors = 0
+
 class Cache:
-	def __init__(self, fn=None, maxSize=100, timeout=None, autoupdate=False):
-		self._values={} #{key:{value, timeout, auto_timeout, args, kwargs}}
-		self._order=[]  #[key]
+	"""
+	LRU cache of function results by their arguments.
+	The keys are distributed over up to STRIPES stripes that are locked
+	independently, each stripe keeps its entries in LRU order in an ordered
+	dict so that lookups and insertions take constant time.
+	Values of one key are only calculated by one thread at a time, other
+	threads that miss the same key wait for that result. Caches with
+	autoupdate refresh their values after 3/4 of the timeout and return
+	expired values for up to staleTime seconds while they are recalculated in
+	the background.
+	"""
+	def __init__(self, fn=None, maxSize=100, timeout=None, autoupdate=False, staleTime=None, name=None):
 		self._maxSize=maxSize
 		self._timeout=timeout
 		self._fn = fn
-		self._lock = threading.RLock()
 		self._autoupdate = autoupdate
+		if staleTime is None:
+			staleTime = 0.5*timeout if autoupdate and timeout else 0
+		self._staleTime = staleTime
+		self._name = name or (fn.__module__ + "." + fn.__name__ if fn else None)
+		stripes = max(1, min(STRIPES, maxSize // STRIPE_MIN_SIZE))
+		self._stripes = [_Stripe(-(-maxSize // stripes)) for _ in xrange(stripes)]
 		self._autoupdate_registered = not self._autoupdate # registration for auto-updates will be checked when a value is set.
 															# this is false iff this cache needs to be added to the auto updater.
+		_caches.append(self)
 	@staticmethod
 	def getKey(args, kwargs):
 		return (tuple(args), tuple(kwargs.items()))
+	def _stripe(self, key):
+		return self._stripes[hash(key) % len(self._stripes)]
 	def get(self, args, kwargs):
 		key = Cache.getKey(args, kwargs)
-		with self._lock:
-			if (not key in self._values) or (self._values[key]['timeout'] <= time.time()):
-				self.update(args, kwargs)
-			return self._values[Cache.getKey(args, kwargs)]['value']
+		stripe = self._stripe(key)
+		now = time.time()
+		refresh = False
+		with stripe.lock:
+			entry = stripe.entries.pop(key, None)
+			if entry is not None:
+				stripe.entries[key] = entry
+				if entry.timeout > now:
+					stripe.hits += 1
+					return entry.value
+				if entry.stale_timeout > now:
+					stripe.stale_hits += 1
+					refresh = not key in stripe.refreshing
+					stripe.refreshing.add(key)
+				else:
+					entry = None
+			if entry is None:
+				stripe.misses += 1
+		if entry is None:
+			return self._calculate(key, args, kwargs)
+		if refresh:
+			if cache_updater is not None:
+				cache_updater.refresh(self, args, kwargs)
+			else:
+				self.refresh(args, kwargs)
+		return entry.value
+	def _calculate(self, key, args, kwargs, wait=True):
+		stripe = self._stripe(key)
+		with stripe.lock:
+			flight = stripe.flights.get(key)
+			owner = flight is None
+			if owner:
+				flight = stripe.flights[key] = _Flight()
+			elif wait:
+				stripe.waits += 1
+		if not owner:
+			if not wait:
+				return None
+			flight.event.wait()
+			if flight.error:
+				raise flight.error[0], flight.error[1], flight.error[2]
+			return flight.value
+		try:
+			calltime = time.time()
+			flight.value = self._fn(*args, **kwargs)
+			self.set(args, kwargs, flight.value, calltime=calltime)
+			return flight.value
+		except:
+			flight.error = sys.exc_info()
+			with stripe.lock:
+				stripe.errors += 1
+			raise
+		finally:
+			with stripe.lock:
+				del stripe.flights[key]
+			flight.event.set()
 	def update(self, args, kwargs):
-		calltime = time.time()
-		value = self._fn(*args, **kwargs) #there may be concurrent method calls here. set() will resolve this.
-		self.set(args, kwargs, value, calltime=calltime)
+		self._calculate(Cache.getKey(args, kwargs), args, kwargs)
+	def refresh(self, args, kwargs):
+		"""
+		Recalculates the value unless another thread is already calculating it.
+		"""
+		key = Cache.getKey(args, kwargs)
+		try:
+			self._calculate(key, args, kwargs, wait=False)
+		finally:
+			stripe = self._stripe(key)
+			with stripe.lock:
+				stripe.refreshing.discard(key)
 	def set(self, args, kwargs, value, calltime=None):
 		key = Cache.getKey(args, kwargs)
 		if calltime is None:
 			calltime = time.time()
-		with self._lock:
-			
-			timeout = (calltime + self._timeout) if self._timeout else sys.maxint
-			auto_timeout = timeout - 0.25*self._timeout if self._timeout else sys.maxint #auto-refresh triggers after 3/4 timeout
-			
-			#check whether another thread has accessed this function concurrently (may happen in update). If yes, do not save this.
-			if key in self._values:
-				if self._values[key]['timeout'] > timeout:
-					return
-			
-			#clear oldest entry if cache is full
-			if len(self._order) >= self._maxSize:
-				delkey = self._order.pop(0)
-				del self._values[delkey]
-				
-			#make sure that this key is not in _order (it may only be once in there)
-			if key in self._values:
-				self._order.remove(key)
-				
-			#save
-			self._order.append(key)
-			self._values[key] = {'value':value,
-								 'timeout':timeout,
-								 'auto_timeout':auto_timeout,
-								 'args':args,
-								 'kwargs':kwargs}
-			
-			#finally, register this cache for auto-update if needed.
-			if not self._autoupdate_registered:
-				if cache_updater is not None:
-					cache_updater.add(self)
-					self._autoupdate_registered = True
+		timeout = (calltime + self._timeout) if self._timeout else sys.maxint
+		auto_timeout = timeout - 0.25*self._timeout if self._timeout else sys.maxint #auto-refresh triggers after 3/4 timeout
+		stripe = self._stripe(key)
+		with stripe.lock:
+			#check whether another thread has set a newer value concurrently. If yes, do not save this.
+			old = stripe.entries.pop(key, None)
+			if old is not None and old.timeout > timeout:
+				stripe.entries[key] = old
+				return
+			stripe.entries[key] = _Entry(value, timeout, auto_timeout, timeout + self._staleTime, args, kwargs)
+			#clear oldest entries if the stripe is full
+			while len(stripe.entries) > stripe.maxSize:
+				stripe.entries.popitem(last=False)
+				stripe.evictions += 1
+		#finally, register this cache for auto-update if needed.
+		if not self._autoupdate_registered:
+			if cache_updater is not None:
+				cache_updater.add(self)
+				self._autoupdate_registered = True
 	def remove(self, args, kwargs):
-		with self._lock:
-			key = Cache.getKey(args, kwargs)
-			del self._values[key]
-			self._order.remove(key)
+		key = Cache.getKey(args, kwargs)
+		stripe = self._stripe(key)
+		with stripe.lock:
+			stripe.entries.pop(key, None)
 	def contains(self, args, kwargs):
-		with self._lock:
-			return Cache.getKey(args, kwargs) in self._values
+		key = Cache.getKey(args, kwargs)
+		stripe = self._stripe(key)
+		with stripe.lock:
+			return key in stripe.entries
 	def clear(self):
-		with self._lock:
-			self._values = {}
-			self._order = []
+		for stripe in self._stripes:
+			with stripe.lock:
+				stripe.entries.clear()
 	def update_all(self):
 		if self._autoupdate:
-			for key in list(self._order): #since maxsize is bounded, this is not a scaling problem.
-				with self._lock: #release the lock between all cycles to allow other threads to step in between two iterations.
-								#    This function can only change the order of entries, but does not delete any.
-								# Concurrent calls may remove the first entries of the list. In this case, this function should ignore these entries.
-								#    However, there is only a really slight chance that this happens, and it doesn't lead to inconsistency.
-								#	 This only means there is no guarantee that the key is still in the list when entering the lock.
-								#        Conclusion: only do something if the key is still cached.
-					if key in self._values:
-						res = self._values[key]
-						if res['auto_timeout'] <= time.time():
-							self.update(res['args'], res['kwargs'])
-		
-		
-	
+			now = time.time()
+			for stripe in self._stripes:
+				with stripe.lock: #only hold the lock while collecting the entries to refresh
+					entries = [entry for entry in stripe.entries.itervalues() if entry.auto_timeout <= now]
+				for entry in entries:
+					try:
+						self.refresh(entry.args, entry.kwargs)
+					except:
+						import traceback
+						traceback.print_exc()
+	def info(self):
+		res = {"max_size": self._maxSize, "timeout": self._timeout, "autoupdate": self._autoupdate,
+			   "stripes": len(self._stripes), "size": 0, "flights": 0}
+		for name in ["hits", "stale_hits", "misses", "waits", "evictions", "errors"]:
+			res[name] = 0
+		for stripe in self._stripes:
+			with stripe.lock:
+				res["size"] += len(stripe.entries)
+				res["flights"] += len(stripe.flights)
+				for name in ["hits", "stale_hits", "misses", "waits", "evictions", "errors"]:
+					res[name] += getattr(stripe, name)
+		return res
+
+
+def info():
+	"""
+	Returns the statistics of all caches by name.
+	"""
+	res = {}
+	for cache in list(_caches):
+		name = cache._name or "cache-%x" % id(cache)
+		while name in res:
+			name += "'"
+		res[name] = cache.info()
+	return res
+
+
 class CachedMethod:
 	def __init__(self, cache):
 		self._cache = cache
@@ -132,18 +132,34 @@ class LinkStatistics(BaseDocument):
 		self.single.append(measurement)
 		self.save()
 
-	def removeOld(self):
+	def _removeOld(self):
 		for type_ in TYPES:
 			list_ = self._getList(type_)
 			list_[:] = filter(lambda e: e.end > _toTime(_toPoint(time.time()) - MAX_AGE[type_]), list_[-KEEP_RECORDS[type_]:])
-		self.save()
+
+	def _housekeepUpdate(self):
+		"""
+		Combines measurements and removes old ones locally and returns the update
+		that has to be applied to the stored document (None if unchanged).
+		"""
+		def state(list_):
+			return (len(list_), list_[-1].end if list_ else None)
+		before = dict((type_, state(self._getList(type_))) for type_ in TYPES)
+		self._removeOld()
+		self._combine()
+		self._removeOld()
+		update = {}
+		for type_ in TYPES:
+			list_ = self._getList(type_)
+			if state(list_) != before[type_]:
+				update[type_] = [lm.to_mongo() for lm in list_]
+		return {"$set": update} if update else None
 
 	def housekeep(self):
-		self.removeOld()
-		self.combine()
-		self.removeOld()
+		if self._housekeepUpdate():
+			self.save()
 
-	def combine(self):
+	def _combine(self):
 		lastList = self._getList(TYPES[0])
 		now = time.time()
 		for type_ in TYPES[1:]:
@@ -174,7 +190,6 @@ class LinkStatistics(BaseDocument):
 				begin = end
 				end = _toTime(_nextPoint(_toPoint(end), type_))
 			lastList = list_
-		self.save()
 
 
 def _measure():
@@ -217,8 +232,7 @@ def _measure():
 @util.wrap_task
 def taskRun():
 	_measure()
-	for ls in LinkStatistics.objects:
-		ls.housekeep()
+	return batchUpdate(LinkStatistics.objects(), LinkStatistics._housekeepUpdate)
 
 def getStatistics(siteA, siteB): #@ReservedAssignment
 	siteA = Site.get(siteA)
@@ -231,4 +245,4 @@ def getStatistics(siteA, siteB): #@ReservedAssignment
 	except LinkStatistics.DoesNotExist:
 		return None
 
-scheduler.scheduleRepeated(60, taskRun) #every minute
\ No newline at end of file
+scheduler.scheduleRepeated(60, taskRun, category="accounting") #every minute
\ No newline at end of file
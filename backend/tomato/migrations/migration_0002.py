@@ -0,0 +1,30 @@
+from mongoengine.connection import get_db
+
+# Converts the usage statistics from lists of embedded records to one series
+# of parallel arrays per type.
+
+TYPES = ["5minutes", "hour", "day", "month", "year"]
+
+
+def _convert(records):
+	return {
+		"b": [rec["b"] for rec in records],
+		"e": [rec["e"] for rec in records],
+		"n": [rec.get("m", 0) for rec in records],
+		"c": [rec.get("u", {}).get("c", 0.0) for rec in records],
+		"m": [rec.get("u", {}).get("m", 0.0) for rec in records],
+		"d": [rec.get("u", {}).get("d", 0.0) for rec in records],
+		"t": [rec.get("u", {}).get("t", 0.0) for rec in records]
+	}
+
+
+def migrate():
+	collection = get_db()["usage_statistics"]
+	for doc in collection.find():
+		update = {}
+		for type_ in TYPES:
+			records = doc.get(type_)
+			if records is None or isinstance(records, list):
+				update[type_] = _convert(records or [])
+		if update:
+			collection.update({"_id": doc["_id"]}, {"$set": update})
@@ -0,0 +1,18 @@
+from mongoengine.connection import get_db
+
+# Stores the organization of the user in each permission entry.
+
+COLLECTIONS = ["topology", "element", "connection"]
+
+
+def migrate():
+	db = get_db()
+	organizations = dict((user["_id"], user.get("organization")) for user in db["user"].find({}, {"organization": 1}))
+	for name in COLLECTIONS:
+		collection = db[name]
+		for doc in collection.find({"permissions": {"$elemMatch": {"organization": {"$exists": False}}}}, {"permissions": 1}):
+			permissions = doc["permissions"]
+			for perm in permissions:
+				if not "organization" in perm:
+					perm["organization"] = organizations.get(perm.get("user"))
+			collection.update({"_id": doc["_id"]}, {"$set": {"permissions": permissions}})
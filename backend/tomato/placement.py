@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from lib import logging #@UnresolvedImport
+from contextlib import contextmanager
+import threading, time
+
+# Preference points per link between two elements depending on where they are
+# placed. Links between hosts need tunnel elements, links between sites also
+# suffer from the measured delay and loss.
+SAME_HOST_LINK = 15.0
+SAME_SITE_LINK = 5.0
+OTHER_SITE_LINK = -10.0
+MAX_LINK_PENALTY = 50.0
+# Preference that is added for the planned host when the element is prepared
+PLAN_AFFINITY = 1000.0
+
+_plans = {}
+_plansLock = threading.RLock()
+
+
+class PlacementPlan:
+	"""
+	Assignment of the VM elements of a topology to hosts. The plan is applied
+	by preparing the topology while it is active (see use()), the elements
+	then prefer their planned hosts in host.select().
+	"""
+	def __init__(self, topology):
+		self.topologyId = topology.idStr
+		self.hosts = {} # element id -> Host
+		self.scores = {} # element id -> score of the planned host
+		self.unplaced = []
+		self.links = {"same_host": 0, "same_site": 0, "other_site": 0}
+		self.duration = 0.0
+
+	def hostFor(self, element):
+		return self.hosts.get(element.idStr)
+
+	def info(self):
+		return {
+			"topology": self.topologyId,
+			"elements": dict((elId, host.name) for elId, host in self.hosts.iteritems()),
+			"scores": self.scores,
+			"unplaced": self.unplaced,
+			"links": self.links,
+			"duration": self.duration
+		}
+
+
+def _node(el):
+	# interfaces and endpoints are placed with their parent element
+	return el.parentId or el.idStr
+
+
+def _linkGraph(elements, connections, placeable):
+	"""
+	Returns the weighted links between the placeable elements as a dict of
+	element id -> {element id: weight}. Elements that are linked through
+	another element (e.g. a switch) are linked with each other, the weight is
+	split over all elements of that switch.
+	"""
+	nodes = dict((el.idStr, _node(el)) for el in elements)
+	neighbors = {}
+	for con in connections:
+		a, b = nodes.get(con.elementFromId), nodes.get(con.elementToId)
+		if not a or not b or a == b:
+			continue
+		neighbors.setdefault(a, []).append(b)
+		neighbors.setdefault(b, []).append(a)
+	graph = dict((elId, {}) for elId in placeable)
+	def link(a, b, weight):
+		graph[a][b] = graph[a].get(b, 0.0) + weight
+		graph[b][a] = graph[b].get(a, 0.0) + weight
+	for node, nbs in neighbors.iteritems():
+		if node in placeable:
+			for nb in nbs:
+				if nb in placeable and node < nb:
+					link(node, nb, 1.0)
+		else:
+			nbs = sorted(set(nb for nb in nbs if nb in placeable))
+			for i, a in enumerate(nbs):
+				for b in nbs[i+1:]:
+					link(a, b, 1.0 / (len(nbs) - 1))
+	return graph
+
+
+def _linkPenalties():
+	"""
+	Returns the penalty for links between two sites by pairs of site ids,
+	calculated from the latest measurement in LinkStatistics.
+	"""
+	from .link import LinkStatistics
+	penalties = {}
+	for stats in LinkStatistics.objects.only('siteA', 'siteB', 'single', 'by5minutes', 'byHour'):
+		for list_ in [stats.byHour, stats.by5minutes, stats.single]:
+			if list_ and list_[-1].measurements:
+				lm = list_[-1]
+				penalty = min(-OTHER_SITE_LINK + lm.delayAvg / 10.0 + lm.loss * 100.0, MAX_LINK_PENALTY)
+				siteA, siteB = stats.getFieldId('siteA'), stats.getFieldId('siteB')
+				penalties[(siteA, siteB)] = penalties[(siteB, siteA)] = penalty
+				break
+	return penalties
+
+
+def _linkScore(snapshot, i, j, penalties):
+	if i == j:
+		return SAME_HOST_LINK
+	siteA, siteB = snapshot.sites[i], snapshot.sites[j]
+	if siteA == siteB:
+		return SAME_SITE_LINK
+	return -penalties.get((siteA, siteB), -OTHER_SITE_LINK)
+
+
+def _linkKind(snapshot, i, j):
+	if i == j:
+		return "same_host"
+	return "same_site" if snapshot.sites[i] == snapshot.sites[j] else "other_site"
+
+
+def _place(placeable, graph, snapshot, penalties):
+	"""
+	Places the elements (element id -> element) one after another, each on
+	the host with the best score. Elements that are already planned for a
+	host are only penalised by counting them as elements of that host in
+	the population score of the snapshot.
+	Returns the positions of the chosen hosts in the snapshot and their
+	scores by element id and the ids of the elements without candidates.
+	"""
+	positions = {} # element id -> position in snapshot
+	placed = {} # element id -> score
+	unplaced = []
+	planned = {} # position -> number of planned elements
+	todo = set(placeable)
+	while todo:
+		# continue with the element that is linked most to the placed ones
+		elId = max(sorted(todo), key=lambda e: (sum(w for nb, w in graph[e].iteritems() if nb in positions), len(graph[e])))
+		todo.remove(elId)
+		el = placeable[elId]
+		candidates = snapshot.candidates(el.getFieldId('site'), [el.TYPE] + el.CAP_CHILDREN.keys())
+		if not candidates:
+			unplaced.append(elId)
+			continue
+		scores = snapshot.scores(candidates, extraElements=planned)
+		for k, i in enumerate(candidates):
+			for nb, weight in graph[elId].iteritems():
+				if nb in positions:
+					scores[k] += weight * _linkScore(snapshot, i, positions[nb], penalties)
+		best = max(xrange(len(candidates)), key=scores.__getitem__)
+		positions[elId] = candidates[best]
+		planned[candidates[best]] = planned.get(candidates[best], 0) + 1
+		placed[elId] = scores[best]
+	return positions, placed, unplaced
+
+
+def plan(topology):
+	"""
+	Assigns all VM elements of the topology that still have to be prepared to
+	hosts at once. Elements are placed in order of their links to already
+	placed elements, each on the host with the best load score (counting the
+	elements already planned for that host) plus the preferences for its
+	links.
+	Elements without suitable hosts are listed as unplaced.
+	"""
+	from .elements.generic import VMElement, ST_CREATED
+	from .host import snapshot, Host
+	start = time.time()
+	res = PlacementPlan(topology)
+	elements = list(topology.elements)
+	placeable = dict((el.idStr, el) for el in elements if isinstance(el, VMElement) and el.state == ST_CREATED)
+	if not placeable:
+		return res
+	graph = _linkGraph(elements, list(topology.connections), placeable)
+	penalties = _linkPenalties()
+	with snapshot.lock:
+		snapshot.check()
+		positions, res.scores, res.unplaced = _place(placeable, graph, snapshot, penalties)
+		hostIds = dict((elId, snapshot.ids[i]) for elId, i in positions.iteritems())
+		for elId, i in positions.iteritems():
+			for nb in graph[elId]:
+				if nb in positions and elId < nb:
+					res.links[_linkKind(snapshot, i, positions[nb])] += 1
+	hosts = dict((h.id, h) for h in Host.objects(id__in=list(set(hostIds.values()))))
+	for elId, hostId in hostIds.iteritems():
+		if hostId in hosts:
+			res.hosts[elId] = hosts[hostId]
+	res.duration = time.time() - start
+	logging.logMessage("placement plan", category="topology", id=topology.idStr, plan=res.info())
+	return res
+
+
+@contextmanager
+def use(plan_):
+	"""
+	Makes the elements of the planned topology prefer their planned hosts
+	while the context is active.
+	"""
+	with _plansLock:
+		_plans[plan_.topologyId] = plan_
+	try:
+		yield plan_
+	finally:
+		with _plansLock:
+			if _plans.get(plan_.topologyId) is plan_:
+				del _plans[plan_.topologyId]
+
+
+def plannedHost(element):
+	"""
+	Returns the planned host of the element if a plan for its topology is
+	active or None.
+	"""
+	with _plansLock:
+		plan_ = _plans.get(element.getFieldId('topology', asString=True))
+	return plan_.hostFor(element) if plan_ else None
@@ -21,8 +21,24 @@ import time
 from lib import logging #@UnresolvedImport
 from accounting import UsageStatistics
 from .auth.permissions import PermissionMixin, Role
-from . import scheduler
-from .lib.error import UserError #@UnresolvedImport
+from . import scheduler, placement, executor
+from .executor import ActionExecutor
+from .lib.error import Error, UserError #@UnresolvedImport
+from functools import partial
+
+def _elementAction(elId, action, stateFilter):
+	# the state may have changed by the actions of other elements
+	el = Element.get(elId)
+	if el and stateFilter(el.state):
+		el.action(action)
+
+def _actionHost(el):
+	host = placement.plannedHost(el)
+	if host:
+		return host.id
+	for hel in el.hostElements:
+		return hel.getFieldId('host')
+	return None
 
 class TimeoutStep:
 	INITIAL = 0
@@ -103,9 +119,10 @@ class Topology(Entity, PermissionMixin, BaseDocument):
 		return True
 
 	def action_prepare(self):
-		self._compoundAction(action="prepare", stateFilter=lambda state: state=="created", 
-							 typeOrder=["kvmqm", "openvz", "repy", "tinc_vpn", "udp_endpoint"],
-							 typesExclude=["kvmqm_interface", "openvz_interface", "repy_interface", "external_network", "external_network_endpoint"])
+		with placement.use(placement.plan(self)):
+			self._compoundAction(action="prepare", stateFilter=lambda state: state=="created",
+								 typeOrder=["kvmqm", "openvz", "repy", "tinc_vpn", "udp_endpoint"],
+								 typesExclude=["kvmqm_interface", "openvz_interface", "repy_interface", "external_network", "external_network_endpoint"])
 	
 	def action_destroy(self):
 		self.action_stop()
@@ -133,17 +150,51 @@ class Topology(Entity, PermissionMixin, BaseDocument):
 		self.timeoutStep = TimeoutStep.INITIAL if timeout > config.TOPOLOGY_TIMEOUT_WARNING else TimeoutStep.WARNED
 		
 	def _compoundAction(self, action, stateFilter, typeOrder, typesExclude):
-		# execute action in order
-		for type_ in typeOrder:
-			for el in self.elements:
-				if el.type != type_ or not stateFilter(el.state) or el.type in typesExclude:
-					continue
-				el.action(action)
-		# execute action on rest
-		for el in self.elements:
-			if not stateFilter(el.state) or el.type in typesExclude or el.type in typeOrder:
+		"""
+		Executes the action on all elements that pass the state filter in
+		parallel. Linked elements are handled in typeOrder (types that are not
+		listed come last) and child elements after their parents. Elements on
+		the same host are limited to config.TOPOLOGY_ACTION_HOST_LIMIT parallel
+		actions over all topologies. All elements are tried, the first error is raised afterwards
+		with the errors of all elements in its data.
+		"""
+		allElements = list(self.elements)
+		elements = [el for el in allElements if stateFilter(el.state) and not el.type in typesExclude]
+		if not elements:
+			return
+		prefetch(elements, ['hostElements'])
+		rank = lambda el: typeOrder.index(el.type) if el.type in typeOrder else len(typeOrder)
+		steps = dict((el.idStr, el) for el in elements)
+		deps = dict((el.idStr, set()) for el in elements)
+		for el in elements:
+			if el.parentId in steps:
+				deps[el.idStr].add(el.parentId)
+		# elements are linked through their parents (e.g. interfaces of a VM)
+		nodes = dict((el.idStr, el.parentId or el.idStr) for el in allElements)
+		for con in self.connections:
+			a, b = nodes.get(con.elementFromId), nodes.get(con.elementToId)
+			if not a in steps or not b in steps or a == b:
 				continue
-			el.action(action)
+			if rank(steps[a]) < rank(steps[b]):
+				deps[b].add(a)
+			elif rank(steps[b]) < rank(steps[a]):
+				deps[a].add(b)
+		user = currentUser()
+		actions = ActionExecutor(self.idStr, action, maxWorkers=config.TOPOLOGY_ACTION_WORKERS,
+			keyLimit=config.TOPOLOGY_ACTION_HOST_LIMIT, totalLimit=config.TOPOLOGY_ACTION_MAX_RUNNING,
+			setup=lambda: setCurrentUser(user))
+		for el in sorted(elements, key=rank):
+			actions.add(el.idStr, partial(_elementAction, el.idStr, action, stateFilter), key=_actionHost(el),
+				deps=deps[el.idStr])
+		actions.run()
+		failed = actions.failed
+		if failed:
+			errors = dict((step.id, step.errorInfo()) for step in failed)
+			logging.logMessage("action failed", category="topology", id=self.idStr, action=action, errors=errors)
+			exc_type, error, trace = failed[0].error
+			if isinstance(error, Error):
+				error.data.update(errors=errors)
+			raise exc_type, error, trace
 
 	def checkRemove(self, recurse=True):
 		self.checkRole(Role.owner)
@@ -183,47 +234,50 @@ class Topology(Entity, PermissionMixin, BaseDocument):
 
 	@property
 	def maxState(self):
-		states = self.elements.distinct('state')
+		# Speed optimization: use existing information to avoid database accesses
+		states = getattr(self, "_statesHint", None)
+		if states is None:
+			states = self.elements.distinct('state')
 		for state in ['started', 'prepared', 'created']:
 			if state in states:
 				return state
 		return 'created'
 
-	def info(self, full=False):
+	def info(self, full=False, components=None):
+		"""
+		components: the elements and connections of this topology as returned
+		by _loadComponents if they have already been loaded (see bulkInfo)
+		"""
+		if components is None:
+			_prefetchTopologies([self])
 		if not currentUser() is True and not currentUser().hasFlag(Flags.Debug):
 			self.checkRole(Role.user)
+		if components is None:
+			components = _loadComponents([self], full)[self.id]
+		els, cons = components
+		self._statesHint = set(el.state for el in els)
 		info = Entity.info(self)
 		if full:
 			# Speed optimization: use existing information to avoid database accesses
-			els = self.elements
 			childs = {}
+			conEls = {}
 			for el in els:
-				if not el.parentId:
-					continue
-				if not el.parentId in childs:
-					childs[el.parentId] = []
-				chs = childs[el.parentId]
-				chs.append(el.id)
-			connections = {}
-			for el in els:
-				if not el.connectionId:
-					continue
-				if not el.connectionId in connections:
-					connections[el.connectionId] = []
-				cons = connections[el.connectionId]
-				cons.append(el)
-			elements = [el.info(childs.get(el.id,[])) for el in els]
-			connections = [con.info(connections.get(con.id, [])) for con in self.connections]
+				if el.parentId:
+					childs.setdefault(el.parentId, []).append(el.id)
+				if el.connectionId:
+					conEls.setdefault(el.connectionId, []).append(el)
+			elements = [el.info(childs.get(el.idStr, [])) for el in els]
+			connections = [con.info(conEls.get(con.idStr, [])) for con in cons]
 		else:
-			elements = [str(el.id) for el in self.elements.only('id')]
-			connections = [str(con.id) for con in self.connections.only('id')]
-		info.update(elements=elements, connections=connections)
+			elements = [el.idStr for el in els]
+			connections = [con.idStr for con in cons]
+		info.update(elements=elements, connections=connections, action_progress=executor.progress(self.idStr))
 		for key, val in self.clientData.items():
 			info["_"+key] = val
 		return info
 
 	def updateUsage(self):
-		self.totalUsage.updateFrom([el.totalUsage for el in self.elements]
+		return self.totalUsage.updateFrom([el.totalUsage for el in self.elements]
 								 + [con.totalUsage for con in self.connections])
 
 	def __str__(self):
@@ -252,6 +306,54 @@ class Topology(Entity, PermissionMixin, BaseDocument):
 	}
 
 
+def _prefetchTopologies(topologies):
+	prefetch(topologies, ["totalUsage", "site"])
+	prefetch([perm for top in topologies for perm in top.permissions], ["user"])
+
+def _loadComponents(topologies, full=False):
+	"""
+	Loads the elements and connections of all given topologies with one query
+	each and returns them as {topology id: (elements, connections)}.
+	If full is set, all documents that are used by the infos of the elements
+	and connections are prefetched with one query per document type.
+	Otherwise only the ids and states are loaded.
+	"""
+	ids = [top.id for top in topologies]
+	els = Element.objects(topology__in=ids)
+	cons = Connection.objects(topology__in=ids)
+	if not full:
+		els = els.only('id', 'topology', 'state')
+		cons = cons.only('id', 'topology')
+	els, cons = list(els), list(cons)
+	if full:
+		prefetch(els + cons, ["topology"], known=topologies)
+		prefetch([perm for obj in els + cons for perm in obj.permissions], ["user"])
+		hostObjects = prefetch(els + cons, ["element", "site", "profile", "template", "network", "hostElements",
+			"hostConnections", "connectionFrom"])
+		hosts = prefetch(hostObjects, ["host"])
+		prefetch(hosts, ["site"])
+	res = dict((id_, ([], [])) for id_ in ids)
+	for el in els:
+		res[el.getFieldId("topology")][0].append(el)
+	for con in cons:
+		res[con.getFieldId("topology")][1].append(con)
+	return res
+
+def bulkInfo(topologies, full=False, accessibleOnly=False):
+	"""
+	Returns the infos of all given topologies. The documents needed for that
+	are loaded with a fixed number of queries instead of one query per
+	component and reference.
+	If accessibleOnly is set, topologies that the current user can not access
+	are skipped.
+	"""
+	topologies = list(topologies)
+	_prefetchTopologies(topologies)
+	if accessibleOnly:
+		topologies = filter(lambda top: top.hasRole(Role.user), topologies)
+	components = _loadComponents(topologies, full)
+	return [top.info(full, components[top.id]) for top in topologies]
+
 def get(id_, **kwargs):
 	try:
 		return Topology.objects.get(id=id_, **kwargs)
@@ -291,7 +393,7 @@ def timeout_task():
 		top.timeoutStep = TimeoutStep.DESTROYED
 		top.save()
 
-scheduler.scheduleRepeated(600, timeout_task)
+scheduler.scheduleRepeated(600, timeout_task, category="topology")
 
 from .elements import Element
 from .connections import Connection
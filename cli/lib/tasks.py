@@ -0,0 +1 @@
+../../shared/lib/tasks.py
\ No newline at end of file
@@ -46,10 +46,18 @@ def currentUser():
 def setCurrentUser(user):
 	_currentUser.user = user
 
+# users by certificate common name, users are never removed
+_users = {}
+_usersLock = threading.RLock()
+
 def login(commonName):
 	if not commonName:
 		return False
-	user, _ = User.objects.get_or_create(name=commonName)
+	user = _users.get(commonName)
+	if not user:
+		with _usersLock:
+			user, _ = User.objects.get_or_create(name=commonName)
+			_users[commonName] = user
 	setCurrentUser(user)
 	return bool(commonName)
 
@@ -75,7 +83,7 @@ scheduler.scheduleRepeated(config.BITTORRENT_RESTART, util.wrap_task(bittorrent.
 stopped = threading.Event()
 
 def start():
-	logging.openDefault(config.LOG_FILE)
+	logging.openDefault(config.LOG_FILE, flushInterval=config.LOG_FLUSH_INTERVAL)
 	dump.init()
 	db_migrate()
 	firewall.add_all_networks(network.getAll())
@@ -88,7 +96,7 @@ def reload_(*args):
 	print >>sys.stderr, "Reloading..."
 	logging.closeDefault()
 	reload(config)
-	logging.openDefault(config.LOG_FILE)
+	logging.openDefault(config.LOG_FILE, flushInterval=config.LOG_FLUSH_INTERVAL)
 
 def _printStackTraces():
 	import traceback
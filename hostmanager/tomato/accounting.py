@@ -15,12 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-from django.db import models
+from django.db import models, connection, transaction
 from django.core import exceptions
 import traceback
 from datetime import datetime, timedelta
 
 from lib import db, attributes, logging #@UnresolvedImport
+from lib.cmd.usage import UsageSampler #@UnresolvedImport
 from lib.decorators import *
 from . import scheduler
 
@@ -38,12 +39,18 @@ KEEP_RECORDS = {
     "month": 12,
     "year": 5,
 }
-
-def _avg(data, weightSum):
-    return sum([k * v for (k, v) in data]) / weightSum
-        
-def _sum(data, weightSum):
-    return sum(v for (v, _) in  data)
+# maximal duration of a record in seconds, records of a type that ended more
+# than KEEP_RECORDS durations ago are removed
+RECORD_DURATION = {
+    "single": 60,
+    "5minutes": 300,
+    "hour": 3600,
+    "day": 24 * 3600,
+    "month": 31 * 24 * 3600,
+    "year": 366 * 24 * 3600,
+}
+# order of the record values in exports
+EXPORT_COLUMNS = ["begin", "end", "measurements", "cputime", "memory", "diskspace", "traffic"]
 
 def _lastRange(type_):
     if type_ == "5minutes":
@@ -64,19 +71,6 @@ def _lastRange(type_):
         begin = datetime(end.year - 1, 1, 1)
     return (util.utcDatetimeToTimestamp(begin), util.utcDatetimeToTimestamp(end))        
     
-def _combine(begin, end, records):
-    #calculate coverage
-    measurements = sum([r.measurements for r in records])
-    #combine attributes
-    combined = Usage()
-    if not measurements:
-        return (combined, 0)
-    combined.cputime = _sum([(r.cputime, r.measurements) for r in records], measurements)
-    combined.diskspace = _avg([(r.diskspace, r.measurements) for r in records], measurements)
-    combined.memory = _avg([(r.memory, r.measurements) for r in records], measurements)
-    combined.traffic = _sum([(r.traffic, r.measurements) for r in records], measurements)
-    return (combined, measurements)
-
 class Usage:
     def __init__(self):
         self.cputime = 0.0
@@ -126,12 +120,12 @@ class UsageStatistics(attributes.Mixin, models.Model):
         return all_
        
     def createRecord(self, type_, begin, end, measurements, usage):
+        """
+        Returns a new unsaved record, records are saved in bulk by update()
+        """
         record = UsageRecord()
         record.init(self, type_, begin, end, measurements, usage)
-        record.save()
-        self.records.add(record)
-        obj = self._object()
-        logging.logMessage("record", category="accounting", type=type_, begin=begin, end=end, measurements=measurements, object=(obj.__class__.__name__.lower(), obj.id), usage=usage.info())
+        return record
        
     def _object(self):
         try:
@@ -145,8 +139,10 @@ class UsageStatistics(attributes.Mixin, models.Model):
         except exceptions.ObjectDoesNotExist:
             pass
        
-    @db.commit_after
-    def update(self):
+    def update(self, sample=None):
+        """
+        Measures the current usage of the object and returns the new record.
+        """
         usage = Usage()
         begin = time.time()
         obj = self._object()
@@ -155,36 +151,14 @@ class UsageStatistics(attributes.Mixin, models.Model):
             return
         obj = obj.upcast()
         try:
-            obj.updateUsage(usage, self.attrs)
+            obj.updateUsage(usage, self.attrs, sample or UsageSampler())
         except:
             obj.dumpException()
             raise
         end = time.time()
-        self.createRecord("single", begin, end, 1, usage)
-        self._combine()
-        self._removeOld()
         self.save()
-       
-    def _combine(self):
-        lastType = TYPES[0]
-        for type_ in TYPES[1:]:
-            begin, end = _lastRange(type_)
-            if self.begin > begin:
-                begin = self.begin
-            if self.begin > end:
-                break
-            if self.records.filter(type=type_, begin=begin, end=end).exists():
-                break
-            records = self.records.filter(type=lastType, begin__gte=begin, end__lte=end)
-            usage, coverage = _combine(begin, end, records)
-            self.createRecord(type_, begin, end, coverage, usage)
-            lastType = type_
-            
-    def _removeOld(self):
-        for type_ in TYPES:
-            for r in self.getRecords(type_).order_by("-begin")[KEEP_RECORDS[type_]:]:
-                r.delete()
-    
+        return self.createRecord("single", begin, end, 1, usage)
+
 class UsageRecord(models.Model):
     statistics = models.ForeignKey(UsageStatistics, related_name="records")
     type = models.CharField(max_length=10, choices=[(t, t) for t in TYPES]) #@ReservedAssignment
@@ -210,7 +184,6 @@ class UsageRecord(models.Model):
         self.memory = usage.memory
         self.diskspace = usage.diskspace
         self.traffic = usage.traffic
-        self.save()
 
     def info(self):
         return {
@@ -221,12 +194,127 @@ class UsageRecord(models.Model):
             "usage": {"cputime": self.cputime, "diskspace": self.diskspace, "memory": self.memory, "traffic": self.traffic},
         }
         
+class AccountingInfo(models.Model):
+    """
+    Holds the creation time of the accounting data. It identifies the
+    database, so the backend notices when the record ids start over.
+    """
+    created = models.FloatField() #unix timestamp
+
+    class Meta:
+        pass
+
+def databaseId():
+    """
+    Returns the creation time of the accounting data.
+    """
+    info = AccountingInfo.objects.order_by("id").first()
+    if not info:
+        AccountingInfo.objects.create(created=time.time())
+        # concurrent calls agree on the first one
+        info = AccountingInfo.objects.order_by("id").first()
+    return info.created
+
+def _combineAll():
+    """
+    Creates the combined records of all statistics for the last completed
+    period of each type with one INSERT ... SELECT per type. Counters are
+    summed up, memory and disk space are averaged weighted by the number of
+    measurements.
+    """
+    qn = connection.ops.quote_name
+    records = qn(UsageRecord._meta.db_table)
+    statistics = qn(UsageStatistics._meta.db_table)
+    statisticsId = qn(UsageRecord._meta.get_field("statistics").column)
+    created = 0
+    cursor = connection.cursor()
+    for lastType, type_ in zip(TYPES[:-1], TYPES[1:]):
+        begin, end = _lastRange(type_)
+        # records of statistics that were created during the period start with the statistics
+        recBegin = "(CASE WHEN s.%(begin)s > %%(begin)s THEN s.%(begin)s ELSE %%(begin)s END)" % {"begin": qn("begin")}
+        cursor.execute(("""
+            INSERT INTO %(records)s (%(statistics)s, %(type)s, %(begin)s, %(end)s, %(measurements)s,
+                %(cputime)s, %(memory)s, %(diskspace)s, %(traffic)s)
+            SELECT s.id, %%(type)s, """ + recBegin + """, %%(end)s, COALESCE(SUM(r.%(measurements)s), 0),
+                COALESCE(SUM(r.%(cputime)s), 0),
+                CASE WHEN SUM(r.%(measurements)s) > 0 THEN SUM(r.%(memory)s * r.%(measurements)s) / SUM(r.%(measurements)s) ELSE 0 END,
+                CASE WHEN SUM(r.%(measurements)s) > 0 THEN SUM(r.%(diskspace)s * r.%(measurements)s) / SUM(r.%(measurements)s) ELSE 0 END,
+                COALESCE(SUM(r.%(traffic)s), 0)
+            FROM %(statisticsTable)s s
+            LEFT JOIN %(records)s r ON r.%(statistics)s = s.id AND r.%(type)s = %%(lastType)s
+                AND r.%(begin)s >= """ + recBegin + """ AND r.%(end)s <= %%(end)s
+            WHERE s.%(begin)s <= %%(end)s AND NOT EXISTS (
+                SELECT 1 FROM %(records)s x WHERE x.%(statistics)s = s.id AND x.%(type)s = %%(type)s
+                    AND x.%(begin)s = """ + recBegin + """ AND x.%(end)s = %%(end)s)
+            GROUP BY s.id, s.%(begin)s
+        """) % {
+            "records": records, "statisticsTable": statistics, "statistics": statisticsId,
+            "type": qn("type"), "begin": qn("begin"), "end": qn("end"), "measurements": qn("measurements"),
+            "cputime": qn("cputime"), "memory": qn("memory"), "diskspace": qn("diskspace"), "traffic": qn("traffic")
+        }, {"type": type_, "lastType": lastType, "begin": begin, "end": end})
+        created += max(cursor.rowcount, 0)
+    return created
+
+def _removeOldAll():
+    """
+    Removes the records that are older than their type allows with one
+    range DELETE per type.
+    """
+    qn = connection.ops.quote_name
+    now = time.time()
+    removed = 0
+    cursor = connection.cursor()
+    for type_ in TYPES:
+        cursor.execute("DELETE FROM %s WHERE %s = %%s AND %s < %%s" % (qn(UsageRecord._meta.db_table), qn("type"), qn("end")),
+                       [type_, now - KEEP_RECORDS[type_] * RECORD_DURATION[type_]])
+        removed += max(cursor.rowcount, 0)
+    return removed
+
+def exportRecords(statistics, type_, after=0):
+    """
+    Returns the records of the given type and statistics ids that were
+    created after the sequence number after.
+    The record id is used as sequence number. Records are only created by
+    the accounting update in one transaction per cycle, so the ids of
+    committed records increase monotonically.
+    Returns (seq, {statistics id: [one list of values per EXPORT_COLUMNS
+    entry]}) where seq is the sequence number to continue with. If after is
+    greater than the latest sequence number, the export starts from the
+    beginning. Sequence numbers are only valid for the database given by
+    databaseId().
+    """
+    latest = UsageRecord.objects.aggregate(models.Max("id"))["id__max"] or 0
+    if after > latest:
+        after = 0
+    columns = {}
+    for row in UsageRecord.objects.filter(type=type_, id__gt=after, id__lte=latest, statistics__in=statistics).order_by("id").values_list("statistics", *EXPORT_COLUMNS):
+        cols = columns.get(row[0])
+        if cols is None:
+            cols = columns[row[0]] = [[] for _ in EXPORT_COLUMNS]
+        for col, value in zip(cols, row[1:]):
+            col.append(value)
+    return (latest, columns)
+
 @util.wrap_task
 def update():
-    for us in UsageStatistics.objects.all():
-        try:
-            us.update()
-        except:
-            traceback.print_exc()
-        
+    # all objects share one sample of the host-wide usage sources per cycle
+    sample = UsageSampler()
+    start = time.time()
+    records = []
+    with transaction.atomic():
+        for us in UsageStatistics.objects.all():
+            try:
+                # a savepoint per object so that its errors do not break the transaction
+                with transaction.atomic():
+                    record = us.update(sample)
+                if record:
+                    records.append(record)
+            except:
+                traceback.print_exc()
+        UsageRecord.objects.bulk_create(records)
+        combined = _combineAll()
+        removed = _removeOldAll()
+    logging.logMessage("update", category="accounting", records=len(records), combined=combined, removed=removed,
+                       duration=time.time() - start)
+
 scheduler.scheduleRepeated(60, update) #@UndefinedVariable
\ No newline at end of file
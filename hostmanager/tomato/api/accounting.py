@@ -58,6 +58,63 @@ def accounting_statistics(type=None, after=None, before=None): #@ReservedAssignm
     conSt = dict([(str(con.id), con.getUsageStatistics().info(type, after, before)) for con in connections.getAll(owner=currentUser())])
     return {"elements": elSt, "connections": conSt}
 
+def accounting_export(type="5minutes", after=0, compress=False): #@ReservedAssignment
+    """
+    Returns the usage records of all elements and all connections that were
+    created since the last export.
+    
+    Parameter *type*:
+      The type of the usage records that are returned.
+      
+    Parameter *after*:
+      The sequence number returned by the last export. Only records that
+      were created after that export are returned. If this parameter is 0,
+      all records of the given type are returned.
+      
+    Parameter *compress*:
+      If this parameter is set, the result is returned as a zlib compressed
+      and base64 encoded JSON string.
+      
+    Return value:
+      This method returns a dict with the following keys.
+      
+      ``seq``:
+        The sequence number that must be passed as *after* to the next
+        export.
+        
+      ``database``:
+        The identity of the accounting database. Sequence numbers of an
+        older export are not valid anymore if it has changed.
+        
+      ``columns``:
+        The names of the record values in the order they are returned.
+      
+      ``elements``:
+        A dict with the new records of all elements that have new records.
+        The keys of the dict are the element ids (as strings) and the values
+        are lists with one list of values per column.
+      
+      ``connections``:
+        A dict with the new records of all connections that have new records
+        in the same format as ``elements``.
+        
+      If *compress* is set, the dict only contains the keys ``seq``,
+      ``database`` and ``zlib``, the latter holding the encoded dict.
+    """
+    owners = {}
+    for kind, model in [("elements", elements.Element), ("connections", connections.Connection)]:
+        for id_, statsId in model.objects.filter(owner=currentUser(), usageStatistics__isnull=False).values_list("id", "usageStatistics"):
+            owners[statsId] = (kind, str(id_))
+    database = _accounting.databaseId()
+    seq, columns = _accounting.exportRecords(owners.keys(), type, after)
+    res = {"seq": seq, "database": database, "columns": _accounting.EXPORT_COLUMNS, "elements": {}, "connections": {}}
+    for statsId, cols in columns.iteritems():
+        kind, id_ = owners[statsId]
+        res[kind][id_] = cols
+    if compress:
+        return {"seq": seq, "database": database, "zlib": base64.b64encode(zlib.compress(json.dumps(res)))}
+    return res
+
 def accounting_element_statistics(id, type=None, after=None, before=None): #@ReservedAssignment
     """
     Returns accounting statistics for one element.
@@ -120,4 +177,7 @@ def accounting_connection_statistics(id, type=None, after=None, before=None): #@
 
 from elements import _getElement
 from connections import _getConnection
-from .. import currentUser, elements, connections
\ No newline at end of file
+from .. import currentUser, elements, connections
+from .. import accounting as _accounting
+from ..lib import anyjson as json
+import zlib, base64
@@ -49,6 +49,13 @@ already include configuration entries for logrotate that have to be adapted
 if this setting is changed.  
 """
 
+LOG_FLUSH_INTERVAL = 1.0
+"""
+Log entries are written to the logfile in batches by a background thread
+every this many seconds so that API calls are not delayed by file I/O.
+If this is set to ``None``, entries are written immediately.
+"""
+
 DUMP_DIR = "/var/log/tomato/dumps_hostmanager"
 """
 The location of the dump files that are created when unexpected errors occur.
@@ -187,6 +194,10 @@ systems that also need those resources, these entries might need to be adapted.
 WEBSOCKIFY_PORT_BLACKLIST = [6000, 6666]
 
 MAX_REQUESTS = 50
+RPC_QUEUE_SIZE = 1000
+RPC_QUEUE_PER_CONNECTION = 200
+# seconds that the database connections of the RPC workers are reused
+DB_CONN_MAX_AGE = 600
 
 import socket
 _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -224,4 +235,6 @@ if not TEMPLATE_DIR:
 if not FILESERVER["PATH"]:
 	FILESERVER["PATH"] = os.path.join(DATA_DIR, "files")
 if not DATABASES:
-	DATABASES = {'default': DATABASE.copy()}
\ No newline at end of file
+	DATABASES = {'default': DATABASE.copy()}
+for _db in DATABASES.values():
+	_db.setdefault('CONN_MAX_AGE', DB_CONN_MAX_AGE)
\ No newline at end of file
@@ -312,7 +312,7 @@ class Connection(db.ChangesetMixin, attributes.Mixin, models.Model):
 		from .. import resources #needed to break import cycle
 		resources.give(type_, num, self)
 		
-	def updateUsage(self, usage, data):
+	def updateUsage(self, usage, data, sample):
 		pass
 
 	def tearDown(self):
@@ -356,15 +356,15 @@ class Bridge(connections.Connection):
 		info = connections.Connection.info(self)
 		return info
 	
-	def updateUsage(self, usage, data):
-		if net.bridgeExists(self.bridge):
-			traffic = sum(net.trafficInfo(self.bridge))
+	def updateUsage(self, usage, data, sample):
+		traffic = sample.traffic(self.bridge) if self.bridge else None
+		if traffic is not None:
 			usage.updateContinuous("traffic", traffic, data)
-		if self.capture_pid and process.exists(self.capture_pid):
-			cputime = process.cputime(self.capture_pid)
+		stats = sample.process(self.capture_pid)
+		if stats:
+			cputime, usage.memory = stats
 			usage.updateContinuous("cputime", cputime, data)
-			usage.memory = process.memory(self.capture_pid)
-		usage.diskspace = path.diskspace(self.dataPath())
+		usage.diskspace = sample.diskspace(self.dataPath())
 
 if not config.MAINTENANCE:
 	bridgeUtilsVersion = cmd.getDpkgVersion("bridge-utils")
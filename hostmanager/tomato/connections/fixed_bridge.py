@@ -122,10 +122,10 @@ class Fixed_Bridge(connections.Connection):
 		info = connections.Connection.info(self)
 		return info
 
-	def updateUsage(self, usage, data):
+	def updateUsage(self, usage, data, sample):
 		ifname = self._ifaceName()
-		if ifname and net.ifaceExists(ifname):
-			traffic = sum(net.trafficInfo(ifname))
+		traffic = sample.traffic(ifname) if ifname else None
+		if traffic is not None:
 			usage.updateContinuous("traffic", traffic, data)
 
 
@@ -342,7 +342,7 @@ class Element(db.ChangesetMixin, attributes.Mixin, models.Model):
 		res['attrs']['rextfv_supported'] = False
 		return res
 
-	def updateUsage(self, usage, data):
+	def updateUsage(self, usage, data, sample):
 		pass
 
 
@@ -25,7 +25,7 @@ from ..lib.cmd import fileserver #@UnresolvedImport
 from ..lib.util import joinDicts #@UnresolvedImport
 from ..lib.error import UserError, InternalError
 from ..lib.newcmd import qm, vfat, qemu_img, ipspy
-from ..lib.newcmd.util import net, proc, io
+from ..lib.newcmd.util import net, io
 
 DOC="""
 Element type: ``kvmqm``
@@ -453,27 +453,25 @@ class KVMQM(elements.RexTFVElement,elements.Element):
 		info["attrs"]["template"] = self.template.upcast().name if self.template else None
 		return info
 
-	def updateUsage(self, usage, data):
-		self._checkState()
+	def _checkSampledState(self, sample):
+		# qm is only asked if the sampled state contradicts the saved one
+		running = bool(self.vmid) and sample.kvmRunning(self.vmid)
+		if running != (self.state == ST_STARTED):
+			self._checkState()
+
+	def updateUsage(self, usage, data, sample):
+		self._checkSampledState(sample)
 		if self.state == ST_CREATED:
 			return
 		if self.state == ST_STARTED:
 			memory = 0
 			cputime = 0
-			stats = qm.getStatistics(self.vmid)
-			memory += stats.memory_used
-			cputime += stats.cputime_total
-			if self.vncpid and proc.isAlive(self.vncpid):
-				stats = proc.getStatistics(self.vncpid)
-				memory += stats.memory_used
-				cputime += stats.cputime_total
-			if self.websocket_pid and proc.isAlive(self.websocket_pid):
-				stats = proc.getStatistics(self.websocket_pid)
-				memory += stats.memory_used
-				cputime += stats.cputime_total
+			for pid in [sample.kvmPid(self.vmid), self.vncpid, self.websocket_pid]:
+				memory += sample.processMemory(pid)
+				cputime += sample.processCputime(pid)
 			usage.memory = memory
 			usage.updateContinuous("cputime", cputime, data)
-		usage.diskspace = io.getSize(self._imagePathDir())
+		usage.diskspace = sample.diskspace(self._imagePathDir())
 		
 KVMQM.__doc__ = DOC
 
@@ -576,11 +574,10 @@ class KVMQM_Interface(elements.Element):
 		info["attrs"]["name"] = "eth%d" % (self.num or 0)
 		return info
 
-	def updateUsage(self, usage, data):
+	def updateUsage(self, usage, data, sample):
 		if self.state == ST_STARTED:
-			ifname = self.interfaceName()
-			if net.ifaceExists(ifname):
-				traffic = sum(net.trafficInfo(ifname))
+			traffic = sample.traffic(self.interfaceName())
+			if traffic is not None:
 				usage.updateContinuous("traffic", traffic, data)
 			
 KVMQM_Interface.__doc__ = DOC_IFACE
@@ -559,69 +559,45 @@ class OpenVZ(elements.RexTFVElement,elements.Element):
 		info["attrs"]["template"] = self.template.upcast().name if self.template else None
 		return info
 
-	def _cputime(self):
+	def _checkSampledState(self, sample):
+		# vzctl is only asked if the sampled state contradicts the saved one
+		running = bool(self.vmid) and sample.vzRunning(self.vmid)
+		if running != (self.state == ST_STARTED):
+			self._checkState()
+
+	def _cputime(self, sample):
 		if self.state != ST_STARTED:
 			return None
-		with open("/proc/vz/vestat") as fp:
-			for line in fp:
-				parts = line.split()
-				if len(parts) < 4:
-					continue
-				veid, user, _, system = line.strip().split()[:4]
-				if veid == str(self.vmid):
-					break
-		if veid == str(self.vmid):
-			cputime = (int(user) + int(system))/process.jiffiesPerSecond()
-		else: #pragma: no cover
+		cputime = sample.vzCputime(self.vmid)
+		if cputime is None: #pragma: no cover
 			return None
-		if self.vncpid and process.exists(self.vncpid):
-			cputime += process.cputime(self.vncpid)
-		return cputime
+		return cputime + sample.processCputime(self.vncpid)
 		
-	def _memory(self):
+	def _memory(self, sample):
 		if self.state != ST_STARTED:
 			return None
-		with open("/proc/user_beancounters") as fp:
-			for line in fp:
-				if line.strip().startswith(str(self.vmid)):
-					break
-			if not line.strip().startswith(str(self.vmid)): #pragma: no cover
-				return None
-			for line in fp:
-				key, val = line.split()[:2]
-				if key == "privvmpages":
-					memory = int(val) * 4096
-					break
-			if key != "privvmpages": #pragma: no cover
-				return None
-		if self.vncpid and process.exists(self.vncpid):
-			memory += process.memory(self.vncpid)
-		return memory
-		
-	def _diskspace(self):
+		memory = sample.vzMemory(self.vmid)
+		if memory is None: #pragma: no cover
+			return None
+		return memory + sample.processMemory(self.vncpid)
+
+	def _diskspace(self, sample):
 		if self.state == ST_STARTED:
-			with open("/proc/vz/vzquota") as fp:
-				while True:
-					line = fp.readline()
-					if line.startswith(str(self.vmid)):
-						break
-				if not line.startswith(str(self.vmid)): #pragma: no cover
-					return None
-				return int(fp.readline().split()[1]) * 1024
+			return sample.vzDiskspace(self.vmid)
 		else:
-			path.diskspace(self._imagePath())
+			return sample.diskspace(self._imagePath())
 		
-	def updateUsage(self, usage, data):
-		self._checkState()
+	def updateUsage(self, usage, data, sample):
+		self._checkSampledState(sample)
 		if self.state == ST_CREATED:
 			return
-		cputime = self._cputime()
+		cputime = self._cputime(sample)
 		if cputime:
 			usage.updateContinuous("cputime", cputime, data)
-		memory = self._memory()
+		memory = self._memory(sample)
 		if memory:
 			usage.memory = memory
-		diskspace = self._diskspace()
+		diskspace = self._diskspace(sample)
 		if diskspace:
 			usage.diskspace = diskspace
 			
@@ -796,10 +772,9 @@ class OpenVZ_Interface(elements.Element):
 		info = elements.Element.info(self)
 		return info
 
-	def updateUsage(self, usage, data):
-		ifname = self.interfaceName()
-		if net.ifaceExists(ifname):
-			traffic = sum(net.trafficInfo(ifname))
+	def updateUsage(self, usage, data, sample):
+		traffic = sample.traffic(self.interfaceName())
+		if traffic is not None:
 			usage.updateContinuous("traffic", traffic, data)
 			
 OpenVZ_Interface.__doc__ = DOC_IFACE
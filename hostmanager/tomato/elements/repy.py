@@ -336,15 +336,15 @@ class Repy(elements.Element):
 		info["attrs"]["template"] = self.template.upcast().name if self.template else None
 		return info
 
-	def updateUsage(self, usage, data):
+	def updateUsage(self, usage, data, sample):
 		self._checkState()
-		usage.diskspace = path.diskspace(self.dataPath())
+		usage.diskspace = sample.diskspace(self.dataPath())
 		if self.state == ST_STARTED:
-			usage.memory = process.memory(self.pid)
-			cputime = process.cputime(self.pid)
+			usage.memory = sample.processMemory(self.pid)
+			cputime = sample.processCputime(self.pid)
 			if self.vncpid:
-				usage.memory += process.memory(self.vncpid)
-				cputime += process.cputime(self.vncpid)
+				usage.memory += sample.processMemory(self.vncpid)
+				cputime += sample.processCputime(self.vncpid)
 			usage.updateContinuous("cputime", cputime, data)
 
 Repy.__doc__ = DOC
@@ -431,10 +431,9 @@ class Repy_Interface(elements.Element):
 		info = elements.Element.info(self)
 		return info
 
-	def updateUsage(self, usage, data):
-		ifname = self.interfaceName()
-		if net.ifaceExists(ifname):
-			traffic = sum(net.trafficInfo(ifname))
+	def updateUsage(self, usage, data, sample):
+		traffic = sample.traffic(self.interfaceName())
+		if traffic is not None:
 			usage.updateContinuous("traffic", traffic, data)
 	
 			
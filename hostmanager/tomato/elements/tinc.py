@@ -19,7 +19,7 @@ import os, shutil, hashlib, base64
 from .. import connections, elements, config
 from ..lib import util, cmd #@UnresolvedImport
 from ..lib.attributes import Attr #@UnresolvedImport
-from ..lib.cmd import process, net, path #@UnresolvedImport
+from ..lib.cmd import net, path #@UnresolvedImport
 from ..lib.error import UserError, InternalError
 
 DOC="""
@@ -225,19 +225,18 @@ class Tinc(elements.Element):
 		with open(pidFile) as fp:
 			return int(fp.readline().strip())
 
-	def updateUsage(self, usage, data):
+	def updateUsage(self, usage, data, sample):
 		if not self.path:
 			return
-		if path.exists(self.path):
-			usage.diskspace = path.diskspace(self.path)
+		usage.diskspace = sample.diskspace(self.path)
 		if self.state == ST_STARTED:
 			return
 		pid = self._getPid()
 		if pid:
-			usage.memory = process.memory(pid)
-			cputime = process.cputime(pid)
+			usage.memory = sample.processMemory(pid)
+			cputime = sample.processCputime(pid)
 			usage.updateContinuous("cputime", cputime, data)
-			traffic = sum(net.trafficInfo(self.interfaceName()))
+			traffic = sample.traffic(self.interfaceName()) or 0
 			usage.updateContinuous("traffic", traffic, data)
 			
 if not config.MAINTENANCE:
@@ -158,17 +158,14 @@ class UDP_Tunnel(elements.Element):
 		info = elements.Element.info(self)
 		return info
 
-	def updateUsage(self, usage, data):
+	def updateUsage(self, usage, data, sample):
 		self._checkState()
 		if self.state == ST_CREATED:
 			return
-		usage.memory = process.memory(self.pid)
-		cputime = process.cputime(self.pid)
+		usage.memory = sample.processMemory(self.pid)
+		cputime = sample.processCputime(self.pid)
 		usage.updateContinuous("cputime", cputime, data)
-		try:
-			traffic = sum(net.trafficInfo(self.interfaceName()))
-		except: #Tunnel just quit
-			traffic = 0
+		traffic = sample.traffic(self.interfaceName()) or 0 #None if the tunnel just quit
 		usage.updateContinuous("traffic", traffic, data)
 
 if not config.MAINTENANCE:
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from process import jiffiesPerSecond
+import os, stat, threading, platform, ctypes, ctypes.util
+
+def _readVestat():
+	res = {}
+	with open("/proc/vz/vestat") as fp:
+		for line in fp:
+			parts = line.split()
+			if len(parts) < 4 or not parts[0].isdigit():
+				continue
+			res[int(parts[0])] = (int(parts[1]) + int(parts[3])) / jiffiesPerSecond()
+	return res
+
+def _readBeancounters():
+	res = {}
+	veid = None
+	with open("/proc/user_beancounters") as fp:
+		for line in fp:
+			parts = line.split()
+			if parts and parts[0].endswith(":"):
+				if not parts[0][:-1].isdigit():
+					continue
+				veid = int(parts[0][:-1])
+				parts = parts[1:]
+			if veid is not None and len(parts) >= 2 and parts[0] == "privvmpages":
+				res[veid] = int(parts[1]) * 4096
+	return res
+
+def _readVzquota():
+	res = {}
+	with open("/proc/vz/vzquota") as fp:
+		veid = None
+		for line in fp:
+			parts = line.split()
+			if not parts:
+				continue
+			if parts[0].endswith(":") and parts[0][:-1].isdigit():
+				veid = int(parts[0][:-1])
+			elif veid is not None and len(parts) >= 2:
+				# the first line after the container is the block usage in KiB
+				res[veid] = int(parts[1]) * 1024
+				veid = None
+	return res
+
+def _readNetDev():
+	res = {}
+	with open("/proc/net/dev") as fp:
+		for line in fp:
+			if not ":" in line:
+				continue
+			ifname, data = line.split(":", 1)
+			data = data.split()
+			if len(data) < 9:
+				continue
+			res[ifname.strip()] = (int(data[0]), int(data[8]))
+	return res
+
+def _readProcess(pid):
+	with open("/proc/%d/stat" % pid) as fp:
+		stats = fp.readline().split()
+	return (sum(map(int, stats[13:17])) / jiffiesPerSecond(), int(stats[23]) * 4096)
+
+# ioprio_set/ioprio_get syscall numbers
+_IOPRIO_SYSCALLS = {"x86_64": (251, 252), "i386": (289, 290), "i686": (289, 290)}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_CLASS_IDLE = 3
+
+try:
+	_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+except OSError: #pragma: no cover
+	_libc = None
+
+class _idleIo:
+	"""
+	Puts the I/O of the calling thread into the idle class while in effect.
+	Does nothing on unknown architectures.
+	"""
+	def __enter__(self):
+		self.saved = None
+		syscalls = _IOPRIO_SYSCALLS.get(platform.machine())
+		if not _libc or not syscalls:
+			return
+		saved = _libc.syscall(syscalls[1], _IOPRIO_WHO_PROCESS, 0)
+		if saved >= 0 and _libc.syscall(syscalls[0], _IOPRIO_WHO_PROCESS, 0, _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT) == 0:
+			self.saved = saved
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		if self.saved is not None:
+			_libc.syscall(_IOPRIO_SYSCALLS[platform.machine()][0], _IOPRIO_WHO_PROCESS, 0, self.saved)
+
+
+class DiskUsageCache:
+	"""
+	Calculates the disk usage of files and directory trees by their allocated
+	blocks (st_blocks), so sparse images count with their real size.
+	The entries of each directory are cached with the directory mtime and
+	are only listed again when the directory has changed. The sizes of files
+	are read with one stat call per file on every request. Directories are
+	listed with idle I/O priority.
+	"""
+	def __init__(self):
+		self._dirs = {} #path -> (mtime, files, subdirs)
+		self._trees = {} #root path -> set of directories in the tree
+		self._lock = threading.RLock()
+
+	def _scanDir(self, path, st, seen):
+		entry = self._dirs.get(path)
+		if not entry or entry[0] != st.st_mtime:
+			files, subdirs = [], []
+			with _idleIo():
+				for name in os.listdir(path):
+					try:
+						mode = os.lstat(os.path.join(path, name)).st_mode
+					except OSError:
+						continue
+					(subdirs if stat.S_ISDIR(mode) else files).append(name)
+			entry = (st.st_mtime, files, subdirs)
+			self._dirs[path] = entry
+		seen.add(path)
+		total = st.st_blocks * 512
+		for name in entry[1]:
+			try:
+				total += os.lstat(os.path.join(path, name)).st_blocks * 512
+			except OSError:
+				pass #removed since the directory was listed
+		for name in entry[2]:
+			subpath = os.path.join(path, name)
+			try:
+				total += self._scanDir(subpath, os.lstat(subpath), seen)
+			except OSError:
+				pass
+		return total
+
+	def size(self, path):
+		"""
+		Returns the allocated size of a file or directory tree in bytes, 0 if
+		the path does not exist.
+		"""
+		try:
+			st = os.lstat(path)
+		except OSError:
+			self.forget(path)
+			return 0
+		if not stat.S_ISDIR(st.st_mode):
+			return st.st_blocks * 512
+		with self._lock:
+			seen = set()
+			total = self._scanDir(path, st, seen)
+			for old in self._trees.get(path, set()) - seen:
+				self._dirs.pop(old, None)
+			self._trees[path] = seen
+			return total
+
+	def forget(self, path):
+		with self._lock:
+			for old in self._trees.pop(path, set()):
+				self._dirs.pop(old, None)
+
+diskUsage = DiskUsageCache()
+
+
+class UsageSampler:
+	"""
+	Reads the host-wide usage sources once per accounting cycle and returns
+	the values for single objects from memory.
+	Each source is read the first time it is needed. Sources that do not
+	exist on this host yield no values.
+	"""
+	def __init__(self):
+		self._sources = {}
+		self._processes = {}
+
+	def _source(self, name, readFn):
+		if not name in self._sources:
+			try:
+				self._sources[name] = readFn()
+			except (IOError, OSError):
+				self._sources[name] = {}
+		return self._sources[name]
+
+	def vzCputime(self, veid):
+		"""
+		CPU time of a running OpenVZ container in seconds or None
+		"""
+		return self._source("vestat", _readVestat).get(int(veid))
+
+	def vzRunning(self, veid):
+		return int(veid) in self._source("vestat", _readVestat)
+
+	def vzMemory(self, veid):
+		"""
+		Private virtual memory of an OpenVZ container in bytes or None
+		"""
+		return self._source("beancounters", _readBeancounters).get(int(veid))
+
+	def vzDiskspace(self, veid):
+		"""
+		Disk space used by a running OpenVZ container in bytes or None
+		"""
+		return self._source("vzquota", _readVzquota).get(int(veid))
+
+	def diskspace(self, path):
+		"""
+		Allocated size of a file or directory tree in bytes, see DiskUsageCache
+		"""
+		return diskUsage.size(path)
+
+	def traffic(self, ifname):
+		"""
+		Sum of received and transmitted bytes of an interface or None if the
+		interface does not exist
+		"""
+		counters = self._source("netdev", _readNetDev).get(ifname)
+		return sum(counters) if counters else None
+
+	def process(self, pid):
+		"""
+		Returns (cputime, memory) of a process or None if it does not exist
+		"""
+		if not pid:
+			return None
+		if not pid in self._processes:
+			try:
+				self._processes[pid] = _readProcess(pid)
+			except (IOError, OSError, ValueError, IndexError):
+				self._processes[pid] = None
+		return self._processes[pid]
+
+	def processCputime(self, pid):
+		stats = self.process(pid)
+		return stats[0] if stats else 0
+
+	def processMemory(self, pid):
+		stats = self.process(pid)
+		return stats[1] if stats else 0
+
+	def kvmPid(self, vmid):
+		try:
+			with open("/var/run/qemu-server/%d.pid" % int(vmid)) as fp:
+				return int(fp.readline().strip())
+		except (IOError, ValueError):
+			return None
+
+	def kvmRunning(self, vmid):
+		return self.process(self.kvmPid(vmid)) is not None
@@ -28,5 +28,5 @@ from connections.fixed_bridge import Fixed_Bridge #@UnusedImport
 from resources import Resource, ResourceInstance #@UnusedImport
 from resources.template import Template #@UnusedImport
 from resources.network import Network #@UnusedImport
-from accounting import UsageStatistics, UsageRecord #@UnusedImport
+from accounting import UsageStatistics, UsageRecord, AccountingInfo #@UnusedImport
 from user import User #@UnusedImport
\ No newline at end of file
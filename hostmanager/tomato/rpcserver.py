@@ -30,15 +30,21 @@ def logCall(function, args, kwargs):
 	logging.log(category="api", method=function.__name__, args=args, kwargs=kwargs, user=currentUser().name)
 
 class Wrapper:
+	"""
+	Database connections are kept open between requests (see
+	config.DB_CONN_MAX_AGE). Connections that are broken or older than their
+	maximal age are closed before and after each request.
+	"""
 	def __init__(self):
 		self.semaphore = threading.Semaphore(config.MAX_REQUESTS)
 	def __enter__(self):
 		self.semaphore.acquire()
+		django.db.close_old_connections()
 	def __exit__(self, exc_type, exc_val, exc_tb):
 		self.semaphore.release()
 		if django.db.transaction.is_dirty():
 			django.db.transaction.commit()
-		django.db.connection.close()
+		django.db.close_old_connections()
 
 @db.commit_after
 def handleError(error, function, args, kwargs):
@@ -62,10 +68,14 @@ def runServer(server):
 
 
 servers = []
+executor = None
 
 
 def start():
 	print >> sys.stderr, "Starting RPC servers"
+	global executor
+	executor = rpc.sslrpc.RequestExecutor(maxWorkers=config.MAX_REQUESTS, maxQueue=config.RPC_QUEUE_SIZE,
+										  maxQueuePerConnection=config.RPC_QUEUE_PER_CONNECTION)
 	for settings in config.SERVER:
 		server_address = ('', settings["PORT"])
 		sslOpts = rpc.SSLOpts(private_key=settings["SSL_OPTS"]["key_file"],
@@ -73,7 +83,7 @@ def start():
 							  client_certs=settings["SSL_OPTS"]["client_certs"])
 		server = rpc.runServer(type=settings.get("TYPE", "https+xmlrpc"), address=server_address, sslOpts=sslOpts,
 							   certCheck=login, wrapper=Wrapper(), beforeExecute=logCall, afterExecute=afterCall,
-								onError=handleError, api=api)
+								onError=handleError, api=api, executor=executor)
 		print >> sys.stderr, " - %s %s:%d" % (
 		settings.get("TYPE", "https+xmlrpc"), server_address[0], server_address[1])
 		servers.append(server)
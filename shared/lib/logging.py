@@ -1,15 +1,55 @@
 from datetime import datetime
-import sys, time, traceback, hashlib
+import sys, time, traceback, hashlib, threading
 from . import anyjson as json
 
 
 class JSONLogger:
-	def __init__(self, path):
+	"""
+	Writes log entries as JSON lines to a file.
+	If flushInterval is set, entries are serialized by the caller but written
+	in batches by a background thread every flushInterval seconds or as soon
+	as maxBuffer entries are waiting, so callers are not delayed by file I/O.
+	"""
+	def __init__(self, path, flushInterval=None, maxBuffer=1000):
 		self.path = path
+		self.flushInterval = flushInterval
+		self.maxBuffer = maxBuffer
+		self._buffer = []
+		self._cond = threading.Condition()
+		self._writer = None
+		self._closing = False
 		self.open()
 
 	def open(self):
 		self._fp = open(self.path, "a")
+		self._closing = False
+		if self.flushInterval:
+			self._writer = threading.Thread(target=self._writeLoop, name="log writer")
+			self._writer.daemon = True
+			self._writer.start()
+
+	def _takeBuffer(self):
+		with self._cond:
+			lines, self._buffer = self._buffer, []
+			return lines
+
+	def _writeLines(self, lines):
+		if not lines:
+			return
+		try:
+			self._fp.write("".join(lines))
+			self._fp.flush()
+		except:
+			print "Failed to write %d log entries" % len(lines)
+
+	def _writeLoop(self):
+		while True:
+			with self._cond:
+				if not self._closing and len(self._buffer) < self.maxBuffer:
+					self._cond.wait(self.flushInterval)
+				if self._closing:
+					return
+			self._writeLines(self._takeBuffer())
 
 	def __enter__(self):
 		return self
@@ -18,13 +58,26 @@ class JSONLogger:
 		self.close()
 
 	def close(self):
+		if self._writer:
+			with self._cond:
+				self._closing = True
+				self._cond.notify()
+			self._writer.join()
+			self._writer = None
+		self._writeLines(self._takeBuffer())
 		self._fp.close()
 		self._fp = None
 
 	def _write(self, data):
 		try:
 			data = json.dumps(data)
-			self._fp.write(data + "\n")
+			if not self.flushInterval:
+				self._fp.write(data + "\n")
+				return
+			with self._cond:
+				self._buffer.append(data + "\n")
+				if len(self._buffer) >= self.maxBuffer:
+					self._cond.notify()
 		except:
 			print "Failed to write log entry: %s" % data
 
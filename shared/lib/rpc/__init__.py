@@ -10,6 +10,8 @@ def unwrapXmlRpcError(err):
 		return TransportError(code=TransportError.UNKNOWN, message=repr(err), module="hostmanager")
 	if err.faultCode == 999:
 		return Error.parsestr(err.faultString)
+	elif err.faultCode == 26:
+		return TransportError(code="method.unknown_method", message=err.faultString, module="hostmanager")
 	elif err.faultCode == 300:
 		return TransportError(code=TransportError.UNAUTHORIZED, module="hostmanager")
 	elif err.faultCode == 500:
@@ -34,6 +36,63 @@ def isReusable(proxy):
 		return True
 	return True
 
+def methodInfo(proxy):
+	"""
+	Returns the method info of a proxy that can be passed to createProxy to
+	create further proxies for the same server without querying it again.
+	"""
+	if isinstance(proxy, sslrpc.RPCProxy):
+		return proxy._methods
+	return None
+
+def call(proxy, method, args=(), kwargs=None, timeout=None):
+	"""
+	Calls a single method and waits at most timeout seconds for its result
+	if the protocol supports it.
+	"""
+	if kwargs is None:
+		kwargs = {}
+	if isinstance(proxy, sslrpc.RPCProxy):
+		if not method in proxy._methods:
+			raise AttributeError(method)
+		return proxy.call_async(method, list(args), kwargs).result(timeout)
+	if isinstance(proxy, xmlrpc.ServerProxy) and timeout is not None:
+		proxy.setTimeout(timeout)
+	return getattr(proxy, method)(*args, **kwargs)
+
+def multicall(proxy, calls, timeout=None):
+	"""
+	Executes a list of calls given as (method, args, kwargs) tuples in a
+	single round trip if the protocol supports it.
+	Returns a list of (success, result) tuples where result is the error
+	object for failed calls.
+	"""
+	if isinstance(proxy, sslrpc.RPCProxy):
+		responses = proxy.call_async("$multicall$", [[{"method": method, "args": list(args), "kwargs": kwargs} for (method, args, kwargs) in calls]]).result(timeout)
+		return [(True, resp["result"]) if "result" in resp else (False, unwrapJsonRpcError(sslrpc.RPCError.decode(resp["error"], None))) for resp in responses]
+	if isinstance(proxy, xmlrpc.ServerProxy):
+		if timeout is not None:
+			proxy.setTimeout(timeout)
+		responses = getattr(proxy, "system.multicall")([{"methodName": method, "params": [list(args), kwargs]} for (method, args, kwargs) in calls])
+		return [(True, resp[0]) if isinstance(resp, list) else (False, unwrapXmlRpcError(Fault(resp["faultCode"], resp["faultString"]))) for resp in responses]
+	results = []
+	for method, args, kwargs in calls:
+		try:
+			results.append((True, getattr(proxy, method)(*args, **kwargs)))
+		except Error, err:
+			results.append((False, err))
+	return results
+
+def pipeline(proxy, calls, timeout=None):
+	"""
+	Like multicall but the calls are sent as individual requests without
+	waiting for responses in between so the server can execute them
+	concurrently. Falls back to multicall for other protocols.
+	"""
+	if isinstance(proxy, sslrpc.RPCProxy):
+		return sslrpc.gather([proxy.call_async(method, list(args), kwargs) for (method, args, kwargs) in calls], timeout)
+	return multicall(proxy, calls, timeout)
+
 def createXmlRpcProxy(url, sslcert, timeout):
 	schema, address = url.split(":", 1)
 	schema, _ = schema.split("+")
@@ -52,7 +111,7 @@ def unwrapJsonRpcError(err):
 		return Error.parse(err.data)
 	return TransportError(code="%s.%s" % (err.category, err.type), message=err.message, data=err.data)
 
-def createJsonRpcProxy(address, sslcert, timeout):
+def createJsonRpcProxy(address, sslcert, timeout, methods=None):
 	if address.startswith("//"):
 		address = address[2:]
 	if not ":" in address:
@@ -60,16 +119,17 @@ def createJsonRpcProxy(address, sslcert, timeout):
 								 message="address must contain port: %s" % address)
 	address, port = address.split(":")
 	port = int(port)
-	return sslrpc.RPCProxy((address, port), certfile=sslcert, keyfile=sslcert, onError=unwrapJsonRpcError)
+	return sslrpc.RPCProxy((address, port), certfile=sslcert, keyfile=sslcert, onError=unwrapJsonRpcError,
+						   methods=methods)
 
-def createProxy(url, sslcert, timeout=30):
+def createProxy(url, sslcert, timeout=30, methods=None):
 	if not ":" in url:
 		raise TransportError(code=TransportError.INVALID_URL, message="invalid url: %s" % url)
 	schema, address = url.split(":", 1)
 	if schema == "http+xmlrpc" or schema == "https+xmlrpc":
 		return createXmlRpcProxy(url, sslcert, timeout)
 	elif schema == "ssl+jsonrpc":
-		return createJsonRpcProxy(address, sslcert, timeout)
+		return createJsonRpcProxy(address, sslcert, timeout, methods)
 	else:
 		raise TransportError(code=TransportError.INVALID_URL, message="unsupported protocol: %s" % schema)
 
@@ -93,7 +153,7 @@ def runXmlRpcServer(address, api, sslOpts, certCheck, wrapper, beforeExecute, af
 	util.start_thread(server.serve_forever)
 	return server
 
-def runJsonRpcServer(address, api, sslOpts, certCheck, wrapper, beforeExecute, afterExecute, onError):
+def runJsonRpcServer(address, api, sslOpts, certCheck, wrapper, beforeExecute, afterExecute, onError, executor=None):
 	def wrapError(error, func, args, kwargs):
 		error = onError(error, func, args, kwargs)
 		assert isinstance(error, Error)
@@ -102,15 +162,15 @@ def runJsonRpcServer(address, api, sslOpts, certCheck, wrapper, beforeExecute, a
 		dict(map(lambda l: l[0], cert['subject']))['commonName']), wrapper=wrapper, beforeExecute=beforeExecute,
 							  afterExecute=afterExecute, onError=wrapError, keyfile=sslOpts.private_key,
 							  certfile=sslOpts.certificate, ca_certs=sslOpts.client_certs,
-							  cert_reqs=ssl.CERT_REQUIRED)
+							  cert_reqs=ssl.CERT_REQUIRED, executor=executor)
 	server.registerContainer(api)
 	util.start_thread(server.serve_forever)
 	return server
 
-def runServer(type, address, api, sslOpts, certCheck, wrapper, beforeExecute, afterExecute, onError):
+def runServer(type, address, api, sslOpts, certCheck, wrapper, beforeExecute, afterExecute, onError, executor=None):
 	if type == "https+xmlrpc":
 		return runXmlRpcServer(address, api, sslOpts, certCheck, wrapper, beforeExecute, afterExecute, onError)
 	elif type == "ssl+jsonrpc":
-		return runJsonRpcServer(address, api, sslOpts, certCheck, wrapper, beforeExecute, afterExecute, onError)
+		return runJsonRpcServer(address, api, sslOpts, certCheck, wrapper, beforeExecute, afterExecute, onError, executor)
 	else:
 		raise TransportError(code=TransportError.INVALID_URL, message="unsupported protocol: %s" % type)
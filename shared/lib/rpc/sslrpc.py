@@ -1,4 +1,5 @@
-import ssl, socket, SocketServer, inspect, threading, thread, sys
+import ssl, socket, SocketServer, inspect, threading, sys, time, collections
+from ..tasks import Histogram
 from ..error import TransportError
 
 JSON = False
@@ -95,6 +96,11 @@ class SSLConnection:
 		self.wfile.flush()
 
 	def close(self):
+		try:
+			# wakes up threads that are blocked reading from the socket
+			self.socket.shutdown(socket.SHUT_RDWR)
+		except socket.error:
+			pass
 		self.rfile.close()
 		self.wfile.close()
 		self.socket.close()
@@ -328,9 +334,117 @@ class DummyWrapper:
 	def __exit__(self, exc_type, exc_val, exc_tb):
 		pass
 
+class RequestExecutor:
+	"""
+	Executes requests on a bounded set of worker threads.
+	Requests are queued per connection and the connections are served round
+	robin so that one busy client can not starve the others. When the queue
+	of a connection or the total queue is full, submit blocks and the
+	connection stops reading further requests until there is room again.
+	"""
+	def __init__(self, maxWorkers=50, maxQueue=1000, maxQueuePerConnection=100, idleTimeout=60.0):
+		self.maxWorkers = maxWorkers
+		self.maxQueue = maxQueue
+		self.maxQueuePerConnection = maxQueuePerConnection
+		self.idleTimeout = idleTimeout
+		self.queues = {} #connection -> deque of (queued, fn, args)
+		self.ready = collections.deque() #connections with queued requests in round robin order
+		self.queued = 0
+		self.workers = 0
+		self.idle = 0
+		self.busy = 0
+		self.handled = 0
+		self.blocked = 0
+		self.lock = threading.RLock()
+		self.workCond = threading.Condition(self.lock)
+		self.spaceCond = threading.Condition(self.lock)
+		self.queueTime = Histogram()
+		self.handleTime = Histogram()
+
+	def _full(self, connection):
+		queue = self.queues.get(connection)
+		return self.queued >= self.maxQueue or (queue is not None and len(queue) >= self.maxQueuePerConnection)
+
+	def submit(self, connection, fn, *args):
+		with self.lock:
+			if self._full(connection):
+				self.blocked += 1
+				while self._full(connection):
+					self.spaceCond.wait()
+			queue = self.queues.get(connection)
+			if queue is None:
+				queue = self.queues[connection] = collections.deque()
+			if not queue:
+				self.ready.append(connection)
+			queue.append((time.time(), fn, args))
+			self.queued += 1
+			if self.idle:
+				self.workCond.notify()
+			elif self.workers < self.maxWorkers:
+				self.workers += 1
+				thread = threading.Thread(target=self._workerLoop)
+				thread.daemon = True
+				thread.start()
+
+	def _next(self):
+		# must be called with lock held
+		connection = self.ready.popleft()
+		queue = self.queues[connection]
+		item = queue.popleft()
+		if queue:
+			self.ready.append(connection)
+		else:
+			del self.queues[connection]
+		self.queued -= 1
+		self.spaceCond.notifyAll()
+		return item
+
+	def _workerLoop(self):
+		while True:
+			with self.lock:
+				if not self.ready:
+					self.idle += 1
+					self.workCond.wait(self.idleTimeout)
+					self.idle -= 1
+					if not self.ready:
+						self.workers -= 1
+						return
+				queued, fn, args = self._next()
+				self.busy += 1
+				self.queueTime.add(time.time() - queued)
+			start = time.time()
+			try:
+				fn(*args)
+			except:
+				import traceback
+				traceback.print_exc()
+			finally:
+				with self.lock:
+					self.busy -= 1
+					self.handled += 1
+					self.handleTime.add(time.time() - start)
+
+	def info(self):
+		with self.lock:
+			return {
+				"max_workers": self.maxWorkers,
+				"max_queue": self.maxQueue,
+				"max_queue_per_connection": self.maxQueuePerConnection,
+				"workers": self.workers,
+				"busy": self.busy,
+				"queued": self.queued,
+				"connections": len(self.queues),
+				"handled": self.handled,
+				"blocked": self.blocked,
+				"queue_time": self.queueTime.info(),
+				"handle_time": self.handleTime.info()
+			}
+
+
 class RPCServer(SocketServer.ThreadingMixIn, SSLServer):
-	def __init__(self, server_address, certCheck=None, wrapper=DummyWrapper, beforeExecute=None, afterExecute=None, onError=None, **sslargs):
+	def __init__(self, server_address, certCheck=None, wrapper=DummyWrapper, beforeExecute=None, afterExecute=None, onError=None, executor=None, **sslargs):
 		SSLServer.__init__(self, server_address, RPCHandler, **sslargs)
+		self.executor = executor or RequestExecutor()
 		self.beforeExecute = beforeExecute
 		self.afterExecute = afterExecute
 		self.wrapper = wrapper
@@ -342,6 +456,7 @@ class RPCServer(SocketServer.ThreadingMixIn, SSLServer):
 		self.register(self._info, "$info$")
 		self.register(self._infoall, "$infoall$")
 		self.register(self._multicall, "$multicall$")
+		self.register(self._stats, "$stats$")
 
 	def register(self, func, name=None):
 		if not callable(func):
@@ -407,6 +522,9 @@ class RPCServer(SocketServer.ThreadingMixIn, SSLServer):
 	def _infoall(self):
 		return dict([(key, method_info(func)) for (key, func) in self.funcs.iteritems()])
 
+	def _stats(self):
+		return {"executor": self.executor.info(), "connections": len(self.children)}
+
 	def _multicall(self, calls):
 		if not isinstance(calls, list):
 			raise TypeError("Argument must be a list")
@@ -436,7 +554,8 @@ class RPCHandler(SocketServer.StreamRequestHandler):
 			if not request_line:
 				break
 			session = self.server.session
-			thread.start_new_thread(self.handleRequestLine, (request_line, session))
+			# blocks while the queue is full, so no further requests are read
+			self.server.executor.submit(self, self.handleRequestLine, request_line, session)
 		self.server.delSession()
 
 	def handleRequestLine(self, request_line, session):
@@ -482,8 +601,153 @@ class RPCHandler(SocketServer.StreamRequestHandler):
 			self.wfile.flush()
 
 
+class RPCFuture:
+	"""
+	The pending result of a call. Callbacks are executed in the reader thread
+	of the proxy, so they must not wait for other calls on the same proxy.
+	"""
+	def __init__(self, id, onError=(lambda x: x)):
+		self.id = id
+		self._onError = onError
+		self._event = threading.Event()
+		self._result = None
+		self._error = None
+		self._callbacks = []
+		self._lock = threading.RLock()
+
+	def done(self):
+		return self._event.isSet()
+
+	def _finish(self, result=None, error=None):
+		with self._lock:
+			if self.done():
+				return
+			self._result = result
+			self._error = error
+			self._event.set()
+			callbacks = self._callbacks
+			self._callbacks = []
+		for callback, errback in callbacks:
+			self._runCallback(callback, errback)
+
+	def _runCallback(self, callback, errback):
+		try:
+			if self._error is None:
+				if callback:
+					callback(self._result)
+			elif errback:
+				errback(self._onError(self._error))
+		except:
+			import traceback
+			traceback.print_exc()
+
+	def addCallback(self, callback, error=None):
+		with self._lock:
+			if not self.done():
+				self._callbacks.append((callback, error))
+				return
+		self._runCallback(callback, error)
+
+	def wait(self, timeout=None):
+		return self._event.wait(timeout)
+
+	def result(self, timeout=None):
+		if not self._event.wait(timeout):
+			raise self._onError(RPCError(id=self.id, category=RPCError.Category.NETWORK, type="timeout",
+										 message="No response after %s seconds" % timeout))
+		if self._error is not None:
+			raise self._onError(self._error)
+		return self._result
+
+
+def gather(futures, timeout=None):
+	"""
+	Waits for all futures and returns a list of (success, result) tuples in
+	the order of the futures where result is the error for failed calls.
+	"""
+	deadline = time.time() + timeout if timeout is not None else None
+	results = []
+	for future in futures:
+		try:
+			results.append((True, future.result(max(deadline - time.time(), 0.0) if deadline else None)))
+		except Exception, exc:
+			results.append((False, exc))
+	return results
+
+
+class _ResponseReader:
+	"""
+	Reads responses from a connection in its own thread and hands them to the
+	futures of the pending requests. This object does not reference the proxy
+	so that unused proxies can be garbage collected.
+	"""
+	def __init__(self, con):
+		self.con = con
+		self.pending = {}
+		self.lock = threading.RLock()
+		self.closed = None
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def register(self, future):
+		with self.lock:
+			if self.closed:
+				raise self.closed
+			self.pending[future.id] = future
+
+	def unregister(self, id):
+		with self.lock:
+			return self.pending.pop(id, None)
+
+	def _dispatch(self, response):
+		future = self.unregister(response.id)
+		if not future and isinstance(response.id, basestring):
+			# errors for undecodable requests carry the request line as id
+			try:
+				future = self.unregister(json.loads(response.id).get("id"))
+			except Exception:
+				pass
+		if not future:
+			return
+		if response.hasResult:
+			future._finish(result=response.result)
+		else:
+			future._finish(error=response.error)
+
+	def run(self):
+		error = None
+		try:
+			while True:
+				line = self.con.readLine()
+				# print "IN: %s" % line.strip()
+				if not line:
+					break
+				try:
+					response = RPCResponse.decode_json(line)
+				except RPCError, err:
+					print >>sys.stderr, "Invalid response: %s" % err
+					continue
+				self._dispatch(response)
+		except Exception, exc:
+			error = RPCError(id=None, category=RPCError.Category.NETWORK, type="connection", message=str(exc))
+		if not error:
+			error = RPCError(id=None, category=RPCError.Category.NETWORK, type="connection", message="Connection closed")
+		with self.lock:
+			self.closed = error
+			pending = self.pending.values()
+			self.pending = {}
+		for future in pending:
+			future._finish(error=error)
+
+
 class RPCProxy:
-	def __init__(self, address, onError=(lambda x: x), **args):
+	"""
+	Client for RPCServer. Any number of calls can be in flight on the
+	connection at the same time, a dedicated reader thread hands the responses
+	to the waiting callers.
+	"""
+	def __init__(self, address, onError=(lambda x: x), methods=None, **args):
 		self._con = None
 		self._onError = onError
 		self._methods = {}
@@ -493,13 +757,10 @@ class RPCProxy:
 			raise self._onError(RPCError(id=None, category=RPCError.Category.NETWORK, type="connect", message=repr(err),
 										 data={"address": address}))
 		self._id = 0
-		self._rlock = threading.RLock()
 		self._wlock = threading.RLock()
-		self._resLock = threading.RLock()
-		self._resCond = threading.Condition(self._resLock)
-		self._results = {}
-		self._errors = {}
-		self._methods = self._call("$infoall$")
+		self._reader = _ResponseReader(self._con)
+		# the method info can be given to avoid the $infoall$ round trip
+		self._methods = methods if methods is not None else self._call("$infoall$")
 
 	def _nextId(self):
 		with self._wlock:
@@ -510,71 +771,41 @@ class RPCProxy:
 		# print "OUT: %s" % line
 		self._con.writeLine(line)
 
-	def _readLine(self):
-		line = self._con.readLine()
-		# print "IN: %s" % line.strip()
-		return line
-
-	def _callInternal(self, name, args=None, kwargs=None):
+	def _send(self, name, args=None, kwargs=None):
 		if not kwargs: kwargs = {}
 		if not args: args = []
 		with self._wlock:
 			request_id = self._nextId()
+			future = RPCFuture(request_id, onError=self._onError)
 			request_line = RPCRequest(id=request_id, method=name, args=args, kwargs=kwargs).encode()
-			self._writeLine(request_line)
-		while True:
-			with self._resLock:
-				# Check if our response is there
-				if request_id in self._results:
-					result = self._results[request_id]
-					del self._results[request_id]
-					return result
-				if request_id in self._errors:
-					error = self._errors[request_id]
-					del self._errors[request_id]
-					# if error.category == RPCError.Category.CALL:
-					# if error.type.endswith("Error") and error.type in __builtins__:
-					# raise __builtins__[error.type](error.message)
-					raise error
-				if request_line in self._errors:
-					error = self._errors[request_line]
-					del self._errors[request_line]
-					raise error
-			if self._rlock.acquire(blocking=False):
-				# We are waiting for a message
-				try:
-					response = RPCResponse.decode_json(self._readLine())
-					with self._resLock:
-						# Save response
-						if response.hasResult:
-							self._results[response.id] = response.result
-						else:
-							self._errors[response.id] = response.error
-						# Notify everyone who is waiting for responses
-						self._resCond.notifyAll()
-				finally:
-					self._rlock.release()
-			else:
-				# Someone else is waiting for a message
-				with self._resCond:
-					# Wait for a message to come in
-					self._resCond.wait()
-
-	def _call(self, name, args=None, kwargs=None):
-		if not kwargs: kwargs = {}
-		if not args: args = []
+			self._reader.register(future)
+			try:
+				self._writeLine(request_line)
+			except:
+				self._reader.unregister(request_id)
+				raise
+		return future
+
+	def call_async(self, name, args=None, kwargs=None, callback=None, error=None):
+		"""
+		Sends a call without waiting for its response and returns an RPCFuture.
+		The optional callback is called with the result and error with the
+		error once the response has arrived.
+		"""
 		try:
-			return self._callInternal(name, args, kwargs)
-		except ssl.SSLError, err:
-			raise self._onError(
-				RPCError(id=None, category=RPCError.Category.NETWORK, type="ssl", message=str(err))), None, \
-			sys.exc_info()[2]
-		except socket.error, err:
+			future = self._send(name, args, kwargs)
+		except RPCError, err:
+			raise self._onError(err), None, sys.exc_info()[2]
+		except (ssl.SSLError, socket.error), err:
 			raise self._onError(
 				RPCError(id=None, category=RPCError.Category.NETWORK, type="connection", message=str(err))), None, \
 			sys.exc_info()[2]
-		except RPCError, err:
-			raise self._onError(err), None, sys.exc_info()[2]
+		if callback or error:
+			future.addCallback(callback, error)
+		return future
+
+	def _call(self, name, args=None, kwargs=None):
+		return self.call_async(name, args, kwargs).result()
 
 	def multicall(self, *callargs):
 		return MultiCallProxy(self, callargs)
@@ -587,12 +818,15 @@ class RPCProxy:
 			raise AttributeError(name)
 		return MethodProxy(self, name, self._methods[name])
 
-	def __del__(self):
+	def _close(self):
 		try:
 			self._con.close()
 		except:
 			pass
 
+	def __del__(self):
+		self._close()
+
 
 class MethodProxy:
 	def __init__(self, proxy, name, info):
@@ -605,22 +839,13 @@ class MethodProxy:
 	def __call__(self, *args, **kwargs):
 		return self.proxy._call(self.name, args, kwargs)
 
-	def _asyncCall(self, callback, error, args, kwargs):
-		try:
-			res = self(*args, **kwargs)
-		except Exception, exc:
-			if error:
-				error(exc)
-			return
-		callback(res)
-
 	def async(self, callback, args, kwargs=None, error=None):
 		if not kwargs: kwargs = {}
 		if not callable(callback):
 			raise TypeError("Callback not callable")
 		if error and not callable(error):
 			raise TypeError("Error callback not callable")
-		thread.start_new_thread(self._asyncCall, (callback, error, args, kwargs))
+		return self.proxy.call_async(self.name, args, kwargs, callback=callback, error=error)
 
 
 class MultiCallProxy(MethodProxy):
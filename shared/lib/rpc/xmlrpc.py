@@ -104,6 +104,8 @@ class WrappedSSLConnection:
 class SecureRequestHandler:
 	def setup(self):
 		self.connection = self.request
+		# detect vanished clients of idle keep-alive connections
+		self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 		if self.server.sslOpts:
 			self.rfile = socket._fileobject(WrappedSSLConnection(self.request), "rb", self.rbufsize)
 			self.wfile = socket._fileobject(WrappedSSLConnection(self.request), "wb", self.wbufsize)
@@ -147,13 +149,16 @@ class SecureServer():
 
 
 class XMLRPCHandler(SecureRequestHandler, BaseHTTPServer.BaseHTTPRequestHandler):
+	# keep connections open for further requests, errors close them
+	protocol_version = "HTTP/1.1"
+
 	def do_POST(self):
 		with self.server.wrapper:
 			credentials = self.getCredentials()
 			sslCert = self.getSSLCertificate()
 			if not self.server.checkAuth(credentials, sslCert):
 				self.send_error(403)
-				return self.finish()
+				return
 			(method, args, kwargs) = self.getRpcRequest()
 			func = self.server.findMethod(method)
 			if not func:
@@ -164,7 +169,7 @@ class XMLRPCHandler(SecureRequestHandler, BaseHTTPServer.BaseHTTPRequestHandler)
 				self.send((ret,))
 			except ErrorUnauthorized:
 				self.send_error(403 if (credentials or sslCert) else 401)
-				return self.finish()
+				return
 			except Exception, err:
 				if not isinstance(err, xmlrpclib.Fault):
 					err = xmlrpclib.Fault(-1, str(err))
@@ -190,7 +195,7 @@ class XMLRPCHandler(SecureRequestHandler, BaseHTTPServer.BaseHTTPRequestHandler)
 		self.send_header("Content-Type", "text/xml")
 		self.end_headers()
 		self.wfile.write(res)
-		self.finish()
+		self.wfile.flush()
 
 	def getRpcRequest(self):
 		length = int(self.headers.get("Content-Length", None))
@@ -221,6 +226,9 @@ class DummyWrapper:
 		pass
 
 class XMLRPCServer(SecureServer, SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	# threads of idle keep-alive connections must not block the shutdown
+	daemon_threads = True
+
 	def __init__(self, address, loginFunc=lambda u, p: True, sslOpts=False, wrapper=DummyWrapper(), beforeExecute=None, afterExecute=None,
 				 onError=None):
 		BaseHTTPServer.HTTPServer.__init__(self, address, XMLRPCHandler, bind_and_activate=not bool(sslOpts))
@@ -327,8 +335,17 @@ class XMLRPCServerIntrospection(XMLRPCServer):
 class ServerProxy(object):
 	def __init__(self, url, onError=(lambda x: x), **kwargs):
 		self._onError = onError
+		self._transport = kwargs.get("transport")
 		self._xmlrpc_server_proxy = xmlrpclib.ServerProxy(url, **kwargs)
 
+	def setTimeout(self, timeout):
+		"""
+		Sets the socket timeout of the following calls if the transport
+		supports it.
+		"""
+		if isinstance(self._transport, TimeoutTransport):
+			self._transport.timeout = timeout
+
 	def __getattr__(self, name):
 		call_proxy = getattr(self._xmlrpc_server_proxy, name)
 
@@ -4,12 +4,65 @@ Created on Jan 24, 2014
 @author: dswd
 '''
 
-import threading, time
+import threading, time, heapq, collections
 
 MAX_WAIT = 3600.0
+DEFAULT_CATEGORY = "default"
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+HISTOGRAM_WINDOW = 100
+
+class Histogram:
+	"""
+	Histogram of durations in seconds.
+	The bucket counts, the sum and the count are cumulative so that they can be
+	scraped by monitoring systems. The last samples are kept in a rolling
+	window to calculate current percentiles.
+	"""
+	def __init__(self, buckets=HISTOGRAM_BUCKETS, window=HISTOGRAM_WINDOW):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+		self.recent = collections.deque(maxlen=window)
+	def add(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				break
+		else:
+			i = len(self.buckets)
+		self.counts[i] += 1
+		self.sum += value
+		self.count += 1
+		self.recent.append(value)
+	def percentile(self, p):
+		if not self.recent:
+			return None
+		values = sorted(self.recent)
+		return values[min(int(len(values) * p), len(values) - 1)]
+	def cumulative(self):
+		res = []
+		total = 0
+		for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+			total += count
+			res.append((bound, total))
+		return res
+	def info(self):
+		return {
+			"buckets": [[str(bound), count] for bound, count in self.cumulative()],
+			"sum": self.sum,
+			"count": self.count,
+			"recent": {
+				"count": len(self.recent),
+				"avg": sum(self.recent) / len(self.recent) if self.recent else None,
+				"p50": self.percentile(0.5),
+				"p90": self.percentile(0.9),
+				"p99": self.percentile(0.99),
+				"max": max(self.recent) if self.recent else None
+			}
+		}
 
 class Task:
-	def __init__(self, fn, args=None, kwargs=None, timeout=0, repeated=False, immediate=False):
+	def __init__(self, fn, args=None, kwargs=None, timeout=0, repeated=False, immediate=False, category=None):
 		if not kwargs:
 			kwargs = {}
 		if not args:
@@ -19,19 +72,39 @@ class Task:
 		self.fn = fn
 		self.args = args
 		self.kwargs = kwargs
-		self.next = time.time() + (0 if immediate else timeout) 
+		self.next = time.time() + (0 if immediate else timeout)
 		self.busy = False
 		self.last = None
 		self.duration = None
+		self.stats = None
+		self.seq = None
+		self.category = category or DEFAULT_CATEGORY
+		self.skipped = False
+		self.key = None
+		self.runs = 0
+		self.errors = 0
+		self.latency = Histogram()
+		self.lateness = Histogram()
+	def skip(self):
+		self.skipped = True
+		self.next = time.time() + self.timeout
 	def execute(self):
 		start = time.time()
+		if self.next:
+			self.lateness.add(max(start - self.next, 0.0))
+		self.runs += 1
 		try:
-			self.fn(*self.args, **self.kwargs)
+			res = self.fn(*self.args, **self.kwargs)
+			# tasks can report statistics about their last run by returning a dict
+			self.stats = res if isinstance(res, dict) else None
 		except Exception:
+			self.errors += 1
 			import traceback
 			traceback.print_exc()
 		self.duration = time.time()-start
+		self.latency.add(self.duration)
 		self.last = self.next
+		self.skipped = False
 		if self.repeated:
 			self.next = time.time() + self.timeout
 		else:
@@ -40,18 +113,82 @@ class Task:
 		return {
 			"method": self.fn.__module__+"."+self.fn.__name__,
 			"busy": self.busy,
+			"category": self.category,
 			"args": [str(arg) for arg in self.args],
 			"kwargs": {name: str(value) for name, value in self.kwargs.items()},
 			"repeated": self.repeated,
 			"timeout": self.timeout,
 			"next": self.next,
 			"last": self.last,
-			"duration": self.duration
+			"duration": self.duration,
+			"stats": self.stats,
+			"runs": self.runs,
+			"errors": self.errors
+		}
+	def metrics(self):
+		return {
+			"method": self.fn.__module__+"."+self.fn.__name__,
+			"category": self.category,
+			"runs": self.runs,
+			"errors": self.errors,
+			"latency": self.latency.info(),
+			"lateness": self.lateness.info()
+		}
+
+class TaskCategory:
+	"""
+	A class of tasks that share a priority and a limit of concurrently running
+	tasks. When several tasks are due, tasks of the category with the highest
+	priority run first.
+	Repeated tasks that are more than maxLate seconds late are skipped once
+	instead of running late. Identical one-shot tasks that are waiting at the
+	same time are coalesced into one if coalesce is set.
+	"""
+	def __init__(self, name, priority=0, maxWorkers=None, maxLate=None, coalesce=False):
+		self.name = name
+		self.priority = priority
+		self.maxWorkers = maxWorkers
+		self.maxLate = maxLate
+		self.coalesce = coalesce
+		self.queue = [] #heap of (next, seq, taskId)
+		self.busy = 0
+		self.runs = 0
+		self.skipped = 0
+		self.coalesced = 0
+		self.lastLateness = None
+		self.maxLateness = 0.0
+	def isFull(self):
+		return bool(self.maxWorkers) and self.busy >= self.maxWorkers
+	def info(self):
+		return {
+			"priority": self.priority,
+			"max_workers": self.maxWorkers,
+			"max_late": self.maxLate,
+			"coalesce": self.coalesce,
+			"busy": self.busy,
+			"runs": self.runs,
+			"skipped": self.skipped,
+			"coalesced": self.coalesced,
+			"last_lateness": self.lastLateness,
+			"max_lateness": self.maxLateness
 		}
 
 class TaskScheduler(threading.Thread):
+	"""
+	Runs tasks on a dynamic pool of worker threads.
+	Tasks belong to categories (see TaskCategory) that are selected with the
+	category keyword argument of scheduleOnce and scheduleRepeated.
+	Tasks that are waiting to be executed are kept in one heap per category
+	ordered by their next execution time. Entries of canceled or rescheduled
+	tasks are not removed from the heaps but are skipped when they reach the top.
+	Busy tasks are not part of the heaps, they are tracked separately.
+	"""
 	def __init__(self, maxLateTime=2.0, maxWorkers=5, minWorkers=1):
 		self.tasks = {}
+		self.categories = {}
+		self.pendingOnce = {} #coalescing key -> taskId
+		self.busy = set()
+		self.seq = 0
 		self.tasksLock = threading.RLock()
 		self.nextId = 1
 		self.workers = 0
@@ -64,17 +201,84 @@ class TaskScheduler(threading.Thread):
 		self.maxWorkers = maxWorkers
 		self.minWorkers = minWorkers
 		self.waitFrac = 0.5
+		self.addCategory(DEFAULT_CATEGORY)
+	def addCategory(self, name, priority=0, maxWorkers=None, maxLate=None, coalesce=False):
+		with self.tasksLock:
+			cat = self._getCategory(name)
+			cat.priority = priority
+			cat.maxWorkers = maxWorkers
+			cat.maxLate = maxLate
+			cat.coalesce = coalesce
+			return cat
+	def _getCategory(self, name):
+		with self.tasksLock:
+			if not name in self.categories:
+				self.categories[name] = TaskCategory(name)
+			return self.categories[name]
+	def _enqueue(self, taskId, task):
+		# must be called with tasksLock held
+		self.seq += 1
+		task.seq = self.seq
+		heapq.heappush(self._getCategory(task.category).queue, (task.next, self.seq, taskId))
+	def _peek(self, cat):
+		# must be called with tasksLock held
+		while cat.queue:
+			_, seq, taskId = cat.queue[0]
+			task = self.tasks.get(taskId)
+			if task and task.seq == seq and not task.busy:
+				return (taskId, task)
+			# stale entry of a canceled, busy or rescheduled task
+			heapq.heappop(cat.queue)
+		return (None, None)
 	def _nextTask(self):
-		try:
-			with self.tasksLock:
-				availableTasks = filter(lambda (tid, task): not task.busy, self.tasks.items())
-				return min(availableTasks, key=lambda (tid, task): task.next)
-		except ValueError:
-			return (None, None)
+		with self.tasksLock:
+			now = time.time()
+			best = None
+			for cat in self.categories.values():
+				if cat.isFull():
+					continue
+				taskId, task = self._peek(cat)
+				if not task:
+					continue
+				# due tasks are ordered by priority first, waiting tasks only by time
+				due = task.next <= now
+				key = (not due, -cat.priority if due else 0, task.next)
+				if not best or key < best[0]:
+					best = (key, taskId, task)
+			return (best[1], best[2]) if best else (None, None)
 	def _waitTime(self):
 		with self.tasksLock:
 			_, nextTask = self._nextTask()
 			return min(nextTask.next - time.time(), MAX_WAIT) if nextTask else MAX_WAIT
+	def _popTask(self):
+		with self.tasksLock:
+			while True:
+				taskId, task = self._nextTask()
+				now = time.time()
+				if not task or task.next > now:
+					return (None, None)
+				cat = self.categories[task.category]
+				heapq.heappop(cat.queue)
+				lateness = now - task.next
+				if task.repeated and cat.maxLate is not None and lateness > cat.maxLate and not task.skipped:
+					# overloaded: skip this run instead of running late, but never twice in a row
+					cat.skipped += 1
+					task.skip()
+					self._enqueue(taskId, task)
+					continue
+				self._markBusy(taskId, task, lateness)
+				return (taskId, task)
+	def _markBusy(self, taskId, task, lateness):
+		# must be called with tasksLock held
+		cat = self.categories[task.category]
+		cat.busy += 1
+		cat.runs += 1
+		cat.lastLateness = lateness
+		cat.maxLateness = max(cat.maxLateness, lateness)
+		task.busy = True
+		self.busy.add(taskId)
+		if task.key and self.pendingOnce.get(task.key) == taskId:
+			del self.pendingOnce[task.key]
 	def _adaptWorkers(self, wait, mainThread):
 		with self.workersLock:
 			self.waitFrac *= 0.9
@@ -101,13 +305,30 @@ class TaskScheduler(threading.Thread):
 				self.wakeup.wait(wait)
 				if self.stopped:
 					break
-			taskId, _ = self._nextTask()
-			self.executeTask(taskId)
+			taskId, task = self._popTask()
+			if task:
+				self._runTask(taskId, task)
 		with self.workersLock:
 			self.waitFrac = 0.5
 			self.workers -= 1
-			if not self.workers:			
+			if not self.workers:
 				self.stopped_confirm.set()
+	def _runTask(self, taskId, task):
+		task.execute()
+		with self.tasksLock:
+			cat = self.categories[task.category]
+			wasFull = cat.isFull()
+			cat.busy -= 1
+			task.busy = False
+			self.busy.discard(taskId)
+			if not task.repeated:
+				self.tasks.pop(taskId, None)
+			elif taskId in self.tasks:
+				self._enqueue(taskId, task)
+		if wasFull:
+			# tasks of this category that are waiting for a free slot can run now
+			self.wakeup.set()
+			self.wakeup.clear()
 	def executeTask(self, taskId, force=False):
 		with self.tasksLock:
 			if not taskId in self.tasks:
@@ -117,12 +338,9 @@ class TaskScheduler(threading.Thread):
 				return
 			if task.busy:
 				return
-			task.busy = True
-		task.execute()
-		with self.tasksLock:
-			task.busy = False
-			if not task.repeated:
-				del self.tasks[taskId]
+			task.seq = None #invalidates the queue entry
+			self._markBusy(taskId, task, max(time.time() - task.next, 0.0))
+		self._runTask(taskId, task)
 		return True
 	def run(self):
 		with self.workersLock:
@@ -135,35 +353,104 @@ class TaskScheduler(threading.Thread):
 		self.stopped = True
 		self.wakeup.set()
 		self.stopped_confirm.wait()
+	def _coalescingKey(self, task):
+		try:
+			key = (task.fn, tuple(task.args), tuple(sorted(task.kwargs.items())))
+			hash(key)
+			return key
+		except TypeError:
+			return None
 	def _schedule(self, task):
-		taskid = self.nextId
-		self.tasks[taskid] = task
-		self.nextId += 1
+		with self.tasksLock:
+			cat = self._getCategory(task.category)
+			if not task.repeated and cat.coalesce:
+				task.key = self._coalescingKey(task)
+				if task.key in self.pendingOnce:
+					# an identical task is already waiting, it will do the work
+					cat.coalesced += 1
+					return self.pendingOnce[task.key]
+			taskid = self.nextId
+			self.tasks[taskid] = task
+			self.nextId += 1
+			if task.key:
+				self.pendingOnce[task.key] = taskid
+			self._enqueue(taskid, task)
 		self.wakeup.set()
 		self.wakeup.clear()
 		return taskid
 	def scheduleOnce(self, timeout, fn, *args, **kwargs):
-		return self._schedule(Task(fn, args, kwargs, timeout=timeout, repeated=False))
+		category = kwargs.pop("category", None)
+		return self._schedule(Task(fn, args, kwargs, timeout=timeout, repeated=False, category=category))
 	def scheduleRepeated(self, timeout, fn, *args, **kwargs):
 		#print "Ignoring task %s" % fn
 		#return
 		immediate = kwargs.pop("immediate", True)
-		return self._schedule(Task(fn, args, kwargs, timeout=timeout, repeated=True, immediate=immediate))
+		category = kwargs.pop("category", None)
+		return self._schedule(Task(fn, args, kwargs, timeout=timeout, repeated=True, immediate=immediate, category=category))
 	def cancelTask(self, taskId):
 		with self.tasksLock:
-			del self.tasks[taskId]
+			task = self.tasks.pop(taskId)
+			if task.key and self.pendingOnce.get(task.key) == taskId:
+				del self.pendingOnce[task.key]
 	def info(self):
 		tasks = []
+		categories = {}
 		with self.tasksLock:
+			now = time.time()
+			for name, cat in self.categories.items():
+				categories[name] = cat.info()
+				categories[name].update(queued=0, lateness=0.0)
 			for id_, t in self.tasks.items():
 				info = t.info()
 				info["id"] = id_
 				tasks.append(info)
+				if not t.busy:
+					catInfo = categories[t.category]
+					catInfo["queued"] += 1
+					catInfo["lateness"] = max(catInfo["lateness"], now - t.next)
+			busy = len(self.busy)
 		info = {
 			"tasks": tasks,
+			"categories": categories,
+			"busy": busy,
 			"max_late_time": self.maxLateTime,
 			"max_workers": self.maxWorkers,
 			"min_workers": self.minWorkers,
 			"workers": self.workers
 		}
 		return info
+	def metrics(self):
+		"""
+		Returns the runtime metrics of all repeated tasks by task id.
+		"""
+		with self.tasksLock:
+			return {str(id_): t.metrics() for id_, t in self.tasks.items() if t.repeated}
+	def metricsText(self, prefix="tomato_task"):
+		"""
+		Returns the runtime metrics of all repeated tasks in the Prometheus
+		text exposition format.
+		"""
+		lines = []
+		def labels(task, **extra):
+			values = [("method", task.fn.__module__+"."+task.fn.__name__), ("category", task.category)]
+			values += sorted(extra.items())
+			return "{" + ",".join('%s="%s"' % (k, v) for k, v in values) + "}"
+		with self.tasksLock:
+			tasks = [t for t in self.tasks.values() if t.repeated]
+			for name, typ, help_ in [("runs_total", "counter", "Number of task runs"),
+									 ("errors_total", "counter", "Number of task runs that raised an exception")]:
+				lines.append("# HELP %s_%s %s" % (prefix, name, help_))
+				lines.append("# TYPE %s_%s %s" % (prefix, name, typ))
+				for t in tasks:
+					lines.append("%s_%s%s %d" % (prefix, name, labels(t), t.runs if name == "runs_total" else t.errors))
+			for name, help_ in [("latency_seconds", "Duration of task runs"),
+								("lateness_seconds", "Delay between planned and actual start of task runs")]:
+				lines.append("# HELP %s_%s %s" % (prefix, name, help_))
+				lines.append("# TYPE %s_%s histogram" % (prefix, name))
+				for t in tasks:
+					hist = t.latency if name == "latency_seconds" else t.lateness
+					for bound, count in hist.cumulative():
+						lines.append("%s_%s_bucket%s %d" % (prefix, name, labels(t, le=bound), count))
+					lines.append("%s_%s_sum%s %f" % (prefix, name, labels(t), hist.sum))
+					lines.append("%s_%s_count%s %d" % (prefix, name, labels(t), hist.count))
+		return "\n".join(lines) + "\n"
@@ -17,7 +17,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 from django.shortcuts import render
-from lib import wrap_rpc
+from django.http import HttpResponse
+from lib import wrap_rpc, pools, cache
+from lib.rpcpool import metrics, viewMetrics
+from lib.error import UserError #@UnresolvedImport
 
 @wrap_rpc
 def host_users(api, request, name):
@@ -43,3 +46,20 @@ def connection(api, request, id):
 def stats(api, request):
 	stats = api.debug_stats()
 	return render(request, "debug/stats.html", {'stats': stats})
+
+@wrap_rpc
+def task_metrics(api, request):
+	return HttpResponse(api.task_metrics("text"), content_type="text/plain; version=0.0.4")
+
+@wrap_rpc
+def api_metrics(api, request):
+	if not api.user or not api.user.hasDebugFlag():
+		raise UserError(code=UserError.DENIED, message="Not enough permissions")
+	text = metrics.text() + viewMetrics.text()
+	text += "# HELP tomato_web_api_connects_total Number of backend connections that have been opened\n"
+	text += "# TYPE tomato_web_api_connects_total counter\n"
+	text += "tomato_web_api_connects_total %d\n" % pools.info()["connects"]
+	for name in ["hits", "misses", "invalidations"]:
+		text += "# TYPE tomato_web_cache_%s_total counter\n" % name
+		text += "tomato_web_cache_%s_total %d\n" % (name, cache.info()[name])
+	return HttpResponse(text, content_type="text/plain; version=0.0.4")
@@ -17,11 +17,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 from django.http import HttpResponse
-import xmlrpclib, urllib, hashlib
+import xmlrpclib, urllib, hashlib, time
 from . import anyjson as json
 from .. import settings
 from .error import Error  # @UnresolvedImport
 from .handleerror import renderError, ajaxError, renderFault, ajaxFault
+from .rpcpool import PoolRegistry, viewMetrics
+from .cache import Cache, LocalBackend, DjangoBackend
+
+# backend connections shared by all requests
+pools = PoolRegistry(maxPools=settings.server_pools, maxCalls=settings.server_max_calls,
+					 maxIdle=settings.server_max_idle, maxWait=settings.server_max_wait)
 
 
 def getauth(request):
@@ -32,29 +38,53 @@ def getauth(request):
 	return (username, password)
 
 
-class CachedMethod:
-	def __init__(self, timeout, fn):
-		self.timeout = timeout
-		self.fn = fn
-		self.time = None
-		self.cache = None
-		self.__name__ = fn.__name__
-		self.__doc__ = fn.__doc__
-
-	def __call__(self, *args, **kwargs):
-		import time
-		if self.time and self.time + self.timeout > time.time():
-			return self.cache
-		self.cache = self.fn(*args, **kwargs)
-		self.time = time.time()
-		return self.cache
-
-
-def cached(timeout):
+def _createCache():
+	if settings.web_cache:
+		return Cache(DjangoBackend(settings.web_cache))
+	return Cache(LocalBackend(settings.web_cache_size))
+
+cache = _createCache()
+
+# verbs of API methods (<entity>_<verb>) that change the entity
+MUTATING_VERBS = ["create", "modify", "remove", "action", "permission"]
+# cache tags that also have to be invalidated when an entity changes
+RELATED_TAGS = {
+	"template": ["resources"],
+	"profile": ["resources"],
+	"network": ["resources"],
+	"host": ["capabilities"],
+	"organization": ["site"]
+}
+
+
+def invalidate(method, args=()):
+	"""
+	Invalidates the cache entries that depend on the entity changed by the
+	API method, i.e. the tags <entity>, <entity>:<first argument> and the
+	related tags of the entity.
+	"""
+	if not "_" in method:
+		return
+	entity, verb = method.rsplit("_", 1)
+	if not verb in MUTATING_VERBS:
+		return
+	tags = [entity] + RELATED_TAGS.get(entity, [])
+	if args:
+		tags.append("%s:%s" % (entity, args[0]))
+	cache.invalidate(*tags)
+
+
+def cached(timeout, tags=()):
+	"""
+	Caches the results of the function by its arguments for timeout seconds.
+	"""
 	def wrap(fn):
-		_cache = None
-		_time = None
-		return CachedMethod(timeout, fn)
+		name = "%s.%s" % (fn.__module__, fn.__name__)
+		def call(*args, **kwargs):
+			return cache.get((name, args, sorted(kwargs.items())), lambda: fn(*args, **kwargs), timeout, tags)
+		call.__name__ = fn.__name__
+		call.__doc__ = fn.__doc__
+		return call
 
 	return wrap
 
@@ -64,21 +94,14 @@ class AuthError(Exception):
 
 
 class ServerProxy(object):
-	def __init__(self, url, **kwargs):
-		self._xmlrpc_server_proxy = xmlrpclib.ServerProxy(url, **kwargs)
+	def __init__(self, url):
+		self._pool = pools.get(url)
 
 	def __getattr__(self, name):
-		call_proxy = getattr(self._xmlrpc_server_proxy, name)
-
 		def _call(*args, **kwargs):
-			import time
-			before = time.time()
 			try:
-				# print "%s(%s, %s)" % (name, args, kwargs)
-				res = call_proxy(args, kwargs)
-				after = time.time()
-				# print "%f, %s(%s, %s) -> %s" % (after-before, name, args, kwargs, res)
-				print "%f, %s(%s, %s)" % (after - before, name, args, kwargs)
+				res = self._pool.call(name, args, kwargs)
+				invalidate(name, args)
 				return res
 			except xmlrpclib.Fault, e:
 				if e.faultCode == 999:
@@ -88,6 +111,59 @@ class ServerProxy(object):
 
 		return _call
 
+	def multicall(self, *calls):
+		"""
+		Executes the calls given as (method, args, kwargs) tuples in one round
+		trip and returns their results. The first failed call raises its error.
+		"""
+		results = []
+		for res in self._pool.multicall(calls):
+			if isinstance(res, dict):
+				if res["faultCode"] == 999:
+					raise Error.parsestr(res["faultString"])
+				raise xmlrpclib.Fault(res["faultCode"], res["faultString"])
+			results.append(res[0])
+		return results
+
+
+def batch(api, calls, shared=()):
+	"""
+	Executes the calls given as (method, args, kwargs) tuples in one round
+	trip and returns their results. The results of the methods in shared do
+	not depend on the user, they are cached for all users for
+	settings.shared_cache_timeout seconds.
+	"""
+	results = [None] * len(calls)
+	missing = []
+	keys = {}
+	for i, (method, args, kwargs) in enumerate(calls):
+		if method in shared:
+			keys[i] = cache.key(("shared", method, args, sorted(kwargs.items())), tags=[method.split("_")[0]])
+			found, results[i] = cache.lookup(keys[i])
+			if found:
+				continue
+		missing.append(i)
+	if missing:
+		for i, res in zip(missing, api.multicall(*[calls[i] for i in missing])):
+			results[i] = res
+			if i in keys:
+				cache.store(keys[i], res, settings.shared_cache_timeout)
+	return results
+
+
+class ViewMetricsMiddleware:
+	"""
+	Records the latency of every view in viewMetrics.
+	"""
+	def process_view(self, request, view_func, view_args, view_kwargs):
+		request._viewName = "%s.%s" % (view_func.__module__, getattr(view_func, "__name__", view_func.__class__.__name__))
+		request._viewStart = time.time()
+
+	def process_response(self, request, response):
+		if hasattr(request, "_viewStart"):
+			viewMetrics.add(request._viewName, time.time() - request._viewStart, error=response.status_code >= 500)
+		return response
+
 
 def getapi(request=None):
 	auth = None
@@ -100,17 +176,15 @@ def getapi(request=None):
 	try:
 		if auth:
 			api = ServerProxy('%s://%s:%s@%s:%s' % (
-			settings.server_protocol, username, password, settings.server_host, settings.server_port), allow_none=True)
-			api.user = UserObj(api)
+			settings.server_protocol, username, password, settings.server_host, settings.server_port))
+			api.user = UserObj(api, request)
 		else:
-			api = ServerProxy('%s://%s:%s' % (settings.server_protocol, settings.server_host, settings.server_port),
-				allow_none=True)
+			api = ServerProxy('%s://%s:%s' % (settings.server_protocol, settings.server_host, settings.server_port))
 			api.user = None
 	except:
 		import traceback
 		traceback.print_exc()
-		api = ServerProxy('%s://%s:%s' % (settings.server_protocol, settings.server_host, settings.server_port),
-			allow_none=True)
+		api = ServerProxy('%s://%s:%s' % (settings.server_protocol, settings.server_host, settings.server_port))
 		api.user = None
 	if request:
 		request.session.user = api.user
@@ -220,9 +294,23 @@ def security_token(data, session=""):
 	return hashlib.md5("%s|%s|%s" % (data, session, settings.SECRET_KEY)).hexdigest()
 
 
+def getAccountInfo(api, request=None):
+	"""
+	Returns the account info of the logged in user, cached per session for
+	settings.account_info_timeout seconds.
+	"""
+	key = request.session.session_key if request else None
+	if not key:
+		return api.account_info()
+	username, _ = getauth(request)
+	auth = hashlib.sha1(request.session["auth"]).hexdigest()
+	return cache.get(("account_info", key, auth), api.account_info, settings.account_info_timeout,
+					 tags=["account:%s" % username])
+
+
 class UserObj:
-	def __init__(self, api):
-		self.data = api.account_info()
+	def __init__(self, api, request=None):
+		self.data = getAccountInfo(api, request)
 		self.name = self.data["name"]
 		self.flags = self.data["flags"]
 		self.origin = self.data["origin"]
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import threading, time, hashlib, collections, itertools, os
+
+TAG_TIMEOUT = 30 * 24 * 3600
+
+
+class LocalBackend:
+	"""
+	In-process LRU dict, entries are not shared between worker processes.
+	"""
+	def __init__(self, maxSize=1000):
+		self.maxSize = maxSize
+		self.lock = threading.Lock()
+		self.entries = collections.OrderedDict() # key -> (expires, value)
+
+	def get(self, key):
+		with self.lock:
+			entry = self.entries.pop(key, None)
+			if entry is None:
+				return None
+			if entry[0] < time.time():
+				return None
+			self.entries[key] = entry
+			return entry[1]
+
+	def set(self, key, value, timeout):
+		with self.lock:
+			self.entries.pop(key, None)
+			self.entries[key] = (time.time() + timeout, value)
+			while len(self.entries) > self.maxSize:
+				self.entries.popitem(last=False)
+
+	def delete(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+	def info(self):
+		with self.lock:
+			return {"type": "local", "entries": len(self.entries), "max_size": self.maxSize}
+
+
+class DjangoBackend:
+	"""
+	A cache configured in settings.CACHES, e.g. memcached or a file based
+	cache, so that all worker processes share the entries.
+	"""
+	def __init__(self, alias="default"):
+		try:
+			from django.core.cache import caches
+			self.cache = caches[alias]
+		except ImportError: # Django < 1.7
+			from django.core.cache import get_cache
+			self.cache = get_cache(alias)
+		self.alias = alias
+
+	def get(self, key):
+		return self.cache.get(key)
+
+	def set(self, key, value, timeout):
+		self.cache.set(key, value, timeout)
+
+	def delete(self, key):
+		self.cache.delete(key)
+
+	def info(self):
+		return {"type": "django", "alias": self.alias}
+
+
+class Cache:
+	"""
+	Keyed cache with a timeout per entry on top of a backend.
+	Entries can be tagged (e.g. "topology:<id>"), invalidating a tag makes
+	all entries with that tag stale. Every tag has a version that is part of
+	the key of its entries, so this works with any backend.
+	"""
+	def __init__(self, backend, prefix="tomato_web"):
+		self.backend = backend
+		self.prefix = prefix
+		self.hits = 0
+		self.misses = 0
+		self.invalidations = 0
+		self._counter = itertools.count()
+
+	def _tagKey(self, tag):
+		return "%s:tag:%s" % (self.prefix, hashlib.sha1(tag).hexdigest())
+
+	def _newVersion(self, tag):
+		version = "%f-%d-%d" % (time.time(), os.getpid(), next(self._counter))
+		self.backend.set(self._tagKey(tag), version, TAG_TIMEOUT)
+		return version
+
+	def key(self, key, tags=()):
+		"""
+		Returns the backend key for the key with the current versions of the
+		tags. Values must be stored with the backend key that was used for
+		the lookup, so they are stale if a tag is invalidated meanwhile.
+		"""
+		# a tag without version (new or evicted) gets a new one, so entries of
+		# an evicted tag can not become valid again
+		versions = [self.backend.get(self._tagKey(tag)) or self._newVersion(tag) for tag in tags]
+		return "%s:%s" % (self.prefix, hashlib.sha1(repr((key, versions))).hexdigest())
+
+	def lookup(self, backendKey):
+		"""
+		Returns (True, value) if the backend key is cached or (False, None).
+		"""
+		entry = self.backend.get(backendKey)
+		if entry is None:
+			self.misses += 1
+			return (False, None)
+		self.hits += 1
+		return (True, entry[0])
+
+	def store(self, backendKey, value, timeout):
+		self.backend.set(backendKey, (value,), timeout)
+
+	def get(self, key, fn, timeout, tags=()):
+		"""
+		Returns the cached value of the key or caches the result of fn().
+		"""
+		backendKey = self.key(key, tags)
+		found, value = self.lookup(backendKey)
+		if not found:
+			value = fn()
+			self.store(backendKey, value, timeout)
+		return value
+
+	def invalidate(self, *tags):
+		for tag in tags:
+			self._newVersion(tag)
+		self.invalidations += len(tags)
+
+	def info(self):
+		return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+				"backend": self.backend.info()}
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# ToMaTo (Topology management software)
+# Copyright (C) 2010 Dennis Schwerdel, University of Kaiserslautern
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import xmlrpclib, threading, time, collections, socket
+from .tasks import Histogram
+
+
+class LatencyMetrics:
+	"""
+	Latency histograms and error counts by name (e.g. API method or view).
+	"""
+	def __init__(self, label, prefix, description):
+		self.label = label
+		self.prefix = prefix
+		self.description = description
+		self.lock = threading.Lock()
+		self.latency = {}
+		self.errors = {}
+
+	def add(self, name, duration, error=False):
+		with self.lock:
+			if not name in self.latency:
+				self.latency[name] = Histogram()
+				self.errors[name] = 0
+			self.latency[name].add(duration)
+			if error:
+				self.errors[name] += 1
+
+	def info(self):
+		with self.lock:
+			return {name: {"latency": hist.info(), "errors": self.errors[name]} for name, hist in self.latency.items()}
+
+	def text(self):
+		"""
+		Returns the metrics in the Prometheus text exposition format.
+		"""
+		prefix, label = self.prefix, self.label
+		lines = []
+		with self.lock:
+			names = sorted(self.latency.keys())
+			lines.append("# HELP %s_errors_total Number of failed %ss" % (prefix, self.description))
+			lines.append("# TYPE %s_errors_total counter" % prefix)
+			for name in names:
+				lines.append('%s_errors_total{%s="%s"} %d' % (prefix, label, name, self.errors[name]))
+			lines.append("# HELP %s_latency_seconds Duration of %ss" % (prefix, self.description))
+			lines.append("# TYPE %s_latency_seconds histogram" % prefix)
+			for name in names:
+				hist = self.latency[name]
+				for bound, count in hist.cumulative():
+					lines.append('%s_latency_seconds_bucket{%s="%s",le="%s"} %d' % (prefix, label, name, bound, count))
+				lines.append('%s_latency_seconds_sum{%s="%s"} %f' % (prefix, label, name, hist.sum))
+				lines.append('%s_latency_seconds_count{%s="%s"} %d' % (prefix, label, name, hist.count))
+		return "\n".join(lines) + "\n"
+
+metrics = LatencyMetrics("method", "tomato_web_api", "backend API call")
+viewMetrics = LatencyMetrics("view", "tomato_web_view", "page load")
+
+
+class ConnectionPool:
+	"""
+	Keep-alive connections to one backend URL (including the credentials).
+	Each call uses an idle connection or opens a new one, the most recently
+	used connection is reused first so that the calls of one request share a
+	connection. At most maxCalls calls run concurrently, further calls wait
+	up to maxWait seconds for a free slot. Connections that were idle for
+	more than maxIdle seconds are closed.
+	"""
+	def __init__(self, url, maxCalls=4, maxIdle=60.0, maxWait=30.0):
+		self.url = url
+		self.maxCalls = maxCalls
+		self.maxIdle = maxIdle
+		self.maxWait = maxWait
+		self.lock = threading.Lock()
+		self.cond = threading.Condition(self.lock)
+		self.running = 0
+		self.idle = [] # (last used, proxy)
+		self.connects = 0
+		self.calls = 0
+		self.timeouts = 0
+
+	def _connect(self):
+		if self.url.startswith("https:"):
+			transport = xmlrpclib.SafeTransport()
+		else:
+			transport = xmlrpclib.Transport()
+		return xmlrpclib.ServerProxy(self.url, transport=transport, allow_none=True)
+
+	def _acquire(self):
+		with self.lock:
+			end = time.time() + self.maxWait
+			while self.running >= self.maxCalls:
+				remaining = end - time.time()
+				if remaining <= 0:
+					self.timeouts += 1
+					raise socket.timeout("Timeout waiting for a backend connection")
+				self.cond.wait(remaining)
+			self.running += 1
+			self.calls += 1
+			limit = time.time() - self.maxIdle
+			while self.idle:
+				lastUsed, proxy = self.idle.pop()
+				if lastUsed > limit:
+					return proxy
+				proxy("close")()
+			self.connects += 1
+		return self._connect()
+
+	def _release(self, proxy, broken):
+		with self.lock:
+			if broken:
+				proxy("close")()
+			else:
+				self.idle.append((time.time(), proxy))
+			self.running -= 1
+			self.cond.notify()
+
+	def call(self, method, args, kwargs):
+		proxy = self._acquire()
+		broken = error = True
+		start = time.time()
+		try:
+			res = getattr(proxy, method)(args, kwargs)
+			broken = error = False
+			return res
+		except xmlrpclib.Fault:
+			broken = False
+			raise
+		finally:
+			self._release(proxy, broken)
+			metrics.add(method, time.time() - start, error=error)
+
+	def multicall(self, calls):
+		"""
+		Executes a list of calls given as (method, args, kwargs) tuples with
+		one system.multicall and returns the list of responses, i.e. [result]
+		or a fault dict for each call.
+		"""
+		proxy = self._acquire()
+		broken = error = True
+		start = time.time()
+		try:
+			res = getattr(proxy, "system.multicall")([{"methodName": method, "params": [list(args), kwargs]} for (method, args, kwargs) in calls])
+			broken = error = False
+			return res
+		except xmlrpclib.Fault:
+			broken = False
+			raise
+		finally:
+			self._release(proxy, broken)
+			metrics.add("system.multicall", time.time() - start, error=error)
+
+	def close(self):
+		with self.lock:
+			for _, proxy in self.idle:
+				proxy("close")()
+			self.idle = []
+
+	def info(self):
+		with self.lock:
+			return {"idle": len(self.idle), "connects": self.connects, "calls": self.calls, "timeouts": self.timeouts}
+
+
+class PoolRegistry:
+	"""
+	Connection pools by URL, the least recently used pools are closed when
+	there are more than maxPools.
+	"""
+	def __init__(self, maxPools=100, **poolArgs):
+		self.maxPools = maxPools
+		self.poolArgs = poolArgs
+		self.lock = threading.Lock()
+		self.pools = collections.OrderedDict()
+
+	def get(self, url):
+		with self.lock:
+			pool = self.pools.pop(url, None)
+			if not pool:
+				pool = ConnectionPool(url, **self.poolArgs)
+			self.pools[url] = pool
+			while len(self.pools) > self.maxPools:
+				_, old = self.pools.popitem(last=False)
+				old.close()
+			return pool
+
+	def info(self):
+		with self.lock:
+			pools = self.pools.values()
+		infos = [pool.info() for pool in pools]
+		return {
+			"pools": len(pools),
+			"idle": sum(info["idle"] for info in infos),
+			"connects": sum(info["connects"] for info in infos),
+			"calls": sum(info["calls"] for info in infos),
+			"timeouts": sum(info["timeouts"] for info in infos)
+		}
@@ -60,6 +60,7 @@ MIDDLEWARE_CLASSES = (
 	'django.middleware.common.CommonMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
 	'django.contrib.auth.middleware.AuthenticationMiddleware',
+	'tomato.lib.ViewMetricsMiddleware',
 )
 
 AUTHENTICATION_BACKENDS = ('django.contrib.auth.backends.RemoteUserAuthBackend',)
@@ -104,6 +105,23 @@ if "BACKEND_PORT_8000_TCP" in os.environ:
 	server_host = os.getenv('BACKEND_PORT_8000_TCP_ADDR')
 	server_port = os.getenv('BACKEND_PORT_8000_TCP_PORT')
 
+# persistent backend connections: number of pools (one per user), concurrent
+# calls per pool, seconds after which idle connections are closed and seconds
+# that a call waits for a free slot
+server_pools = 100
+server_max_calls = 4
+server_max_idle = 60.0
+server_max_wait = 30.0
+# seconds for which user-independent backend results are shared by all users
+shared_cache_timeout = 60
+# seconds for which the account info is cached per session
+account_info_timeout = 60
+# cache for backend results: None for a cache in each process with at most
+# web_cache_size entries or the name of a cache in CACHES (e.g. memcached) to
+# share it between all worker processes
+web_cache = None
+web_cache_size = 1000
+
 server_httprealm = "G-Lab ToMaTo"
 tutorial_list_url = "http://packages.tomato-lab.org/tutorials/index.json"
 
@@ -20,11 +20,11 @@ from django.shortcuts import render, redirect
 from django import forms
 from django.http import HttpResponse
 
-import re, time
+import re, time, copy
 from .lib import anyjson as json
 
 from tutorial import loadTutorial
-from lib import wrap_rpc, AuthError, serverInfo
+from lib import wrap_rpc, AuthError, serverInfo, batch
 
 from admin_common import BootstrapForm, Buttons
 from tomato.crispy_forms.layout import Layout
@@ -69,11 +69,12 @@ def list(api, request, show_all=False, organization=None):
 
 
 def _display(api, request, info, tutorial_state):
-	caps = api.capabilities()
-	resources = api.resources_map()
-	sites = api.site_list()
-	permission_list = api.topology_permissions()
-	orgas = dict([(o["name"], o) for o in api.organization_list()])
+	caps, resources, sites, permission_list, orgas = batch(api, [
+		("capabilities", (), {}), ("resources_map", (), {}), ("site_list", (), {}),
+		("topology_permissions", (), {}), ("organization_list", (), {})
+	], shared=["capabilities", "resources_map", "site_list"])
+	orgas = dict([(o["name"], o) for o in orgas])
+	sites = copy.deepcopy(sites)
 	for s in sites:
 		orga = orgas[s['organization']]
 		del s['organization']
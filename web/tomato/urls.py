@@ -149,6 +149,8 @@ urlpatterns = patterns('',
 	(r'^debug/element/(?P<id>\w{24})$', 'tomato.debug.element'),
 	(r'^debug/connection/(?P<id>\w{24})$', 'tomato.debug.connection'),
 	(r'^debug/stats$', 'tomato.debug.stats'),
+	(r'^debug/task_metrics$', 'tomato.debug.task_metrics'),
+	(r'^debug/api_metrics$', 'tomato.debug.api_metrics'),
     url(r'^dumpmanager/$',  'tomato.dumpmanager.group_list',name='errorgroup_list'),
     (r'^dumpmanager/refresh$', 'tomato.dumpmanager.refresh'),
     (r'^dumpmanager/group/(?P<group_id>\w+)$', 'tomato.dumpmanager.group_info'),